@@ -1,37 +1,192 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import logging
-
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable
+from telegram import Update
 from telegram.ext import Dispatcher
 from telegram.ext import Updater
+from exceptions import MissingConfigParameterError
 from modules.events.event_command import EventCommand
-from modules.events.event_inline import EventInline
+from modules.events.event_inline import INLINE_CACHE_SIZE, AsyncEventInline, EventInline, render_cache
+from modules.events.event_repository import EventRepository
+from modules.events.reminder_repository import ReminderRepository
+from modules.events.sqlite_event_repository import SqliteEventRepository
+from modules.events.sqlite_reminder_repository import SqliteReminderRepository
+from services import log, metrics
+from services.aio import AsyncPolling
+from services.outbound import EditCoalescer, OutboundQueue
+from services.processes import ProcessRouter, sender_key, serve, worker_of
+from services.session import SessionStore
 from services.util import *
-
-# Set up logging config used by python-telegram-bot
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+from services.webhook import WebhookServer
 
 
-# Load all handlers of specific module
+# Load all handlers of specific module, timed by the metrics and tagging their log records
 def load_modules(dispatcher: Dispatcher, modules: list):
     for module in modules:
         for handler in module.get_handlers():
-            dispatcher.add_handler(handler)
+            name = type(module).__name__
+            dispatcher.add_handler(metrics.instrument_handler(log.tag_handler(handler, name), name))
+
+
+def setup(updater: Updater, mode: str, executor: ThreadPoolExecutor = None, worker: int = None,
+          processes: int = 1) -> (EventCommand, SessionStore):
+    """Storage, outbound queue, modules and metrics of a process: the only one, or `worker` of `processes`"""
+    dispatcher = updater.dispatcher
+    throttling = config.get('throttling') or {}
+
+    # One repository for the whole process, shared by every module; past events are moved to the archive
+    archive = config.get('archive') or {}
+    storage = config.get('storage') or {}
+    if storage.get('backend', 'tinydb') == 'sqlite':
+        event_repository = SqliteEventRepository()
+        reminders = SqliteReminderRepository()
+    else:
+        event_repository = EventRepository(archive_after=archive.get('after'), shards=storage.get('shards', 1))
+        reminders = ReminderRepository()
+        if archive.get('after') is not None:
+            event_repository.archive_periodically(archive.get('interval', 3600))
+
+    # Every module sends through the same queue, within Telegram's rate limits (shared by the processes)
+    outbound = OutboundQueue(throttling.get('global_rate', 30) / processes,
+                             throttling.get('chat_rate', 1),
+                             throttling.get('workers', 2))
+    coalescer = EditCoalescer(outbound, throttling.get('edit_window', 1.0))
+
+    # Drafts of the /create wizard live in memory, optionally checkpointed across restarts
+    drafts = config.get('drafts') or {}
+    checkpoint = drafts.get('checkpoint')
+    if checkpoint and worker is not None:
+        checkpoint = '{}.{}'.format(checkpoint, worker)
+    draft_store = SessionStore(drafts.get('capacity', 1024), drafts.get('ttl', 86400), checkpoint,
+                               encode=EventCommand.encode_draft, decode=EventCommand.decode_draft)
+
+    event_command = EventCommand(config['permissions']['events'], event_repository, outbound,
+                                 reminders=reminders, drafts=draft_store)
+
+    # Answers cached by a process are not invalidated by the writes of the others
+    answer_cache_size = INLINE_CACHE_SIZE if processes == 1 else 0
+    if mode == 'asyncio':
+        event_inline = AsyncEventInline(config['permissions']['events'], event_repository, coalescer, outbound,
+                                        executor, answer_cache_size)
+    else:
+        event_inline = EventInline(config['permissions']['events'], event_repository, coalescer, outbound,
+                                   answer_cache_size)
+
+    load_modules(dispatcher, [event_command, event_inline])
+
+    # Storage latency, queues and caches on the metrics endpoint (or in the log)
+    for repository in (event_repository, event_repository.users, event_command.reminders):
+        metrics.instrument_repository(repository)
+
+    metrics.watch_queue('outbound', outbound.stats)
+    if isinstance(event_repository, EventRepository):
+        metrics.watch_cache('event_queries', event_repository.query_cache)
+        metrics.watch_cache('attendance', event_repository.attendance)
+    metrics.watch_cache('inline_answers', event_inline.answer_cache)
+    metrics.watch_cache('rendered_events', render_cache)
+    metrics.registry.gauge('reminders_scheduled', 'Reminders waiting for their time').watch(
+        (), lambda: len(event_command.scheduler))
+    metrics.registry.gauge('drafts', 'Events being created').watch((), lambda: len(draft_store))
+    start_metrics(worker)
+
+    return event_command, draft_store
+
+
+def start_metrics(worker: int = None):
+    # Each worker process serves its own metrics, on the ports following the one of the ingress
+    settings = config.get('metrics') or {}
+    if settings.get('port'):
+        port = settings['port'] + (worker + 1 if worker is not None else 0)
+        metrics.MetricsServer(settings.get('listen', '127.0.0.1'), port).start()
+    if settings.get('dump_interval'):
+        metrics.dump_periodically(settings['dump_interval'])
+
+
+def route(update: Update) -> Hashable:
+    # RSVP clicks go to the worker of the event, whoever clicked: its edits are coalesced and ordered there
+    if update.callback_query is not None:
+        try:
+            return 'event', EventInline.parse_callback(update.callback_query)[0]
+        except ValueError:
+            pass
+
+    # Everything else to the worker of the user, holding their conversation
+    return sender_key(update)
+
+
+def worker_main(worker: int, updates):
+    """Entry point of a worker process of the multi-process mode"""
+    log_listener = log.setup(config.get('logging') or {})
+    processes = config['telegram']['processes']
+
+    updater = Updater(config['telegram']['token'], workers=config['telegram'].get('workers', 4))
+    (event_command, draft_store) = setup(updater, 'polling', worker=worker, processes=processes)
+
+    # The reminders are shared: each worker sends the ones of its users
+    event_command.start(updater.bot, lambda reminder: worker_of(reminder.user_id, processes) == worker)
+
+    try:
+        serve(updater.dispatcher, updates)
+    finally:
+        draft_store.close()
+        log_listener.stop()
 
 
 def main():
-    updater = Updater(config['telegram']['token'])
+    # Records are written by a thread of their own, python-telegram-bot's included
+    log_listener = log.setup(config.get('logging') or {})
+
+    mode = config['telegram'].get('mode', 'polling')
+    workers = config['telegram'].get('workers', 4)
+    processes = config['telegram'].get('processes', 1)
+    throttling = config.get('throttling') or {}
+
+    # A single HTTP connection pool for every Bot API call: handlers, outbound queue and polling
+    updater = Updater(config['telegram']['token'], workers=workers,
+                      request_kwargs={'con_pool_size': workers + throttling.get('workers', 2) + 4})
     dispatcher = updater.dispatcher
+    executor = ThreadPoolExecutor(workers) if mode == 'asyncio' else None
+
+    if processes > 1:
+        if (config.get('storage') or {}).get('backend') != 'sqlite':
+            raise MissingConfigParameterError('More than one process needs \'backend: sqlite\' in \'storage\'')
+
+        # This process only receives the updates, the workers handle them
+        dispatcher = ProcessRouter(updater.bot, processes, worker_main, route)
+        dispatcher.start()
+        metrics.watch_queue('workers', dispatcher.stats)
+        start_metrics()
+    else:
+        (event_command, draft_store) = setup(updater, mode, executor)
+
+        # Reminders and drafts of the previous runs start again
+        event_command.start(updater.bot)
+
+    try:
+        if mode == 'asyncio' and processes == 1:
+            AsyncPolling(dispatcher, executor, config['telegram'].get('concurrency', 1000)).start()
+        elif mode == 'webhook':
+            webhook = config['telegram']['webhook']
+            server = WebhookServer(dispatcher, webhook.get('listen', '127.0.0.1'), webhook.get('port', 8443),
+                                   webhook.get('path', '/'), workers, webhook.get('queue_size', 1000))
 
-    load_modules(dispatcher,
-                 [
-                     EventCommand(config['permissions']['events']),
-                     EventInline(config['permissions']['events'])
-                 ])
+            metrics.watch_queue('webhook', server.stats)
 
-    updater.start_polling()
-    updater.idle()
+            updater.bot.setWebhook(url=webhook['url'])
+            server.start()
+        elif processes > 1:
+            dispatcher.poll()
+        else:
+            updater.start_polling()
+            updater.idle()
+    finally:
+        if processes > 1:
+            dispatcher.stop()
+        else:
+            draft_store.close()
+        log_listener.stop()
 
 
 if __name__ == '__main__':
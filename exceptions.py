@@ -24,3 +24,7 @@ class MissingValueError(MarvinDefaultError):
 
 class NoDraftExistError(MarvinDefaultError):
     pass
+
+
+class StorageInUseError(MarvinDefaultError):
+    pass
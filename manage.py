@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import datetime
+import gzip
+import logging
+import os
+import sys
+
+import ruamel.yaml as yaml
+
+from modules.events import event_repository
+from modules.events.event_repository import EventRepository
+from modules.events.event_transfer import export_events, import_events, matches
+from modules.events.sqlite_event_repository import SqliteEventRepository, migrate
+from modules.events.sqlite_reminder_repository import SqliteReminderRepository
+from services.journal import JournalDB
+
+
+def migrate_command(arguments: argparse.Namespace):
+    repository = SqliteEventRepository(arguments.data_dir)
+    reminders = SqliteReminderRepository(arguments.data_dir)
+
+    try:
+        copied = migrate(arguments.data_dir, repository, reminders, arguments.batch_size)
+    finally:
+        repository.close()
+        reminders.close()
+
+    print('{events} events, {users} profiles and {reminders} reminders copied into {path}'.format(
+        path=repository.path, **copied))
+
+
+def export_command(arguments: argparse.Namespace):
+    filters = {
+        'user_id': arguments.user_id,
+        'since': arguments.since,
+        'until': arguments.until,
+        'drafts': {'include': None, 'only': True, 'exclude': False}[arguments.drafts],
+    }
+
+    if arguments.output == '-':
+        output = sys.stdout
+    elif arguments.output.endswith('.gz'):
+        output = gzip.open(arguments.output, 'wt', encoding='utf-8')
+    else:
+        output = open(arguments.output, 'w', encoding='utf-8')
+
+    try:
+        if arguments.backend == 'sqlite':
+            repository = SqliteEventRepository(arguments.data_dir)
+            try:
+                exported = export_events(repository.stream(batch_size=arguments.batch_size, **filters),
+                                         repository.users.find_by_ids, output, arguments.batch_size)
+            finally:
+                repository.close()
+        else:
+            # The files are read as they are, without opening the repositories: the bot may be running
+            exported = export_events(
+                ((eid, document) for (eid, document) in event_repository.stream(arguments.data_dir)
+                 if matches(document, **filters)),
+                lambda user_ids: stream_profiles(arguments.data_dir, user_ids),
+                output, arguments.batch_size)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print('{} events exported'.format(exported), file=sys.stderr)
+
+
+def stream_profiles(data_dir: str, user_ids: set) -> dict:
+    """Profiles of `user_ids`, read from the files of the user directory a chunk at a time"""
+    if not user_ids:
+        return {}
+
+    users = JournalDB.stream(os.path.join(data_dir, 'users.json'), 'users')
+
+    return {document['id']: document for (_, document) in users if document['id'] in user_ids}
+
+
+def import_command(arguments: argparse.Namespace):
+    # With tinydb the bot must be stopped (StorageInUseError otherwise): its next compaction would drop the import
+    if arguments.backend == 'sqlite':
+        repository = SqliteEventRepository(arguments.data_dir)
+    else:
+        repository = EventRepository(arguments.data_dir,
+                                     shards=arguments.shards or storage_config().get('shards', 1))
+
+    opener = gzip.open if arguments.input.endswith('.gz') else open
+
+    try:
+        with opener(arguments.input, 'rb') as lines:
+            imported = import_events(lines, repository, arguments.batch_size, arguments.input + '.progress',
+                                     arguments.resume)
+    finally:
+        repository.close()
+
+    print('{} events imported'.format(imported))
+
+
+def storage_config(path: str = 'config.yml') -> dict:
+    """The storage section of the configuration of the bot, empty without one"""
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as ymlfile:
+        return (yaml.load(ymlfile, Loader=yaml.Loader) or {}).get('storage') or {}
+
+
+def date(value: str) -> float:
+    return datetime.datetime.strptime(value, '%Y-%m-%d').timestamp()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Maintenance of the bot storage')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('migrate',
+                                  help='copy the events, profiles and reminders of the TinyDB files into SQLite')
+    command.add_argument('--data-dir', default='./data/')
+    command.add_argument('--batch-size', type=int, default=1000, help='events written in each transaction')
+    command.set_defaults(run=migrate_command)
+
+    command = commands.add_parser('export', help='write the events as JSON lines, a batch at a time')
+    command.add_argument('--data-dir', default='./data/')
+    command.add_argument('--backend', choices=('tinydb', 'sqlite'), default='tinydb')
+    command.add_argument('--output', default='-', help='file to write (compressed if it ends in .gz), - for stdout')
+    command.add_argument('--user-id', type=int, help='only the events of this owner')
+    command.add_argument('--since', type=date, help='only the events on or after this day (YYYY-MM-DD)')
+    command.add_argument('--until', type=date, help='only the events before this day (YYYY-MM-DD)')
+    command.add_argument('--drafts', choices=('include', 'exclude', 'only'), default='include')
+    command.add_argument('--batch-size', type=int, default=1000, help='events read at a time')
+    command.set_defaults(run=export_command)
+
+    command = commands.add_parser('import', help='insert the events of an export, keeping their ids '
+                                                 '(with tinydb, while the bot is stopped)')
+    command.add_argument('input', help='file written by export (compressed if it ends in .gz)')
+    command.add_argument('--data-dir', default='./data/')
+    command.add_argument('--backend', choices=('tinydb', 'sqlite'), default='tinydb')
+    command.add_argument('--shards', type=int,
+                         help='with tinydb, the shards of the storage (as in config.yml by default)')
+    command.add_argument('--batch-size', type=int, default=1000, help='events written in each write')
+    command.add_argument('--resume', action='store_true',
+                         help='start after the last batch written by an interrupted import')
+    command.set_defaults(run=import_command)
+
+    arguments = parser.parse_args()
+    arguments.run(arguments)
+
+
+if __name__ == '__main__':
+    main()
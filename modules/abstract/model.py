@@ -2,6 +2,9 @@ from abc import ABC, abstractmethod
 
 
 class MarvinModel(ABC):
+    # Subclasses declaring __slots__ get no instance __dict__
+    __slots__ = ()
+
     @abstractmethod
     def to_dict(self):
         pass
@@ -0,0 +1,123 @@
+import json
+import os
+import random
+import statistics
+import string
+import tempfile
+import time
+
+from tinydb import Query
+
+from modules.events.event_repository import EventRepository
+from modules.events.sqlite_event_repository import SqliteEventRepository, migrate
+from modules.events.sqlite_reminder_repository import SqliteReminderRepository
+
+EVENTS_PER_USER = 10
+SIZES = (1000, 10000, 100000)
+WORDS = [''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(4, 9))) for _ in range(20000)]
+
+
+def sentence(length: int) -> str:
+    return ' '.join(random.choice(WORDS) for _ in range(length)).capitalize()
+
+
+def seed(data_dir: str, size: int):
+    """Write a TinyDB file with `size` events, one open draft for every user"""
+    now = time.time()
+    events = {}
+
+    for eid in range(1, size + 1):
+        user_id = eid // EVENTS_PER_USER + 1
+        events[str(eid)] = {
+            'id': eid,
+            'title': sentence(3),
+            'description': sentence(12),
+            'location': '',
+            'datetime': now + random.randint(-86400 * 30, 86400 * 30),
+            'draft': eid % EVENTS_PER_USER == 0,
+            'user_id': user_id,
+            'users_confirmed': [],
+            'users_not_confirmed': [],
+            'users_to_be_confirmed': [],
+        }
+
+    with open(os.path.join(data_dir, 'events.json'), 'w') as db_file:
+        json.dump({'events': events}, db_file)
+
+    return size // EVENTS_PER_USER
+
+
+def measure(operation, arguments: list) -> dict:
+    """Latency percentiles of `operation` on every argument, in microseconds"""
+    timings = []
+
+    for argument in arguments:
+        start = time.perf_counter()
+        operation(argument)
+        timings.append((time.perf_counter() - start) * 1e6)
+
+    timings.sort()
+
+    return {
+        'samples': len(timings),
+        'p50': statistics.median(timings),
+        'p95': percentile(timings, 0.95),
+        'p99': percentile(timings, 0.99),
+        # Operations per second, one after the other
+        'throughput': len(timings) / sum(timings) * 1e6 if sum(timings) else float('inf'),
+    }
+
+
+def percentile(timings: list, fraction: float) -> float:
+    """`fraction` percentile of the sorted `timings`"""
+    return timings[max(int(len(timings) * fraction) - 1, 0)]
+
+
+def run(samples: int = 2000, scan_samples: int = 3, update_samples: int = 200):
+    print('{:>8} {:>8} {:>24} {:>10} {:>10}'.format('events', 'backend', 'lookup', 'p50 (us)', 'p99 (us)'))
+
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as data_dir:
+            users = seed(data_dir, size)
+            repository = EventRepository(data_dir)
+            sqlite_repository = SqliteEventRepository(data_dir)
+            sqlite_reminders = SqliteReminderRepository(data_dir)
+            migrate(data_dir, sqlite_repository, sqlite_reminders)
+            sqlite_reminders.close()
+
+            user_ids = [random.randint(1, users) for _ in range(samples)]
+            words = [random.choice(WORDS) for _ in range(samples)]
+            event_ids = [random.randint(1, size) for _ in range(update_samples)]
+
+            results = {
+                ('tinydb', 'full scan'): measure(
+                    # What find_draft cost before the indexes, for comparison
+                    lambda u: repository.db.search((Query().user_id == u) & (Query().draft == True)),
+                    user_ids[:scan_samples]),
+            }
+
+            for (backend, tested) in (('tinydb', repository), ('sqlite', sqlite_repository)):
+                results.update({
+                    (backend, 'find_draft'): measure(tested.find_draft, user_ids),
+                    (backend, 'find_by_user_id(future)'): measure(lambda u: tested.find_by_user_id(u, True),
+                                                                  user_ids),
+                    (backend, 'find_by_id'): measure(tested.find_by_id, event_ids),
+                    (backend, 'text search (word)'): measure(lambda w: tested.find_by_name(w, 50), words),
+                    (backend, 'text search (substring)'): measure(lambda w: tested.find_by_name(w[1:7].upper(), 50),
+                                                                  words),
+                    (backend, 'text search (owner)'): measure(
+                        lambda u: tested.find_by_name_and_user_id('a', u, 50), user_ids),
+                    (backend, 'set_rsvp'): measure(
+                        lambda e: tested.set_rsvp(e, {'id': e % 97 + 1, 'first_name': 'User'}, 'yes'), event_ids),
+                    (backend, 'update'): measure(tested.update, [tested.find_by_id(e) for e in event_ids]),
+                })
+
+            repository.close()
+            sqlite_repository.close()
+
+            for ((backend, name), result) in sorted(results.items(), key=lambda item: (item[0][1], item[0][0])):
+                print('{:>8} {:>8} {:>24} {:>10.1f} {:>10.1f}'.format(size, backend, name, result['p50'],
+                                                                      result['p99']))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+
+class FakeBot:
+    """Records the Bot API calls instead of sending them"""
+
+    def __init__(self):
+        self.calls = {}
+
+    def __getattr__(self, method: str):
+        def call(*args, **kwargs):
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        return call
+
+
+class ImmediateOutbound:
+    """Sends right away, so that the cost of the sends is part of the handler latency"""
+
+    def put(self, chat_id: int, priority: int, method, *args, **kwargs):
+        method(*args, **kwargs)
+
+
+class ImmediateCoalescer:
+    """Edits on every click, the worst case of the real coalescer"""
+
+    def submit(self, key, chat_id: int, edit):
+        edit()
+
+
+def user(user_id: int) -> SimpleNamespace:
+    return SimpleNamespace(id=user_id, first_name='User', last_name=str(user_id), username='user{}'.format(user_id))
+
+
+def message_update(user_id: int, text: str) -> SimpleNamespace:
+    chat = SimpleNamespace(id=user_id)
+    message = SimpleNamespace(text=text, chat=chat, chat_id=chat.id, from_user=user(user_id),
+                              reply_text=lambda *args, **kwargs: None)
+
+    return SimpleNamespace(message=message)
+
+
+def inline_query_update(user_id: int, query: str, offset: str = '') -> SimpleNamespace:
+    return SimpleNamespace(inline_query=SimpleNamespace(id='query', query=query, offset=offset,
+                                                        from_user=user(user_id)))
+
+
+def callback_query_update(user_id: int, event_id: int, status: str) -> SimpleNamespace:
+    message = SimpleNamespace(chat=SimpleNamespace(id=user_id), message_id=event_id)
+
+    return SimpleNamespace(callback_query=SimpleNamespace(id='callback', data='{}_{}'.format(status, event_id),
+                                                          from_user=user(user_id), inline_message_id=None,
+                                                          message=message))
@@ -0,0 +1,151 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from modules.events.benchmarks.event_repository import SIZES, WORDS, measure, seed
+from modules.events.benchmarks.fakes import FakeBot, ImmediateCoalescer, ImmediateOutbound
+from modules.events.benchmarks.fakes import callback_query_update, inline_query_update, message_update
+from modules.events.event_command import EventCommand
+from modules.events.event_inline import EventInline
+from modules.events.event_repository import EventRepository
+from modules.events.reminder_model import Reminder
+from modules.events.reminder_repository import ReminderRepository
+
+# Chats reminded of every event, and reminders sent by every fire
+CHATS_PER_EVENT = 10
+REMINDER_BATCH = 100
+
+
+def create_wizard(command: EventCommand, user_id: int):
+    command.create_new_command(None, message_update(user_id, '/create'), [])
+    command.set_title(None, message_update(user_id, ' '.join(random.sample(WORDS, 3))))
+    command.set_description(None, message_update(user_id, ' '.join(random.sample(WORDS, 12))))
+    command.set_datetime(None, message_update(user_id, '30/10/2100 15:33'))
+    command.set_location(None, message_update(user_id, 'Milliways'))
+
+
+def seed_reminders(reminders: ReminderRepository, events: int, count: int) -> list:
+    """Reminders of `count` / CHATS_PER_EVENT events, in batches of the size of a fire"""
+    documents = []
+
+    for event_id in random.sample(range(1, events + 1), count // CHATS_PER_EVENT):
+        for chat_id in range(CHATS_PER_EVENT):
+            reminder = Reminder(event_id, chat_id, 1, 3600)
+            reminder.next_run = time.time()
+            documents.append(reminder.to_dict())
+
+    ids = reminders.db.insert_multiple(documents)
+
+    return [ids[n:n + REMINDER_BATCH] for n in range(0, len(ids), REMINDER_BATCH)]
+
+
+def run_size(size: int, samples: int) -> list:
+    with tempfile.TemporaryDirectory() as data_dir:
+        users = seed(data_dir, size)
+        repository = EventRepository(data_dir)
+        reminders = ReminderRepository(data_dir)
+        outbound = ImmediateOutbound()
+        bot = FakeBot()
+
+        command = EventCommand({'create': ['anyone'], 'publish': 'anyone'}, repository, outbound, reminders)
+        command.start(bot)
+        inlines = {
+            scope: EventInline({'publish': scope}, repository, ImmediateCoalescer(), outbound)
+            for scope in ('anyone', 'owner')
+        }
+
+        user_ids = [random.randint(1, users) for _ in range(samples)]
+        queries = [random.choice(WORDS)[:random.randint(2, 6)] for _ in range(samples)]
+        batches = seed_reminders(reminders, size, samples)
+
+        scenarios = {
+            'inline search (anyone)': measure(
+                lambda n: inlines['anyone'].inline_event_list(bot, inline_query_update(user_ids[n], queries[n])),
+                range(samples)),
+            'inline search (owner)': measure(
+                lambda n: inlines['owner'].inline_event_list(bot, inline_query_update(user_ids[n], queries[n])),
+                range(samples)),
+            'rsvp callback': measure(
+                lambda n: inlines['anyone'].callback_handler(bot, callback_query_update(
+                    user_ids[n], random.randint(1, size), random.choice(('yes', 'no', 'maybe')))),
+                range(samples)),
+            'create wizard': measure(lambda n: create_wizard(command, users + n + 1), range(samples // 10)),
+            'reminder fire ({} chats)'.format(REMINDER_BATCH): measure(command.reminder_messages, batches),
+        }
+
+        command.scheduler.stop()
+        reminders.close()
+        repository.close()
+
+    return [
+        {
+            'events': size,
+            'scenario': name,
+            'samples': result['samples'],
+            'p50_ms': result['p50'] / 1e3,
+            'p95_ms': result['p95'] / 1e3,
+            'p99_ms': result['p99'] / 1e3,
+            'ops_per_s': result['throughput'],
+        }
+        for (name, result) in scenarios.items()
+    ]
+
+
+def run(sizes=SIZES, samples: int = 1000) -> dict:
+    results = []
+
+    for size in sizes:
+        results.extend(run_size(size, samples))
+
+    return {
+        'python': platform.python_version(),
+        'timestamp': int(time.time()),
+        'results': results,
+    }
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list:
+    """Scenarios whose p95 grew by more than `tolerance` (a fraction) since `baseline`"""
+    before = {(result['events'], result['scenario']): result for result in baseline['results']}
+    slower = []
+
+    for result in report['results']:
+        previous = before.get((result['events'], result['scenario']))
+
+        if previous and result['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            slower.append('{} events, {}: p95 {:.3f} ms, was {:.3f} ms'.format(
+                result['events'], result['scenario'], result['p95_ms'], previous['p95_ms']))
+
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Latency of the events handlers, as JSON')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='events seeded, one run each')
+    parser.add_argument('--samples', type=int, default=1000, help='calls measured for each scenario')
+    parser.add_argument('--output', help='file to write the results to, instead of the standard output')
+    parser.add_argument('--baseline', help='results of a previous run: exit with 1 if any p95 got worse')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='p95 increase allowed by --baseline')
+    arguments = parser.parse_args()
+
+    results = run(arguments.sizes, arguments.samples)
+    report = json.dumps(results, indent=2)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline:
+            slower = regressions(results, json.load(baseline), arguments.tolerance)
+
+        for line in slower:
+            print(line, file=sys.stderr)
+
+        sys.exit(1 if slower else 0)
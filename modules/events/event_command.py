@@ -1,53 +1,90 @@
+import functools
+import logging
 import time
 
 from telegram import Bot, ParseMode
 from telegram import ReplyKeyboardRemove
 from telegram import Update
 from telegram import InlineKeyboardMarkup
-from telegram.ext import CommandHandler, Job
+from telegram.ext import CommandHandler
 from telegram.ext import ConversationHandler
 from telegram.ext import Filters
 from telegram.ext import MessageHandler
-from telegram.ext.jobqueue import Days, JobQueue
-from typing import Tuple, Dict
+from typing import Callable, Dict, List, Tuple
 from datetime import datetime
+from tinydb.database import Element
 
 from exceptions import NoDraftExistError
 from modules.events.event_model import Event
 from modules.events.event_repository import EventRepository
 from modules.events.event_inline import EventInline
+from modules.events.reminder_model import Reminder
+from modules.events.reminder_repository import ReminderRepository
+from services.outbound import INTERACTIVE, REMINDER, OutboundQueue
+from services.scheduler import Scheduler
+from services.session import SessionStore
 
 TITLE, DESCRIPTION, DATETIME, LOCATION = range(4)
 
 
+def wizard_step(step: Callable) -> Callable:
+    """Ends the wizard of a user whose draft expired, instead of failing at every message after it"""
+    @functools.wraps(step)
+    def handle(self, bot: Bot, update: Update) -> int:
+        try:
+            return step(self, bot, update)
+        except NoDraftExistError:
+            self.reply(update, _('Your draft expired, start again with /create'), reply_markup=ReplyKeyboardRemove())
+            return ConversationHandler.END
+
+    return handle
+
+
 class EventCommand:
     handlers = []
     permissions = []
 
-    def __init__(self, permissions: Dict[str, str]):
+    def __init__(self, permissions: Dict[str, str], repository: EventRepository = None,
+                 outbound: OutboundQueue = None, reminders: ReminderRepository = None, drafts: SessionStore = None):
+        self.conversation = ConversationHandler(
+            per_chat=False,
+            entry_points=[CommandHandler('create', self.create_new_command, pass_args=True)],
+            states={
+                TITLE: [MessageHandler(Filters.text, self.set_title)],
+                DESCRIPTION: [MessageHandler(Filters.text, self.set_description),
+                              CommandHandler('skip', self.skip_desc_command)],
+                DATETIME: [MessageHandler(Filters.text, self.set_datetime)],
+                LOCATION: [MessageHandler(Filters.text, self.set_location),
+                           CommandHandler('skip', self.skip_location_command)],
+            },
+            fallbacks=[CommandHandler('cancel', self.cancel_command)]
+        )
         self.handlers = [
-            CommandHandler('reminder', self.reminder_command, pass_args=True, pass_job_queue=True, pass_chat_data=True),
-            CommandHandler('cancel_reminder', self.cancel_reminder_command, pass_chat_data=True),
-            ConversationHandler(
-                per_chat=False,
-                entry_points=[CommandHandler('create', self.create_new_command, pass_args=True)],
-                states={
-                    TITLE: [MessageHandler(Filters.text, self.set_title)],
-                    DESCRIPTION: [MessageHandler(Filters.text, self.set_description),
-                                  CommandHandler('skip', self.skip_desc_command)],
-                    DATETIME: [MessageHandler(Filters.text, self.set_datetime)],
-                    LOCATION: [MessageHandler(Filters.text, self.set_location),
-                               CommandHandler('skip', self.skip_location_command)],
-                },
-                fallbacks=[CommandHandler('cancel', self.cancel_command)]
-            )
+            CommandHandler('reminder', self.reminder_command, pass_args=True),
+            CommandHandler('cancel_reminder', self.cancel_reminder_command, pass_args=True),
+            self.conversation
         ]
         self.permissions = permissions
-        self.repository = EventRepository()
+        self.repository = repository or EventRepository()
+        self.outbound = outbound or OutboundQueue()
+
+        # One timer for all the reminders, sent by the bot given to start()
+        self.reminders = reminders or ReminderRepository()
+        self.scheduler = Scheduler(self.reminder_messages)
+        self.bot = None
+        self.repository.subscribe(self.cancel_event_reminders)
+
+        # Events being created, with the step of the wizard they are at: stored only once complete
+        self.drafts = drafts or SessionStore()
+        self.logger = logging.getLogger(__name__)
 
     def get_handlers(self) -> list:
         return self.handlers
 
+    def reply(self, update: Update, text: str, **kwargs):
+        # Replies go before the reminders, within the rate limits of the chat
+        self.outbound.put(update.message.chat_id, INTERACTIVE, update.message.reply_text, text, **kwargs)
+
     def check_permission(self, action: str, user: Tuple[int, str]):
         if action == 'create':
             permission_list = self.permissions['create']
@@ -59,95 +96,165 @@ class EventCommand:
 
             return False
 
-    def reminder_command(self, bot: Bot, update: Update, args: list, job_queue: JobQueue, chat_data):
+    def reminder_command(self, bot: Bot, update: Update, args: list):
         if len(args) < 2:
-            update.message.reply_text(_("The usage of reminder command is: /reminder <hours> <event_name>"))
+            self.reply(update, _("The usage of reminder command is: /reminder <hours> <event_name>"))
             return
 
         try:
             hour_interval = int(args[0])
         except IndexError:
-            update.message.reply_text(_("The first argument must be an integer (hours)"))
+            self.reply(update, _("The first argument must be an integer (hours)"))
             return
 
         del args[0]
         event_name = ' '.join(args)
 
-        events = self.repository.find_by_name(event_name)
+        event = self.repository.query(event_name).first()
 
-        if not events:
-            update.message.reply_text(_('No events found with name "{}"'.format(event_name)))
+        if not event:
+            self.reply(update, _('No events found with name "{}"'.format(event_name)))
             return
-        else:
-            event = events[0]
 
         if update.message.from_user.id != event.user_id:
-            update.message.reply_text(_("You can't set a reminder on events created by others"))
+            self.reply(update, _("You can't set a reminder on events created by others"))
             return
 
         chat_id = update.message.chat_id
         user_id = update.message.from_user.id
-        job_name = str(user_id) + '_' + str(event.id) + '_' + str(chat_id)
-
-        context = {
-            "chat_id": chat_id,
-            "event_id": event.id,
-            "user_id": user_id
-        }
 
         if hour_interval < 1:
             hour_interval = 1
 
         interval = hour_interval * 3600
 
-        job = Job(self.reminder_message, interval=interval, repeat=True, context=context, days=Days.EVERY_DAY,
-                  name=job_name)
+        # A new reminder of the same event in the same chat replaces the previous one
+        reminder = next((r for r in self.reminders.find_by_chat_id(chat_id) if r.event_id == event.id), None)
+
+        if reminder:
+            reminder.user_id = user_id
+            reminder.interval = interval
+            reminder.next_run = time.time() + interval
+            self.reminders.update(reminder)
+        else:
+            reminder = Reminder(event.id, chat_id, user_id, interval)
+            reminder.next_run = time.time() + interval
+            reminder.id = self.reminders.insert(reminder)
 
-        job_queue.put(job)
-        chat_data['job'] = job
+        self.scheduler.schedule(reminder.id, reminder.next_run)
 
-        update.message.reply_text(_(
+        self.reply(update, _(
             'Reminder set! I will text "{}" event every {} hours in this chat'.format(event.title,
                                                                                       int(interval / 3600))))
 
-    @staticmethod
-    def cancel_reminder_command(bot: Bot, update: Update, chat_data):
-        if 'job' not in chat_data:
-            update.message.reply_text(_('There are no active timer'))
+    def cancel_reminder_command(self, bot: Bot, update: Update, args: list):
+        reminders = self.reminders.find_by_chat_id(update.message.chat_id)
+
+        # With an event name only the reminders of that event are removed
+        if args:
+            event = self.repository.query(' '.join(args)).first()
+            reminders = [r for r in reminders if event and r.event_id == event.id]
+
+        if not reminders:
+            self.reply(update, _('There are no active timer'))
             return
-        else:
-            job = chat_data['job']  # type: Job
 
         user_id = update.message.from_user.id
+        reminders = [r for r in reminders if r.user_id == user_id]
 
-        if job.context['user_id'] != user_id:
-            update.message.reply_text(_('You can\'t remove the timer'))
+        if not reminders:
+            self.reply(update, _('You can\'t remove the timer'))
             return
 
-        job.schedule_removal()
-        del chat_data['job']
+        for reminder in reminders:
+            self.remove_reminder(reminder.id)
 
-        update.message.reply_text(_("Reminder removed!"))
+        self.reply(update, _("Reminder removed!"))
 
-    def reminder_message(self, bot: Bot, job: Job):
-        event = self.repository.find_by_id(job.context['event_id'])
+    def start(self, bot: Bot, owned: Callable[[Reminder], bool] = None):
+        """
+        Schedule the reminders stored by the previous runs, sent by `bot`, and resume the drafts checkpointed.
+        With several processes sharing the reminders, each schedules only the ones `owned`
+        """
+        self.bot = bot
 
-        if not event:
-            job.schedule_removal()
-            return
+        for (user_id, (state, event)) in self.drafts.items():
+            self.conversation.conversations[(user_id,)] = state
+
+        for reminder in self.reminders.find_all():
+            if owned is None or owned(reminder):
+                self.scheduler.schedule(reminder.id, reminder.next_run)
+
+    def remove_reminder(self, reminder_id: int):
+        self.scheduler.cancel(reminder_id)
+        self.reminders.remove(reminder_id)
+
+    def cancel_event_reminders(self, event_id: int, previous: dict, current: dict):
+        if current is None:
+            for reminder in self.reminders.find_by_event_id(event_id):
+                self.remove_reminder(reminder.id)
+
+    def reminder_messages(self, reminder_ids: List[int]):
+        reminders = {}
+
+        for reminder in self.reminders.find_by_ids(reminder_ids):
+            reminders.setdefault(reminder.event_id, []).append(reminder)
+
+        now = time.time()
+        sent = []
+        failed = []
 
-        bot.sendMessage(job.context['chat_id'], text=EventInline.create_event_message(event),
-                        reply_markup=InlineKeyboardMarkup(
-                            inline_keyboard=EventInline.create_reply_keyboard(event)),
-                        parse_mode=ParseMode.HTML)
+        # Every event is loaded and rendered once, however many chats it is sent to
+        for (event_id, event_reminders) in reminders.items():
+            try:
+                sent.extend(self.send_reminders(event_id, event_reminders, now))
+            except Exception:
+                # The reminders of the other events go on: these are retried by the scheduler
+                self.logger.exception('Reminders of event %s failed', event_id)
+                failed.append(event_id)
+
+        # Scheduled before they are stored: a failed write doesn't stop them
+        for reminder in sent:
+            self.scheduler.schedule(reminder.id, reminder.next_run)
+
+        self.reminders.update_multiple(sent)
+
+        if failed:
+            raise RuntimeError('Reminders of events {} failed'.format(failed))
+
+    def send_reminders(self, event_id: int, reminders: List[Reminder], now: float) -> List[Reminder]:
+        """Send `reminders` of `event_id`, returns the ones sent, with their next run"""
+        event = self.repository.find_by_id(event_id)
+
+        # Nothing left to remind of deleted events and of the ones already over
+        if not event or (event.datetime and event.datetime < now):
+            for reminder in reminders:
+                self.remove_reminder(reminder.id)
+            return []
+
+        text = EventInline.create_event_message(event)
+        reply_markup = InlineKeyboardMarkup(inline_keyboard=EventInline.create_reply_keyboard(event))
+
+        for reminder in reminders:
+            self.outbound.put(reminder.chat_id, REMINDER, self.bot.sendMessage, reminder.chat_id,
+                              text=text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+            # After a downtime the missed reminders are not sent again
+            reminder.next_run += reminder.interval
+            if reminder.next_run <= now:
+                reminder.next_run = now + reminder.interval
+
+        return reminders
 
     def cancel_command(self, bot: Bot, update: Update) -> int:
         user_id = update.message.from_user.id
 
+        self.drafts.pop(user_id)
+        # Drafts were stored in the repository up to now
         self.repository.remove_draft(user_id)
 
-        update.message.reply_text(_('Bye! I hope we can talk again some day'),
-                                  reply_markup=ReplyKeyboardRemove())
+        self.reply(update, _('Bye! I hope we can talk again some day'),
+                   reply_markup=ReplyKeyboardRemove())
         return ConversationHandler.END
 
     def create_new_command(self, bot: Bot, update: Update, args) -> int:
@@ -157,92 +264,104 @@ class EventCommand:
         can_create = self.check_permission('create', (user_id, user_name))
 
         if not can_create:
-            bot.sendMessage(update.message.chat.id, _('You don\'t have the permission to create new event'))
+            self.outbound.put(update.message.chat.id, INTERACTIVE, bot.sendMessage, update.message.chat.id,
+                              _('You don\'t have the permission to create new event'))
             return ConversationHandler.END
         else:
-            event = Event(user_id)
-            event_id = self.repository.insert(event)
-
-            event.id = event_id
-            self.repository.update(event)
-
-            update.message.reply_text(_('(1/4) Insert the title of the event'))
-            return TITLE
+            self.reply(update, _('(1/4) Insert the title of the event'))
+            return self.save_draft(user_id, Event(user_id), TITLE)
 
+    @wizard_step
     def set_title(self, bot: Bot, update: Update) -> int:
         title = update.message.text
         user_id = update.message.from_user.id
 
-        # get event by user id
         event = self.load_draft(user_id)
         event.title = title
-        # update event entity
-        self.repository.update(event)
 
-        update.message.reply_text(_('(2/4) Ok! Now set a description or /skip'))
-        return DESCRIPTION
+        self.reply(update, _('(2/4) Ok! Now set a description or /skip'))
+        return self.save_draft(user_id, event, DESCRIPTION)
 
+    @wizard_step
     def set_description(self, bot: Bot, update: Update) -> int:
         description = update.message.text
         user_id = update.message.from_user.id
 
         event = self.load_draft(user_id)
         event.description = description
-        self.repository.update(event)
 
-        update.message.reply_text(
-            _('(3/4) Ok! Now set the date and the time (dd/mm/yyyy HH:mm format, eg 30/10/1970 15:33)'))
-        return DATETIME
+        self.reply(update,
+                   _('(3/4) Ok! Now set the date and the time (dd/mm/yyyy HH:mm format, eg 30/10/1970 15:33)'))
+        return self.save_draft(user_id, event, DATETIME)
 
-    @staticmethod
-    def skip_desc_command(bot: Bot, update: Update) -> int:
-        update.message.reply_text(
-            _('(3/4) Ok! Now set the date and the time (dd/mm/yyyy HH:mm format, eg 30/10/1970 15:33)'))
+    @wizard_step
+    def skip_desc_command(self, bot: Bot, update: Update) -> int:
+        user_id = update.message.from_user.id
 
-        return DATETIME
+        self.reply(update,
+                   _('(3/4) Ok! Now set the date and the time (dd/mm/yyyy HH:mm format, eg 30/10/1970 15:33)'))
 
+        return self.save_draft(user_id, self.load_draft(user_id), DATETIME)
+
+    @wizard_step
     def set_datetime(self, bot: Bot, update: Update) -> int:
         timestamp = time.mktime(datetime.strptime(update.message.text, '%d/%m/%Y %H:%M').timetuple())
 
         if time.time() > timestamp:
-            update.message.reply_text(_('The date is in the past, insert correct date!'))
+            self.reply(update, _('The date is in the past, insert correct date!'))
             return DATETIME
 
         user_id = update.message.from_user.id
 
         event = self.load_draft(user_id)
         event.datetime = timestamp
-        self.repository.update(event)
 
-        update.message.reply_text(_('(4/4) Last step! Set the location or /skip'))
-        return LOCATION
+        self.reply(update, _('(4/4) Last step! Set the location or /skip'))
+        return self.save_draft(user_id, event, LOCATION)
 
+    @wizard_step
     def set_location(self, bot: Bot, update: Update) -> int:
         location = update.message.text
         user_id = update.message.from_user.id
 
         event = self.load_draft(user_id)
         event.location = location
-        event.draft = False
-        self.repository.update(event)
 
-        update.message.reply_text(_('Yeah!!! Event created'))
-        return ConversationHandler.END
+        return self.create_event(update, event)
 
+    @wizard_step
     def skip_location_command(self, bot: Bot, update: Update) -> int:
         user_id = update.message.from_user.id
 
-        event = self.load_draft(user_id)
+        return self.create_event(update, self.load_draft(user_id))
+
+    def create_event(self, update: Update, event: Event) -> int:
+        # The only write of the whole wizard
         event.draft = False
-        self.repository.update(event)
+        event.id = self.repository.insert(event)
+        self.drafts.pop(event.user_id)
 
-        update.message.reply_text(_('Yeah!!! Event created'))
+        self.reply(update, _('Yeah!!! Event created'))
         return ConversationHandler.END
 
-    def load_draft(self, user_id):
-        event = self.repository.find_draft(user_id)
+    def save_draft(self, user_id: int, event: Event, state: int) -> int:
+        """Keep `event` as the draft of the user, who is now at `state` of the wizard"""
+        self.drafts.put(user_id, (state, event))
 
-        if not event:
+        return state
+
+    def load_draft(self, user_id) -> Event:
+        draft = self.drafts.get(user_id)
+
+        if not draft:
             raise NoDraftExistError(_('There is no draft open for user {}').format(user_id))
         else:
-            return event
+            return draft[1]
+
+    @staticmethod
+    def encode_draft(draft: tuple) -> list:
+        return [draft[0], draft[1].to_dict()]
+
+    @staticmethod
+    def decode_draft(value: list) -> tuple:
+        return value[0], Event.from_dict(Element(value[1], None))
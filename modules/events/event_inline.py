@@ -1,8 +1,11 @@
+from concurrent.futures import Executor
 from typing import List
 
 from telegram import Bot
+from telegram import CallbackQuery
 from telegram import InlineKeyboardButton
 from telegram import InlineKeyboardMarkup
+from telegram import InlineQuery
 from telegram import InlineQueryResultArticle
 from telegram import InputTextMessageContent
 from telegram import ParseMode
@@ -14,59 +17,134 @@ from emoji import emojize
 
 from modules.events.event_model import Event
 from modules.events.event_repository import EventRepository
+from services.aio import AsyncProxy
+from services.cache import TaggedCache
+from services.outbound import EditCoalescer, OutboundQueue
+from services.util import config
+
+# Telegram doesn't accept more than 50 results for each answer
+INLINE_PAGE_SIZE = 50
+INLINE_CACHE_SIZE = 1024
+INLINE_CACHE_TTL = 60
+
+PUSHPIN = emojize(":pushpin:", use_aliases=True)
+
+# Messages and keyboards of the events, by event id and version: a new version is a new entry
+render_cache = TaggedCache(4096)
 
 
 class EventInline:
-    def __init__(self, permissions):
+    def __init__(self, permissions, repository: EventRepository = None, coalescer: EditCoalescer = None,
+                 outbound: OutboundQueue = None, answer_cache_size: int = INLINE_CACHE_SIZE):
         self.handlers = [
             CallbackQueryHandler(self.callback_handler),
             InlineQueryHandler(self.inline_event_list),
         ]
-        self.repository = EventRepository()
+        self.repository = repository or EventRepository()
         self.permissions = permissions
+        self.coalescer = coalescer or EditCoalescer(outbound or OutboundQueue())
+
+        # Rendered answers to inline queries, dropped as soon as one of their events changes
+        # (only writes of this process are seen: with more processes the size is 0, nothing is cached)
+        self.answer_cache = TaggedCache(answer_cache_size, INLINE_CACHE_TTL)
+        self.repository.subscribe(self.invalidate_inline_answers)
 
     def get_handlers(self) -> list:
         return self.handlers
 
     def callback_handler(self, bot: Bot, update: Update):
         query = update.callback_query
-        data = query.data
-        user = query.from_user.__dict__
+        (event_id, user, command) = self.parse_callback(query)
 
-        user.pop('bot')
+        event = self.repository.set_rsvp(event_id, user, command)
 
-        (command, event_id) = tuple(data.split('_'))
+        # Stop the spinner on the button right away, the message is edited later
+        bot.answerCallbackQuery(query.id)
 
-        event = self.repository.find_by_id(event_id)
-        event = self.register_user(user, event, command)
+        self.submit_edit(bot, query, event)
+
+    @staticmethod
+    def parse_callback(query: CallbackQuery) -> (int, dict, str):
+        user = dict(query.from_user.__dict__)
+
+        user.pop('bot', None)
+
+        (command, event_id) = tuple(query.data.split('_'))
+
+        return int(event_id), user, command
+
+    def submit_edit(self, bot: Bot, query: CallbackQuery, event: Event):
+        if not event:
+            return
 
         # If user click on an inline message or a message
         if query.inline_message_id:
-            bot.editMessageText(text=self.create_event_message(event),
-                                parse_mode=ParseMode.HTML,
-                                inline_message_id=query.inline_message_id,
-                                reply_markup=InlineKeyboardMarkup(inline_keyboard=self.create_reply_keyboard(event),
-                                                                  parse_mode=ParseMode.HTML)
-                                )
+            chat_id = None
+            target = {'inline_message_id': query.inline_message_id}
         else:
-            bot.editMessageText(text=self.create_event_message(event),
-                                chat_id=query.message.chat.id,
-                                parse_mode=ParseMode.HTML,
-                                message_id=query.message.message_id,
-                                reply_markup=InlineKeyboardMarkup(inline_keyboard=self.create_reply_keyboard(event),
-                                                                  parse_mode=ParseMode.HTML)
-                                )
+            chat_id = query.message.chat.id
+            target = {'chat_id': chat_id, 'message_id': query.message.message_id}
+
+        # A burst of clicks on the same message ends up in a single edit, with the latest RSVPs
+        self.coalescer.submit(tuple(sorted(target.items())), chat_id,
+                              lambda: self.edit_event_message(bot, event.id, target))
+
+    def edit_event_message(self, bot: Bot, event_id: int, target: dict):
+        event = self.repository.find_by_id(event_id)
+
+        if not event:
+            return
+
+        bot.editMessageText(text=self.create_event_message(event),
+                            parse_mode=ParseMode.HTML,
+                            reply_markup=InlineKeyboardMarkup(inline_keyboard=self.create_reply_keyboard(event)),
+                            **target)
 
     def inline_event_list(self, bot, update):
-        query = update.inline_query.query
-        user_id = update.inline_query.from_user.id
+        bot.answerInlineQuery(update.inline_query.id, **self.inline_answer(update.inline_query))
+
+    def inline_answer(self, inline_query: InlineQuery) -> dict:
+        """Arguments of answerInlineQuery for `inline_query`"""
+        query = inline_query.query
+        user_id = inline_query.from_user.id
+        scope = self.permissions['publish']
+
+        try:
+            offset = max(int(inline_query.offset), 0)
+        except (TypeError, ValueError):
+            offset = 0
 
+        # With 'owner' every user gets different results, cached for that user only (by us and by Telegram)
+        key = (query, scope, user_id if scope == 'owner' else None, offset)
+        answer = self.answer_cache.get(key)
+
+        if answer is None:
+            (answer, events) = self.build_inline_answer(query, user_id, offset)
+            tags = [('event', event.id) for event in events]
+            tags.append((scope, user_id) if scope == 'owner' else (scope,))
+
+            self.answer_cache.put(key, answer, tags)
+
+        (results, next_offset) = answer
+
+        return {
+            'results': results,
+            'is_personal': scope == 'owner',
+            'cache_time': 10,
+            'next_offset': next_offset,
+        }
+
+    def build_inline_answer(self, query: str, user_id: int, offset: int) -> (tuple, List[Event]):
         results = events = []
 
+        # One event more than the page tells whether there is a next one
         if 'anyone' == self.permissions['publish']:
-            events = self.repository.find_by_name(query)  # type: List[Event]
+            events = list(self.repository.query(query).offset(offset).limit(INLINE_PAGE_SIZE + 1))
         if 'owner' == self.permissions['publish']:
-            events = self.repository.find_by_name_and_user_id(query, user_id)  # type: List[Event]
+            events = list(self.repository.query(query, user_id).offset(offset).limit(INLINE_PAGE_SIZE + 1))
+
+        next_offset = str(offset + INLINE_PAGE_SIZE) if len(events) > INLINE_PAGE_SIZE else ''
+        events = events[:INLINE_PAGE_SIZE]
 
         for event in events:
             keyboard = self.create_reply_keyboard(event)
@@ -81,76 +159,70 @@ class EventInline:
                                               reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
             results.append(result)
 
-        bot.answerInlineQuery(
-            update.inline_query.id,
-            results=results,
-            is_personal=False,
-            cache_time=10
-        )
-
-    def register_user(self, user: dict, event: Event, action: str) -> Event:
-        if any(u['id'] == user['id'] for u in event.users_confirmed):
-            event.users_confirmed.remove(user)
-        if any(u['id'] == user['id'] for u in event.users_not_confirmed):
-            event.users_not_confirmed.remove(user)
-        if any(u['id'] == user['id'] for u in event.users_to_be_confirmed):
-            event.users_to_be_confirmed.remove(user)
+        return (results, next_offset), events
 
-        if action == 'yes':
-            event.users_confirmed.append(user)
-        if action == 'no':
-            event.users_not_confirmed.append(user)
-        if action == 'maybe':
-            event.users_to_be_confirmed.append(user)
+    def invalidate_inline_answers(self, event_id: int, previous: dict, current: dict):
+        # Answers showing the event are stale; if it may now match other queries every answer is
+        tags = [('event', event_id)]
 
-        self.repository.update(event)
+        if EventRepository.search_changed(previous, current):
+            tags.append(('anyone',))
+            tags.extend(('owner', document['user_id']) for document in (previous, current) if document)
 
-        return event
+        self.answer_cache.invalidate(*tags)
 
     @staticmethod
     def create_event_message(event: Event) -> str:
-        text = '<b>{title}</b> - {date}\n'.format(title=event.title, date=event.formatted_date())
+        key = ('message', event.id, event.version, config['language'])
+        text = render_cache.get(key)
 
-        if event.description != '':
-            text += '<i>{description}</i>\n'.format(description=event.description)
+        if text is None:
+            text = EventInline.render_event_message(event)
+            render_cache.put(key, text)
 
-        if event.location != '':
-            text += emojize(":pushpin:", use_aliases=True) + ' {location}\n'.format(location=event.location)
+        return text
 
-        text += '\n'
+    @staticmethod
+    def render_event_message(event: Event) -> str:
+        parts = ['<b>{title}</b> - {date}\n'.format(title=event.title, date=event.formatted_date())]
 
-        if len(event.users_confirmed) > 0:
-            text += _('Users confirmed (<b>{total}</b>)\n').format(total=len(event.users_confirmed))
+        if event.description != '':
+            parts.append('<i>{description}</i>\n'.format(description=event.description))
 
-            for u in event.users_confirmed:
-                u = {k: v for k, v in u.items() if v is not None}
-                text += '@' + u['username'] if u.get('username') else ''
-                text += ' (' + (u['first_name'] + ' ' + u.get('last_name', '')).strip() + ')\n'
+        if event.location != '':
+            parts.append(PUSHPIN + ' {location}\n'.format(location=event.location))
 
-            text += '\n'
+        parts.append('\n')
 
-        if len(event.users_not_confirmed) > 0:
-            text += _('Users not confirmed ({total})\n').format(total=len(event.users_not_confirmed))
+        sections = (
+            (_('Users confirmed (<b>{total}</b>)\n'), event.users_confirmed, '\n'),
+            (_('Users not confirmed ({total})\n'), event.users_not_confirmed, '\n'),
+            (_('Users maybe ({total})\n'), event.users_to_be_confirmed, ''),
+        )
 
-            for u in event.users_not_confirmed:
-                u = {k: v for k, v in u.items() if v is not None}
-                text += '@' + u['username'] if u.get('username') else ''
-                text += ' (' + (u['first_name'] + ' ' + u.get('last_name', '')).strip() + ')\n'
+        for (header, users, separator) in sections:
+            if not users:
+                continue
 
-            text += '\n'
+            parts.append(header.format(total=len(users)))
 
-        if len(event.users_to_be_confirmed) > 0:
-            text += _('Users maybe ({total})\n').format(total=len(event.users_to_be_confirmed))
+            for u in users.values():
+                if u.get('username'):
+                    parts.append('@' + u['username'])
+                parts.append(' (' + ((u.get('first_name') or '') + ' ' + (u.get('last_name') or '')).strip() + ')\n')
 
-            for u in event.users_to_be_confirmed:
-                u = {k: v for k, v in u.items() if v is not None}
-                text += '@' + u['username'] if u.get('username') else ''
-                text += ' (' + (u['first_name'] + ' ' + u.get('last_name', '')).strip() + ')\n'
+            parts.append(separator)
 
-        return text
+        return ''.join(parts)
 
     @staticmethod
     def create_reply_keyboard(event: Event) -> List[List[InlineKeyboardButton]]:
+        key = ('keyboard', event.id, config['language'])
+        keyboard = render_cache.get(key)
+
+        if keyboard is not None:
+            return keyboard
+
         buttons = [
             InlineKeyboardButton(
                 text=_('Join'),
@@ -166,4 +238,41 @@ class EventInline:
             )
         ]
 
-        return [buttons, []]
+        keyboard = [buttons, []]
+        render_cache.put(key, keyboard)
+
+        return keyboard
+
+
+class AsyncEventInline(EventInline):
+    """
+    EventInline for the asyncio runtime (services.aio): the handlers are coroutines,
+    the RSVP writes and the Bot API calls run in `executor`
+    """
+
+    def __init__(self, permissions, repository: EventRepository = None, coalescer: EditCoalescer = None,
+                 outbound: OutboundQueue = None, executor: Executor = None,
+                 answer_cache_size: int = INLINE_CACHE_SIZE):
+        super().__init__(permissions, repository, coalescer, outbound, answer_cache_size)
+        self.executor = executor
+        self.storage = AsyncProxy(self.repository, executor)
+
+    async def callback_handler(self, bot: Bot, update: Update):
+        query = update.callback_query
+        (event_id, user, command) = self.parse_callback(query)
+
+        event = await self.storage.set_rsvp(event_id, user, command)
+
+        await AsyncProxy(bot, self.executor).answerCallbackQuery(query.id)
+
+        self.submit_edit(bot, query, event)
+
+    async def inline_event_list(self, bot: Bot, update: Update):
+        if isinstance(self.repository, EventRepository):
+            # Answers come from the indexes and the caches in memory: only the HTTP call leaves the loop
+            answer = self.inline_answer(update.inline_query)
+        else:
+            # The sqlite backend answers with SQL queries, which would block the loop
+            answer = await AsyncProxy(self, self.executor).inline_answer(update.inline_query)
+
+        await AsyncProxy(bot, self.executor).answerInlineQuery(update.inline_query.id, **answer)
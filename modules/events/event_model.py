@@ -5,25 +5,31 @@ from modules.abstract.model import MarvinModel
 
 
 class Event(MarvinModel):
-    id = None
+    __slots__ = ('id', 'title', 'description', 'location', 'datetime', 'draft', 'user_id', 'version',
+                 'users_confirmed', 'users_not_confirmed', 'users_to_be_confirmed')
 
-    title = ''
-    description = ''
-    location = ''
-
-    datetime = None
+    def __init__(self, user_id: int):
+        self.id = None
 
-    draft = True
-    user_id = None
+        self.title = ''
+        self.description = ''
+        self.location = ''
 
-    users_confirmed = []
-    users_not_confirmed = []
-    users_to_be_confirmed = []
+        self.datetime = None
 
-    def __init__(self, user_id: int):
+        self.draft = True
         self.user_id = user_id
 
+        # Increased by the repository on every update
+        self.version = 0
+
+        # Profiles of the attendees by user id, in the order they answered
+        self.users_confirmed = {}
+        self.users_not_confirmed = {}
+        self.users_to_be_confirmed = {}
+
     def to_dict(self) -> dict:
+        # Attendees are stored by id: their profiles are in the user directory
         return {
             'id': self.id,
             'title': self.title,
@@ -32,17 +38,24 @@ class Event(MarvinModel):
             'datetime': self.datetime,
             'draft': self.draft,
             'user_id': self.user_id,
-            'users_confirmed': self.users_confirmed,
-            'users_not_confirmed': self.users_not_confirmed,
-            'users_to_be_confirmed': self.users_to_be_confirmed,
+            'users_confirmed': list(self.users_confirmed),
+            'users_not_confirmed': list(self.users_not_confirmed),
+            'users_to_be_confirmed': list(self.users_to_be_confirmed),
+            'version': self.version,
         }
 
     def formatted_date(self):
         date = datetime.datetime.fromtimestamp(self.datetime)
         return date.strftime("%d/%m/%Y %H:%M")
 
+    def attendees(self) -> list:
+        """Profiles of every attendee, whatever the answer"""
+        return [*self.users_confirmed.values(), *self.users_not_confirmed.values(),
+                *self.users_to_be_confirmed.values()]
+
     @staticmethod
-    def from_dict(values: dict) -> MarvinModel:
+    def from_dict(values: dict, users: dict = None) -> MarvinModel:
+        """`users` are the profiles of the user directory by id, shared (not copied) by the events"""
         if not values['user_id']:
             raise MissingValueError(_('No user_id found in dictionary'))
 
@@ -53,8 +66,22 @@ class Event(MarvinModel):
         event.location = values['location']
         event.datetime = values['datetime']
         event.draft = values['draft']
-        event.users_confirmed = values['users_confirmed']
-        event.users_not_confirmed = values['users_not_confirmed']
-        event.users_to_be_confirmed = values['users_to_be_confirmed']
+        event.users_confirmed = Event._attendees(values['users_confirmed'], users)
+        event.users_not_confirmed = Event._attendees(values['users_not_confirmed'], users)
+        event.users_to_be_confirmed = Event._attendees(values['users_to_be_confirmed'], users)
+        event.version = values.get('version', 0)
 
         return event
+
+    @staticmethod
+    def _attendees(attendees: list, users: dict = None) -> dict:
+        result = {}
+
+        for attendee in attendees:
+            # Events stored before the user directory hold the whole profiles
+            if isinstance(attendee, dict):
+                result[attendee['id']] = attendee
+            else:
+                result[attendee] = (users or {}).get(attendee) or {'id': attendee}
+
+        return result
@@ -1,80 +1,443 @@
+import glob
+import itertools
+import logging
+import os
+import re
+import threading
 import time
 
-from typing import List
-
-from tinydb import Query
+from contextlib import ExitStack
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 from modules.events.event_model import Event
+from modules.events.user_repository import UserRepository
+from services.archive import Archive
+from services.cache import TaggedCache
+from services.index import HashIndex, SortedIndex, TextIndex
+from services.journal import JournalDB
+from services.query import Query
 from services.storage import Storage
 
 
+INDEXED_FIELDS = ('user_id', 'draft', 'datetime', 'title', 'description')
+SEARCHED_FIELDS = ('user_id', 'title', 'description')
+
+# Orders of query(), the first by default
+ORDERS = ('relevance', 'id', 'datetime', '-datetime')
+
+# Attendee list of every RSVP status
+RSVP_LISTS = {
+    'yes': 'users_confirmed',
+    'no': 'users_not_confirmed',
+    'maybe': 'users_to_be_confirmed',
+}
+
+
 class EventRepository(Storage):
-    def __init__(self):
-        super().__init__('events')
+    """
+    Events of every user, in `shards` files partitioned by owner. With
+    `archive_after`, events that took place more than that many seconds ago
+    can be moved by archive_past() to a compressed archive: they can still
+    be read by id, but are no longer held in memory, indexed or searched,
+    and can't be changed
+    """
+
+    shard_key = 'user_id'
+
+    def __init__(self, data_dir: str = './data/', archive_after: float = None, shards: int = 1):
+        self.indexes = {
+            'user_id': HashIndex(lambda d: d['user_id']),
+            'draft': HashIndex(lambda d: (d['user_id'], d['draft'])),
+            'datetime': SortedIndex(lambda d: d['datetime']),
+            'text': TextIndex({'title': 2, 'description': 1}, grams=('title',)),
+        }
+        # Ids matched by the text searches, ranked
+        self.query_cache = TaggedCache()
+        self.listeners = []
+
+        # Writers of the same event are serialized by one of these, then the indexes are updated holding
+        # the index lock: writes of different events reach the storage (and its shards) at once. Readers never wait
+        self.event_locks = [threading.Lock() for _ in range(64)]
+        self.index_lock = threading.RLock()
+        # RSVP status of the attendees by user id, for the version of the event they were read from
+        self.attendance = TaggedCache(4096)
+        # Profiles of the attendees, which the events refer to by id
+        self.users = UserRepository(data_dir)
+        # Past events, read by id only
+        self.archive = Archive(os.path.join(data_dir, 'events.archive.gz'))
+        self.archive_after = archive_after
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger(__name__)
+
+        super().__init__('events', data_dir, shards)
+
+    def open(self):
+        super().open()
+
+        for index in self.indexes.values():
+            index.clear()
+        self.query_cache.clear()
+
+        for document in self.db.all():
+            self._index(document.eid, document)
+
+        # Ids of archived events are never given again: messages, reminders and buttons still refer to them
+        if len(self.archive):
+            self.db.last_id = max(self.db.last_id, max(self.archive.offsets))
+
+    def _index(self, eid: int, document: dict):
+        for index in self.indexes.values():
+            index.add(eid, document)
+
+    def _unindex(self, eid: int, document: dict):
+        for index in self.indexes.values():
+            index.discard(eid, document)
+
+    def close(self):
+        self.stopped.set()
+        super().close()
+        self.users.close()
+
+    def clear_cache(self):
+        super().clear_cache()
+        self.query_cache.clear()
+
+    def _event(self, document: dict) -> Event:
+        return Event.from_dict(document, self.users.profiles)
+
+    def _register(self, users: list):
+        # Profiles already in the directory are newer than the ones held by the events
+        for user in users:
+            if user['id'] not in self.users.profiles:
+                self.users.save(user)
+
+    def _attendee_ids(self, attendees: list) -> list:
+        # Events stored before the user directory hold the whole profiles: moved there on their next write
+        self._register([attendee for attendee in attendees if isinstance(attendee, dict)])
+
+        return [attendee['id'] if isinstance(attendee, dict) else attendee for attendee in attendees]
+
+    def subscribe(self, listener: Callable[[int, dict, dict], None]):
+        """
+        Call `listener(event_id, previous, current)` after every write,
+        with None as `previous` for new events and as `current` for removed ones
+        """
+        self.listeners.append(listener)
+
+    @staticmethod
+    def search_changed(previous: dict = None, current: dict = None) -> bool:
+        """Whether a write may change the events matched by the text searches"""
+        return not (previous and current and all(previous[key] == current[key] for key in SEARCHED_FIELDS))
+
+    def _written(self, event_id: int, previous: dict = None, current: dict = None, notify: bool = True):
+        # RSVPs don't touch any indexed field: skip the reindexing on every click
+        if not (previous and current) or any(previous[key] != current[key] for key in INDEXED_FIELDS):
+            if previous:
+                self._unindex(event_id, previous)
+            if current:
+                self._index(event_id, current)
+
+        # Drop the cached queries that may match differently
+        if self.search_changed(previous, current):
+            owners = {('user_id', document['user_id']) for document in (previous, current) if document}
+            self.query_cache.invalidate('text', *owners)
+
+        if notify:
+            self._notify(event_id, previous, current)
+
+    def _notify(self, event_id: int, previous: dict = None, current: dict = None):
+        for listener in self.listeners:
+            listener(event_id, previous, current)
+
+    def _ranked(self, name: str, user_id: int = None, size: int = None) -> tuple:
+        # The best `size` matches (all with None) are cached, so that the following pages cost only their events
+        if user_id is None:
+            (key, tags) = (('name', name), ('text',))
+        else:
+            (key, tags) = (('name', name, user_id), (('user_id', user_id),))
+
+        cached = self.query_cache.get(key)
+
+        # Cached with whether they are all the matches
+        if cached is not None and (cached[1] or (size is not None and len(cached[0]) >= size)):
+            return cached[0]
+
+        within = self.indexes['user_id'].find(user_id) if user_id is not None else None
+        ids = tuple(self.indexes['text'].search(name, within=within, limit=size))
+        self.query_cache.put(key, (ids, size is None or len(ids) < size), tags)
+
+        return ids
+
+    def _ranking(self, name: str, user_id: int, size: int) -> Iterator[int]:
+        # Ranked only as far as the caller reads (some events may be filtered out): twice as far every time
+        seen = set()
+
+        while True:
+            ids = self._ranked(name, user_id, size)
+
+            for eid in ids:
+                if eid not in seen:
+                    seen.add(eid)
+                    yield eid
+
+            if len(ids) < size:
+                return
+
+            size = len(ids) * 2
+
+    def query(self, name: str = None, user_id: int = None, only_future: bool = False, drafts: bool = None) -> Query:
+        """
+        Events whose title or description match `name` (every event without
+        it), of `user_id`, taking place from now on, only drafts (or none,
+        with False). Ordered by relevance (by id without a name), 'id',
+        'datetime' or '-datetime', events without a date last
+        """
+        def matching(order: str, limit: int = None, offset: int = 0) -> Iterable[int]:
+            now = time.time()
+            candidates = None
+
+            if only_future and not name:
+                # Walk whichever side is smaller: the user's events or the upcoming ones
+                owned = self.indexes['user_id'].find(user_id) if user_id is not None else None
+                if owned is None or self.indexes['datetime'].count(low=now) < len(owned):
+                    candidates = sorted(eid for eid in self.indexes['datetime'].range(low=now)
+                                        if owned is None or eid in owned)
+
+            if candidates is None and order == 'relevance' and limit is not None:
+                candidates = self._ranking(name or '', user_id, max(offset + limit, 1))
+            elif candidates is None:
+                candidates = self._ranked(name or '', user_id)
+
+            ids = (eid for eid in candidates if keep(self.db.get(eid=eid), now))
+
+            if order == 'id':
+                ids = sorted(ids)
+            elif order in ('datetime', '-datetime'):
+                sign = -1 if order == '-datetime' else 1
+                dates = {eid: self.db.get(eid=eid)['datetime'] for eid in ids}
+                ids = sorted(dates, key=lambda eid: (dates[eid] is None, sign * (dates[eid] or 0), eid))
+
+            return itertools.islice(ids, offset, None if limit is None else offset + limit)
+
+        def keep(document: dict, now: float) -> bool:
+            return (document is not None and (not only_future or (document['datetime'] or 0) > now)
+                    and (drafts is None or document['draft'] == drafts))
+
+        def load(ids: List[int]) -> List[Event]:
+            documents = (self.db.get(eid=eid) for eid in ids)
+            return [self._event(document) for document in documents if document is not None]
+
+        return Query(matching, load, ORDERS)
+
+    def insert(self, event: Event):
+        self._register(event.attendees())
+
+        event_id = super().insert(event)
+
+        with self.index_lock:
+            self._written(event_id, current=self.db.get(eid=event_id))
+
+        return event_id
 
     def find_draft(self, user_id: int):
-        results = self.db.search((Query().user_id == user_id) & (Query().draft == True))
+        ids = self.indexes['draft'].find((user_id, True))
 
-        if results:
-            return Event.from_dict(results[0])
+        if ids:
+            return self._event(self.db.get(eid=min(ids)))
         else:
             return None
 
     def remove_draft(self, user_id: int):
-        self.db.remove((Query().user_id == user_id) & (Query().draft == True))
-        self.clear_cache()
+        for event_id in self.indexes['draft'].find((user_id, True)):
+            with self.event_lock(event_id):
+                document = self.db.get(eid=event_id)
+
+                if document is None:
+                    continue
+
+                self.db.remove(eids=[event_id])
+
+                with self.index_lock:
+                    self._written(event_id, previous=document)
+
+    def insert_documents(self, documents: Dict[int, dict]):
+        """Insert (or replace) `documents` by id as they are, in one write"""
+        # Attendees may be whole profiles: the directory keeps the ones it already has
+        documents = {eid: dict(document, **{name: self._attendee_ids(document.get(name) or [])
+                                            for name in RSVP_LISTS.values()})
+                     for (eid, document) in documents.items()}
+
+        # The event locks in the order archive_past() takes them
+        with ExitStack() as locks:
+            for n in sorted({hash(eid) % len(self.event_locks) for eid in documents}):
+                locks.enter_context(self.event_locks[n])
+
+            previous = {eid: self.db.get(eid=eid) for eid in documents}
+            self.db.insert_multiple(list(documents.values()), list(documents))
+
+            with self.index_lock:
+                for eid in documents:
+                    self._written(eid, previous[eid], self.db.get(eid=eid))
+
+    def event_lock(self, event_id: int) -> threading.Lock:
+        return self.event_locks[hash(event_id) % len(self.event_locks)]
 
     def update(self, event: Event):
-        self.db.update(event.to_dict(), eids=[event.id])
-        self.clear_cache()
+        self._register(event.attendees())
+
+        with self.event_lock(event.id):
+            previous = self.db.get(eid=event.id)
+
+            if previous is None:
+                return
+
+            # A new version for every write: what was rendered for the previous one is stale
+            event.version = previous.get('version', 0) + 1
+            self.db.update(event.to_dict(), eids=[event.id])
+
+            with self.index_lock:
+                self._written(event.id, previous, self.db.get(eid=event.id))
+
+    def set_rsvp(self, event_id: int, user: dict, status: str):
+        """
+        Atomically move `user` to the attendee list of `status` ('yes', 'no' or 'maybe'),
+        or out of every list for any other status. Returns the updated event, None if it doesn't exist
+        """
+        with self.event_lock(event_id):
+            previous = self.db.get(eid=event_id)
+
+            if previous is None:
+                return None
+
+            attendance = self._attendance(previous)
+            before = RSVP_LISTS.get(attendance.get(user['id']))
+            after = RSVP_LISTS.get(status)
+
+            # The directory keeps the latest profile of the user: a new one is a new version, rendered again
+            renamed = self.users.save(user) and before is not None
+
+            if before == after and not renamed:
+                return self._event(previous)
+
+            fields = {'version': previous.get('version', 0) + 1}
+            if before and before != after:
+                fields[before] = [u for u in self._attendee_ids(previous[before]) if u != user['id']]
+            if after and after != before:
+                fields[after] = self._attendee_ids(previous[after]) + [user['id']]
+
+            self.db.update(fields, eids=[event_id])
+            current = self.db.get(eid=event_id)
+
+            with self.index_lock:
+                attendance.pop(user['id'], None)
+                if after:
+                    attendance[user['id']] = status
+                self.attendance.put(event_id, (fields['version'], attendance))
+
+                self._written(event_id, previous, current)
+
+            return self._event(current)
+
+    def _attendance(self, document: dict) -> dict:
+        cached = self.attendance.get(document.eid)
+
+        if cached is not None and cached[0] == document.get('version', 0):
+            return cached[1]
+
+        return {u['id'] if isinstance(u, dict) else u: status
+                for (status, name) in RSVP_LISTS.items() for u in document[name]}
 
     def find_by_id(self, event_id: int):
         if not isinstance(event_id, int):
             event_id = int(event_id)
 
-        evt = self.db.get(eid=event_id)
+        evt = self.db.get(eid=event_id) or self.archive.get(event_id)
 
         if evt:
-            return Event.from_dict(evt)
+            return self._event(evt)
         else:
             return None
 
     def find_all(self) -> List[Event]:
-        events = self.db.all()
-        results = []
+        return list(self.query().order_by('id'))
 
-        for event in events:
-            results.append(Event.from_dict(event))
+    def find_by_name(self, name: str, limit: int = None, offset: int = 0) -> List[Event]:
+        """Events whose title or description match `name`, best match first"""
+        return list(self.query(name).offset(offset).limit(limit))
 
-        return results
+    def find_by_name_and_user_id(self, name: str, user_id: int, limit: int = None, offset: int = 0) -> List[Event]:
+        return list(self.query(name, user_id).offset(offset).limit(limit))
 
-    def find_by_name(self, name: str) -> List[Event]:
-        events = self.db.search(Query().title.test(lambda v: name in v))
-        results = []
+    def find_by_user_id(self, user_id: int, only_future: bool):
+        return list(self.query(user_id=user_id, only_future=only_future).order_by('id'))
 
-        for event in events:
-            results.append(Event.from_dict(event))
+    def archive_past(self, now: float = None, batch_size: int = 1000) -> int:
+        """Move the events older than `archive_after` seconds to the archive, returns how many"""
+        if self.archive_after is None:
+            return 0
 
-        return results
+        deadline = (now if now is not None else time.time()) - self.archive_after
+        archived = 0
 
-    def find_by_name_and_user_id(self, name: str, user_id: int) -> List[Event]:
-        events = self.db.search((Query().user_id == user_id) & (Query().title.test(lambda v: name in v)))
-        results = []
+        while True:
+            documents = {}
+            for event_id in self.indexes['datetime'].range(high=deadline):
+                document = self.db.get(eid=event_id)
+                if document is not None and not document['draft']:
+                    documents[event_id] = document
+                    if len(documents) == batch_size:
+                        break
 
-        for event in events:
-            results.append(Event.from_dict(event))
+            if not documents:
+                return archived
 
-        return results
+            # Compressed and synced while the writers carry on: the events they change meanwhile stay live
+            self.archive.append(documents)
 
-    def find_by_user_id(self, user_id: int, only_future: bool):
-        if only_future:
-            events = self.db.search((Query().user_id == user_id) & (Query().datetime > time.time()))
-        else:
-            events = self.db.search((Query().user_id == user_id))
+            # Every writer takes its event lock before the index one: the same order, over all of them
+            with ExitStack() as locks:
+                for lock in self.event_locks:
+                    locks.enter_context(lock)
+                locks.enter_context(self.index_lock)
+
+                changed = [event_id for event_id in documents if self.db.get(eid=event_id) != documents[event_id]]
+                if changed:
+                    self.archive.discard(changed)
+                    for event_id in changed:
+                        del documents[event_id]
+
+                self.db.remove(eids=list(documents))
+                for (event_id, document) in documents.items():
+                    self._written(event_id, previous=document, notify=False)
+
+            for (event_id, document) in documents.items():
+                self._notify(event_id, previous=document)
+
+            archived += len(documents)
+
+    def archive_periodically(self, interval: float):
+        """Call archive_past every `interval` seconds from a daemon thread, until closed"""
+        def archive():
+            while not self.stopped.wait(interval):
+                try:
+                    self.archive_past()
+                except OSError:
+                    self.logger.exception('Archival of the past events failed')
+
+        threading.Thread(target=archive, name='events-archive', daemon=True).start()
 
-        results = []
 
-        for event in events:
-            results.append(Event.from_dict(event))
+def stream(data_dir: str) -> Iterator[Tuple[int, dict]]:
+    """
+    Yield the id and the document of every event stored in `data_dir`,
+    shards and archive included, reading the files a chunk at a time
+    without opening the repository
+    """
+    pattern = re.compile(r'events(\.\d+)?\.(json|journal)$')
+    # Unsharded or sharded, snapshots or just their journals
+    names = (os.path.basename(path) for path in glob.glob(os.path.join(glob.escape(data_dir), 'events*')))
+    paths = sorted({os.path.join(data_dir, 'events{}.json'.format(match.group(1) or ''))
+                    for match in map(pattern.match, names) if match})
+    archive = Archive(os.path.join(data_dir, 'events.archive.gz'))
 
-        return results
+    return itertools.chain(*[JournalDB.stream(path, 'events') for path in paths], archive.items())
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from modules.events.event_repository import RSVP_LISTS
+
+
+def matches(document: dict, user_id: int = None, since: float = None, until: float = None,
+            drafts: bool = None) -> bool:
+    """Whether `document` passes the filters of SqliteEventRepository.stream"""
+    if user_id is not None and document['user_id'] != user_id:
+        return False
+
+    if drafts is not None and bool(document['draft']) != drafts:
+        return False
+
+    if since is not None or until is not None:
+        when = document.get('datetime')
+
+        if when is None or (since is not None and when < since) or (until is not None and when >= until):
+            return False
+
+    return True
+
+
+def export_events(documents: Iterable[Tuple[int, dict]], profiles: Callable[[Iterable[int]], Dict[int, dict]],
+                  output: IO, batch_size: int = 1000) -> int:
+    """
+    Write the events of `documents` to `output` as JSON lines, keeping
+    their ids, `batch_size` at a time. The attendees are written as the
+    profiles found by `profiles(user_ids)`, so that the file holds
+    everything needed to import it anywhere. Returns how many were written
+    """
+    logger = logging.getLogger(__name__)
+    exported = 0
+
+    for batch in _batches(documents, batch_size):
+        found = profiles({attendee for (_, document) in batch for name in RSVP_LISTS.values()
+                          for attendee in document.get(name) or [] if not isinstance(attendee, dict)})
+
+        output.write(''.join(_line(eid, document, found) for (eid, document) in batch))
+        exported += len(batch)
+        logger.info('%d events exported', exported)
+
+    return exported
+
+
+def import_events(lines: IO, repository, batch_size: int = 1000, progress: str = None, resume: bool = False) -> int:
+    """
+    Insert the events written by export_events from the binary file
+    `lines` into `repository`, keeping their ids, `batch_size` in each
+    write: importing the same file again changes nothing. With `progress`,
+    the position reached is saved in that file after every batch, and with
+    `resume` the import starts from there. Returns how many were imported
+    """
+    logger = logging.getLogger(__name__)
+    imported = 0
+
+    if resume and progress and os.path.exists(progress):
+        with open(progress) as state:
+            position = json.load(state)
+
+        lines.seek(position['offset'])
+        imported = position['imported']
+        logger.info('Resuming after %d events', imported)
+
+    batch = {}
+
+    while True:
+        line = lines.readline()
+
+        if line.strip():
+            entry = json.loads(line.decode('utf-8'))
+            batch[entry['eid']] = entry['document']
+
+        if batch and (len(batch) == batch_size or not line):
+            repository.insert_documents(batch)
+            imported += len(batch)
+            batch = {}
+
+            if progress:
+                _save_progress(progress, {'offset': lines.tell(), 'imported': imported})
+            logger.info('%d events imported', imported)
+
+        if not line:
+            break
+
+    if progress and os.path.exists(progress):
+        os.remove(progress)
+
+    return imported
+
+
+def _batches(documents: Iterable[Tuple[int, dict]], batch_size: int) -> Iterator[List[Tuple[int, dict]]]:
+    batch = []
+
+    for item in documents:
+        batch.append(item)
+
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _line(eid: int, document: dict, profiles: Dict[int, dict]) -> str:
+    document = {key: value for (key, value) in document.items() if key != 'id'}
+
+    for name in RSVP_LISTS.values():
+        document[name] = [attendee if isinstance(attendee, dict) else profiles.get(attendee, {'id': attendee})
+                          for attendee in document.get(name) or []]
+
+    return json.dumps({'eid': eid, 'document': document}, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def _save_progress(path: str, position: dict):
+    # Replaced at once: an import interrupted while saving resumes from the previous batch
+    with open(path + '.tmp', 'w') as state:
+        json.dump(position, state)
+        state.flush()
+        os.fsync(state.fileno())
+
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,37 @@
+from modules.abstract.model import MarvinModel
+
+
+class Reminder(MarvinModel):
+    id = None
+
+    event_id = None
+    chat_id = None
+    user_id = None
+
+    # Seconds between two reminders, and timestamp of the next one
+    interval = 3600
+    next_run = None
+
+    def __init__(self, event_id: int, chat_id: int, user_id: int, interval: int = 3600):
+        self.event_id = event_id
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.interval = interval
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'event_id': self.event_id,
+            'chat_id': self.chat_id,
+            'user_id': self.user_id,
+            'interval': self.interval,
+            'next_run': self.next_run,
+        }
+
+    @staticmethod
+    def from_dict(values: dict) -> MarvinModel:
+        reminder = Reminder(values['event_id'], values['chat_id'], values['user_id'], values['interval'])
+        reminder.id = values.eid
+        reminder.next_run = values['next_run']
+
+        return reminder
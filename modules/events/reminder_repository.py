@@ -0,0 +1,72 @@
+from typing import List
+
+from tinydb import Query
+
+from modules.events.reminder_model import Reminder
+from services.index import HashIndex
+from services.storage import Storage
+
+
+class ReminderRepository(Storage):
+    def __init__(self, data_dir: str = './data/'):
+        # Reminders by event, looked up for every event removed or archived (holding the locks of the events)
+        self.event_index = HashIndex(lambda d: d['event_id'])
+
+        super().__init__('reminders', data_dir)
+
+    def open(self):
+        super().open()
+
+        self.event_index.clear()
+        for document in self.db.all():
+            self.event_index.add(document.eid, document)
+
+    def insert(self, reminder: Reminder):
+        with self.db.lock:
+            reminder_id = super().insert(reminder)
+            self.event_index.add(reminder_id, reminder.to_dict())
+
+        return reminder_id
+
+    def update(self, reminder: Reminder):
+        self.update_multiple([reminder])
+
+    def update_multiple(self, reminders: List[Reminder]):
+        with self.db.lock:
+            previous = {reminder.id: self.db.get(eid=reminder.id) for reminder in reminders}
+            self.db.update_multiple({reminder.id: reminder.to_dict() for reminder in reminders})
+
+            for reminder in reminders:
+                if previous[reminder.id] is not None:
+                    self.event_index.discard(reminder.id, previous[reminder.id])
+                    self.event_index.add(reminder.id, reminder.to_dict())
+
+    def remove(self, reminder_id: int):
+        with self.db.lock:
+            previous = self.db.get(eid=reminder_id)
+            self.db.remove(eids=[reminder_id])
+
+            if previous is not None:
+                self.event_index.discard(reminder_id, previous)
+
+    def find_by_id(self, reminder_id: int):
+        reminder = self.db.get(eid=reminder_id)
+
+        if reminder:
+            return Reminder.from_dict(reminder)
+        else:
+            return None
+
+    def find_by_ids(self, reminder_ids: List[int]) -> List[Reminder]:
+        reminders = (self.db.get(eid=reminder_id) for reminder_id in reminder_ids)
+
+        return [Reminder.from_dict(reminder) for reminder in reminders if reminder]
+
+    def find_all(self) -> List[Reminder]:
+        return [Reminder.from_dict(reminder) for reminder in self.db.all()]
+
+    def find_by_chat_id(self, chat_id: int) -> List[Reminder]:
+        return [Reminder.from_dict(reminder) for reminder in self.db.search(Query().chat_id == chat_id)]
+
+    def find_by_event_id(self, event_id: int) -> List[Reminder]:
+        return self.find_by_ids(sorted(self.event_index.find(event_id)))
@@ -0,0 +1,421 @@
+import logging
+import os
+import time
+
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from tinydb.database import Element
+
+from modules.events.event_model import Event
+from modules.events.event_repository import ORDERS, RSVP_LISTS, EventRepository, stream
+from modules.events.sqlite_reminder_repository import SqliteReminderRepository
+from modules.events.sqlite_user_repository import SqliteUserRepository
+from services.journal import JournalDB
+from services.query import Query
+from services.sqlite_storage import SqliteStorage
+
+# RSVP status of every attendee list
+RSVP_STATUSES = {name: status for (status, name) in RSVP_LISTS.items()}
+
+# Bound parameters in a single statement, below SQLite's limit
+BATCH_SIZE = 500
+
+# ORDER BY of every order of query() but relevance, events without a date last
+SQL_ORDERS = {
+    'id': 'events.id',
+    'datetime': 'events.datetime IS NULL, events.datetime, events.id',
+    '-datetime': 'events.datetime IS NULL, events.datetime DESC, events.id',
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    location TEXT NOT NULL DEFAULT '',
+    datetime REAL,
+    draft INTEGER NOT NULL DEFAULT 1,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS events_user_draft ON events (user_id, draft);
+CREATE INDEX IF NOT EXISTS events_datetime ON events (datetime);
+
+CREATE TABLE IF NOT EXISTS attendees (
+    event_id INTEGER NOT NULL REFERENCES events (id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (event_id, user_id)
+) WITHOUT ROWID;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS events_text USING fts5(
+    title, description, content='events', content_rowid='id', tokenize='trigram');
+
+CREATE TRIGGER IF NOT EXISTS events_text_insert AFTER INSERT ON events BEGIN
+    INSERT INTO events_text (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS events_text_delete AFTER DELETE ON events BEGIN
+    INSERT INTO events_text (events_text, rowid, title, description)
+    VALUES ('delete', old.id, old.title, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS events_text_update AFTER UPDATE OF title, description ON events BEGIN
+    INSERT INTO events_text (events_text, rowid, title, description)
+    VALUES ('delete', old.id, old.title, old.description);
+    INSERT INTO events_text (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;
+'''
+
+
+class SqliteEventRepository(SqliteStorage):
+    """
+    Same interface of EventRepository, on SQLite: owner, draft and date are
+    indexed columns, titles and descriptions are searched by a trigram FTS5
+    table, and the attendees are rows of their own, so an RSVP writes only
+    its own row. Several processes can share the database
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, data_dir: str = './data/'):
+        self.listeners = []
+        # Profiles of the attendees, which the events refer to by id
+        self.users = SqliteUserRepository(data_dir)
+
+        super().__init__('events', data_dir)
+
+    def close(self):
+        super().close()
+        self.users.close()
+
+    search_changed = staticmethod(EventRepository.search_changed)
+
+    def subscribe(self, listener: Callable[[int, dict, dict], None]):
+        """
+        Call `listener(event_id, previous, current)` after every write,
+        with None as `previous` for new events and as `current` for removed ones
+        """
+        self.listeners.append(listener)
+
+    def _written(self, event_id: int, previous: dict = None, current: dict = None):
+        for listener in self.listeners:
+            listener(event_id, previous, current)
+
+    def _register(self, users: list):
+        # Profiles already in the directory are newer than the ones held by the events
+        self.users.register(users)
+
+    # Documents, in the layout of the TinyDB ones
+
+    def _documents(self, ids: Iterable[int]) -> Dict[int, Element]:
+        ids = list(ids)
+        documents = {}
+        connection = self.connection()
+
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start:start + BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+
+            for row in connection.execute('SELECT * FROM events WHERE id IN ({})'.format(placeholders), batch):
+                document = dict(row)
+                document['draft'] = bool(document['draft'])
+                document.update({name: [] for name in RSVP_STATUSES})
+                documents[row['id']] = Element(document, row['id'])
+
+            for row in connection.execute('SELECT event_id, user_id, status FROM attendees WHERE event_id IN ({}) '
+                                          'ORDER BY event_id, position'.format(placeholders), batch):
+                documents[row['event_id']][RSVP_LISTS[row['status']]].append(row['user_id'])
+
+        return documents
+
+    def _document(self, event_id: int):
+        return self._documents([event_id]).get(event_id)
+
+    def _events(self, ids: List[int]) -> List[Event]:
+        documents = self._documents(ids)
+        profiles = self.users.find_by_ids({user_id for document in documents.values() for name in RSVP_STATUSES
+                                           for user_id in document[name]})
+
+        return [Event.from_dict(documents[event_id], profiles) for event_id in ids if event_id in documents]
+
+    def _event(self, document: dict) -> Event:
+        return Event.from_dict(document, self.users.find_by_ids(
+            [user_id for name in RSVP_STATUSES for user_id in document[name]]))
+
+    def _ids(self, sql: str, parameters: tuple = ()) -> List[int]:
+        return [row[0] for row in self.connection().execute(sql, parameters)]
+
+    # Writing
+
+    @staticmethod
+    def _columns(event: Event) -> tuple:
+        return (event.user_id, event.title or '', event.description or '', event.location or '', event.datetime,
+                int(bool(event.draft)), event.version)
+
+    @staticmethod
+    def _write_attendees(connection, event_id: int, event: Event):
+        connection.execute('DELETE FROM attendees WHERE event_id = ?', (event_id,))
+        connection.executemany(
+            'INSERT INTO attendees (event_id, user_id, status, position) VALUES (?, ?, ?, ?)',
+            [(event_id, user_id, RSVP_STATUSES[name], position)
+             for name in RSVP_STATUSES
+             for (position, user_id) in enumerate(getattr(event, name))])
+
+    def insert(self, event: Event) -> int:
+        self._register(event.attendees())
+
+        with self.transaction() as connection:
+            cursor = connection.execute('INSERT INTO events (user_id, title, description, location, datetime, '
+                                        'draft, version) VALUES (?, ?, ?, ?, ?, ?, ?)', self._columns(event))
+            event_id = cursor.lastrowid
+            self._write_attendees(connection, event_id, event)
+            current = self._document(event_id)
+
+        self._written(event_id, current=current)
+
+        return event_id
+
+    def insert_documents(self, documents: Dict[int, dict]):
+        """Insert (or replace) `documents` by id as they are, in one transaction"""
+        # Documents stored before the user directory hold the whole profiles of the attendees
+        self._register([attendee for document in documents.values() for name in RSVP_STATUSES
+                        for attendee in document.get(name) or [] if isinstance(attendee, dict)])
+
+        with self.transaction() as connection:
+            # Upserts, not REPLACE: that would delete the rows without the triggers keeping the text index
+            connection.executemany(
+                'INSERT INTO events (id, user_id, title, description, location, datetime, draft, version) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET user_id = excluded.user_id, '
+                'title = excluded.title, description = excluded.description, location = excluded.location, '
+                'datetime = excluded.datetime, draft = excluded.draft, version = excluded.version',
+                [(eid, document['user_id'], document.get('title') or '', document.get('description') or '',
+                  document.get('location') or '', document.get('datetime'), int(bool(document.get('draft'))),
+                  document.get('version', 0)) for (eid, document) in documents.items()])
+            connection.executemany(
+                'DELETE FROM attendees WHERE event_id = ?', [(eid,) for eid in documents])
+            connection.executemany(
+                'INSERT INTO attendees (event_id, user_id, status, position) VALUES (?, ?, ?, ?)',
+                [(eid, attendee['id'] if isinstance(attendee, dict) else attendee, status, position)
+                 for (eid, document) in documents.items()
+                 for (name, status) in RSVP_STATUSES.items()
+                 for (position, attendee) in enumerate(document.get(name) or [])])
+
+    def update(self, event: Event):
+        self._register(event.attendees())
+
+        with self.transaction() as connection:
+            previous = self._document(event.id)
+
+            if previous is None:
+                return
+
+            # A new version for every write: what was rendered for the previous one is stale
+            event.version = previous.get('version', 0) + 1
+            connection.execute('UPDATE events SET user_id = ?, title = ?, description = ?, location = ?, '
+                               'datetime = ?, draft = ?, version = ? WHERE id = ?',
+                               self._columns(event) + (event.id,))
+            self._write_attendees(connection, event.id, event)
+            current = self._document(event.id)
+
+        self._written(event.id, previous, current)
+
+    def set_rsvp(self, event_id: int, user: dict, status: str):
+        """
+        Atomically move `user` to the attendee list of `status` ('yes', 'no' or 'maybe'),
+        or out of every list for any other status. Returns the updated event, None if it doesn't exist
+        """
+        # The directory keeps the latest profile of the user: a new one is a new version, rendered again
+        renamed = self.users.save(user)
+
+        with self.transaction() as connection:
+            previous = self._document(event_id)
+
+            if previous is None:
+                return None
+
+            row = connection.execute('SELECT status FROM attendees WHERE event_id = ? AND user_id = ?',
+                                     (event_id, user['id'])).fetchone()
+            before = row['status'] if row is not None else None
+            after = status if status in RSVP_LISTS else None
+
+            if before == after and not (renamed and before):
+                return self._event(previous)
+
+            if before != after:
+                connection.execute('DELETE FROM attendees WHERE event_id = ? AND user_id = ?',
+                                   (event_id, user['id']))
+                if after:
+                    connection.execute(
+                        'INSERT INTO attendees (event_id, user_id, status, position) SELECT ?, ?, ?, '
+                        'COALESCE(MAX(position), -1) + 1 FROM attendees WHERE event_id = ?',
+                        (event_id, user['id'], after, event_id))
+            connection.execute('UPDATE events SET version = version + 1 WHERE id = ?', (event_id,))
+            current = self._document(event_id)
+
+        self._written(event_id, previous, current)
+
+        return self._event(current)
+
+    def remove_draft(self, user_id: int):
+        with self.transaction() as connection:
+            documents = self._documents(self._ids('SELECT id FROM events WHERE user_id = ? AND draft = 1',
+                                                  (user_id,)))
+            connection.executemany('DELETE FROM events WHERE id = ?', [(event_id,) for event_id in documents])
+
+        for (event_id, document) in documents.items():
+            self._written(event_id, previous=document)
+
+    # Reading
+
+    def find_draft(self, user_id: int):
+        return self.query(user_id=user_id, drafts=True).order_by('id').first()
+
+    def find_by_id(self, event_id: int):
+        if not isinstance(event_id, int):
+            event_id = int(event_id)
+
+        events = self._events([event_id])
+
+        return events[0] if events else None
+
+    def find_all(self) -> List[Event]:
+        return list(self.query().order_by('id'))
+
+    def find_by_name(self, name: str, limit: int = None, offset: int = 0) -> List[Event]:
+        """Events whose title or description match `name`, best match first"""
+        return list(self.query(name).offset(offset).limit(limit))
+
+    def find_by_name_and_user_id(self, name: str, user_id: int, limit: int = None, offset: int = 0) -> List[Event]:
+        return list(self.query(name, user_id).offset(offset).limit(limit))
+
+    def find_by_user_id(self, user_id: int, only_future: bool):
+        return list(self.query(user_id=user_id, only_future=only_future).order_by('id'))
+
+    def stream(self, user_id: int = None, since: float = None, until: float = None, drafts: bool = None,
+               batch_size: int = 1000) -> Iterator[Tuple[int, Element]]:
+        """
+        Yield the id and the document of the events of `user_id`, taking
+        place between `since` and `until`, only drafts (or none, with
+        False), in id order: only `batch_size` of them are read at a time
+        """
+        conditions = ['id > ?']
+        parameters = ()
+
+        for (condition, value) in (('user_id = ?', user_id), ('datetime >= ?', since), ('datetime < ?', until),
+                                   ('draft = ?', None if drafts is None else int(drafts))):
+            if value is not None:
+                conditions.append(condition)
+                parameters += (value,)
+
+        last_id = 0
+
+        while True:
+            ids = self._ids('SELECT id FROM events WHERE {} ORDER BY id LIMIT ?'.format(' AND '.join(conditions)),
+                            (last_id,) + parameters + (batch_size,))
+
+            if not ids:
+                return
+
+            documents = self._documents(ids)
+            for event_id in ids:
+                if event_id in documents:
+                    yield event_id, documents[event_id]
+
+            last_id = ids[-1]
+
+    def query(self, name: str = None, user_id: int = None, only_future: bool = False, drafts: bool = None) -> Query:
+        """Same as EventRepository.query: the filters, the order and the page are all done by SQLite"""
+        def matching(order: str, limit: int = None, offset: int = 0) -> List[int]:
+            (source, parameters, relevance, relevance_parameters) = self._matches(name, user_id, only_future, drafts)
+
+            if order == 'relevance':
+                (order, parameters) = (relevance, parameters + relevance_parameters)
+            else:
+                order = SQL_ORDERS[order]
+
+            return self._ids('SELECT events.id {} ORDER BY {} LIMIT ? OFFSET ?'.format(source, order),
+                             parameters + (-1 if limit is None else limit, offset))
+
+        def total() -> int:
+            (source, parameters, _, _) = self._matches(name, user_id, only_future, drafts)
+
+            return self.connection().execute('SELECT COUNT(*) {}'.format(source), parameters).fetchone()[0]
+
+        return Query(matching, self._events, ORDERS, total)
+
+    @staticmethod
+    def _matches(name: str, user_id: int = None, only_future: bool = False, drafts: bool = None) -> tuple:
+        """FROM and WHERE of the events matching, their parameters, and the best first order with its own"""
+        words = (name or '').split()
+        conditions = []
+        parameters = ()
+
+        if words and all(len(word) >= 3 for word in words):
+            # Trigrams match any substring, case-insensitive; titles weigh twice the descriptions
+            source = 'FROM events_text JOIN events ON events.id = events_text.rowid'
+            conditions.append('events_text MATCH ?')
+            parameters += (' '.join('"{}"'.format(word.replace('"', '""')) for word in words),)
+            (relevance, relevance_parameters) = ('bm25(events_text, 2.0, 1.0), events.id', ())
+        elif words:
+            # Words too short for the trigrams: scanned, titles first
+            source = 'FROM events'
+            likes = tuple('%{}%'.format(word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+                          for word in words)
+            conditions.extend("(events.title LIKE ? ESCAPE '\\' OR events.description LIKE ? ESCAPE '\\')"
+                              for _ in words)
+            parameters += tuple(like for like in likes for _ in range(2))
+            relevance = '({}) DESC, events.id'.format(' AND '.join("events.title LIKE ? ESCAPE '\\'" for _ in words))
+            relevance_parameters = likes
+        else:
+            source = 'FROM events'
+            (relevance, relevance_parameters) = ('events.id', ())
+
+        for (condition, value) in (('events.user_id = ?', user_id),
+                                   ('events.datetime > ?', time.time() if only_future else None),
+                                   ('events.draft = ?', None if drafts is None else int(drafts))):
+            if value is not None:
+                conditions.append(condition)
+                parameters += (value,)
+
+        if conditions:
+            source += ' WHERE ' + ' AND '.join(conditions)
+
+        return source, parameters, relevance, relevance_parameters
+
+
+def migrate(data_dir: str, repository: SqliteEventRepository, reminders: SqliteReminderRepository,
+            batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Copy the events (shards and archive included), the profiles and the
+    reminders of the TinyDB files in `data_dir` into `repository` and
+    `reminders`, keeping their ids, `batch_size` at a time. The files are
+    streamed, never loaded whole, and left as they are: an interrupted
+    migration can just be run again. Returns how many of each were copied
+    """
+    # Profiles first: the events holding whole profiles must not overwrite them
+    return {
+        'users': _copy(JournalDB.stream(os.path.join(data_dir, 'users.json'), 'users'), repository.users,
+                       batch_size),
+        'events': _copy(stream(data_dir), repository, batch_size),
+        'reminders': _copy(JournalDB.stream(os.path.join(data_dir, 'reminders.json'), 'reminders'), reminders,
+                           batch_size),
+    }
+
+
+def _copy(documents: Iterable[tuple], repository, batch_size: int) -> int:
+    logger = logging.getLogger(__name__)
+    copied = 0
+    batch = {}
+
+    for (eid, document) in documents:
+        batch[eid] = document
+
+        if len(batch) == batch_size:
+            repository.insert_documents(batch)
+            copied += len(batch)
+            batch = {}
+            logger.info('%d %s copied', copied, type(repository).__name__)
+
+    repository.insert_documents(batch)
+
+    return copied + len(batch)
@@ -0,0 +1,92 @@
+from typing import Dict, List
+
+from tinydb.database import Element
+
+from modules.events.reminder_model import Reminder
+from services.sqlite_storage import SqliteStorage
+
+# Bound parameters in a single statement, below SQLite's limit
+BATCH_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reminders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    interval INTEGER NOT NULL,
+    next_run REAL
+);
+CREATE INDEX IF NOT EXISTS reminders_chat ON reminders (chat_id);
+CREATE INDEX IF NOT EXISTS reminders_event ON reminders (event_id);
+'''
+
+
+class SqliteReminderRepository(SqliteStorage):
+    """Same interface of ReminderRepository, in the SQLite database of the events"""
+
+    schema = SCHEMA
+
+    def __init__(self, data_dir: str = './data/'):
+        super().__init__('events', data_dir)
+
+    @staticmethod
+    def _reminders(rows) -> List[Reminder]:
+        return [Reminder.from_dict(Element(dict(row), row['id'])) for row in rows]
+
+    def insert(self, reminder: Reminder) -> int:
+        with self.transaction() as connection:
+            return connection.execute(
+                'INSERT INTO reminders (event_id, chat_id, user_id, interval, next_run) VALUES (?, ?, ?, ?, ?)',
+                (reminder.event_id, reminder.chat_id, reminder.user_id, reminder.interval,
+                 reminder.next_run)).lastrowid
+
+    def insert_documents(self, documents: Dict[int, dict]):
+        """Insert (or replace) `documents` by id as they are, in one transaction"""
+        with self.transaction() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO reminders (id, event_id, chat_id, user_id, interval, next_run) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(eid, document['event_id'], document['chat_id'], document['user_id'], document['interval'],
+                  document['next_run']) for (eid, document) in documents.items()])
+
+    def update(self, reminder: Reminder):
+        self.update_multiple([reminder])
+
+    def update_multiple(self, reminders: List[Reminder]):
+        with self.transaction() as connection:
+            connection.executemany(
+                'UPDATE reminders SET event_id = ?, chat_id = ?, user_id = ?, interval = ?, next_run = ? '
+                'WHERE id = ?',
+                [(reminder.event_id, reminder.chat_id, reminder.user_id, reminder.interval, reminder.next_run,
+                  reminder.id) for reminder in reminders])
+
+    def remove(self, reminder_id: int):
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM reminders WHERE id = ?', (reminder_id,))
+
+    def find_by_id(self, reminder_id: int):
+        reminders = self.find_by_ids([reminder_id])
+
+        return reminders[0] if reminders else None
+
+    def find_by_ids(self, reminder_ids: List[int]) -> List[Reminder]:
+        reminders = []
+
+        for start in range(0, len(reminder_ids), BATCH_SIZE):
+            batch = list(reminder_ids[start:start + BATCH_SIZE])
+            reminders.extend(self._reminders(self.connection().execute(
+                'SELECT * FROM reminders WHERE id IN ({}) ORDER BY id'.format(','.join('?' * len(batch))), batch)))
+
+        return reminders
+
+    def find_all(self) -> List[Reminder]:
+        return self._reminders(self.connection().execute('SELECT * FROM reminders ORDER BY id'))
+
+    def find_by_chat_id(self, chat_id: int) -> List[Reminder]:
+        return self._reminders(self.connection().execute('SELECT * FROM reminders WHERE chat_id = ? ORDER BY id',
+                                                         (chat_id,)))
+
+    def find_by_event_id(self, event_id: int) -> List[Reminder]:
+        return self._reminders(self.connection().execute('SELECT * FROM reminders WHERE event_id = ? ORDER BY id',
+                                                         (event_id,)))
@@ -0,0 +1,76 @@
+import json
+
+from typing import Dict, Iterable
+
+from services.sqlite_storage import SqliteStorage
+
+# Bound parameters in a single statement, below SQLite's limit
+BATCH_SIZE = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    profile TEXT NOT NULL
+);
+'''
+
+
+class SqliteUserRepository(SqliteStorage):
+    """
+    Telegram profiles of the attendees, in the SQLite database of the
+    events: every process sharing it reads the profiles saved by the others
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, data_dir: str = './data/'):
+        super().__init__('events', data_dir)
+
+    def save(self, user: dict) -> bool:
+        """Store the profile of `user`, unless it is the one already stored. Returns whether it was"""
+        stored = self.find_by_id(user['id'])
+
+        if stored is not None and dict(stored, **user) == stored:
+            return False
+
+        with self.transaction() as connection:
+            profile = dict(self.find_by_id(user['id']) or {}, **user)
+            connection.execute('INSERT INTO users (id, profile) VALUES (?, ?) '
+                               'ON CONFLICT (id) DO UPDATE SET profile = excluded.profile',
+                               (user['id'], json.dumps(profile)))
+
+        return True
+
+    def register(self, users: Iterable[dict]):
+        """Store the profiles of `users` not stored yet: the ones already there are newer"""
+        rows = [(user['id'], json.dumps(user)) for user in users]
+
+        if rows:
+            with self.transaction() as connection:
+                connection.executemany('INSERT INTO users (id, profile) VALUES (?, ?) ON CONFLICT (id) DO NOTHING',
+                                       rows)
+
+    def insert_documents(self, documents: Dict[int, dict]):
+        """Insert (or replace) the profiles held by `documents`, in one transaction"""
+        with self.transaction() as connection:
+            connection.executemany('INSERT INTO users (id, profile) VALUES (?, ?) '
+                                   'ON CONFLICT (id) DO UPDATE SET profile = excluded.profile',
+                                   [(profile['id'], json.dumps(profile)) for profile in documents.values()])
+
+    def find_by_id(self, user_id: int) -> dict:
+        row = self.connection().execute('SELECT profile FROM users WHERE id = ?', (user_id,)).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    def find_by_ids(self, user_ids: Iterable[int]) -> Dict[int, dict]:
+        user_ids = list(user_ids)
+        profiles = {}
+
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            batch = user_ids[start:start + BATCH_SIZE]
+
+            for row in self.connection().execute('SELECT id, profile FROM users WHERE id IN ({})'.format(
+                    ','.join('?' * len(batch))), batch):
+                profiles[row[0]] = json.loads(row[1])
+
+        return profiles
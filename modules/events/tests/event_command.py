@@ -1,7 +1,14 @@
+import tempfile
 import unittest
 
+from types import SimpleNamespace
 from unittest_data_provider import data_provider
-from modules.events.event_command import EventCommand
+from modules.events.event_command import DESCRIPTION, EventCommand, TITLE
+from modules.events.event_model import Event
+from modules.events.event_repository import EventRepository
+from modules.events.reminder_model import Reminder
+from modules.events.reminder_repository import ReminderRepository
+from telegram.ext import ConversationHandler
 
 
 class TestEventCommand(unittest.TestCase):
@@ -38,6 +45,87 @@ class TestEventCommand(unittest.TestCase):
 
         self.assertTrue(result)
 
+    def test_create_wizard_writes_the_event_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            repository = EventRepository(directory)
+            outbound = SimpleNamespace(put=lambda *args, **kwargs: None)
+            evt_cmd = EventCommand({'create': ['anyone'], 'publish': 'owner'}, repository, outbound,
+                                   ReminderRepository(directory))
+
+            def update(text: str):
+                return SimpleNamespace(message=SimpleNamespace(text=text, chat_id=1, chat=SimpleNamespace(id=1),
+                                                               from_user=SimpleNamespace(id=42, username='arthur'),
+                                                               reply_text=None))
+
+            self.assertEqual(evt_cmd.create_new_command(None, update('/create'), []), TITLE)
+            self.assertEqual(evt_cmd.set_title(None, update('Party')), DESCRIPTION)
+            evt_cmd.skip_desc_command(None, update('/skip'))
+            evt_cmd.set_datetime(None, update('30/10/2100 15:33'))
+
+            self.assertEqual(repository.db.records, 0)
+            self.assertEqual(evt_cmd.set_location(None, update('Milliways')), ConversationHandler.END)
+            self.assertEqual(repository.db.records, 1)
+
+            (event,) = repository.find_by_user_id(42, False)
+            self.assertEqual((event.title, event.location, event.draft), ('Party', 'Milliways', False))
+            self.assertEqual(len(evt_cmd.drafts), 0)
+
+            repository.close()
+            evt_cmd.reminders.close()
+
+    def test_expired_draft_ends_the_wizard(self):
+        with tempfile.TemporaryDirectory() as directory:
+            replies = []
+            outbound = SimpleNamespace(put=lambda chat_id, priority, send, text, **kwargs: replies.append(text))
+            evt_cmd = EventCommand({'create': ['anyone'], 'publish': 'owner'}, EventRepository(directory), outbound,
+                                   ReminderRepository(directory))
+
+            def update(text: str):
+                return SimpleNamespace(message=SimpleNamespace(text=text, chat_id=1, chat=SimpleNamespace(id=1),
+                                                               from_user=SimpleNamespace(id=42, username='arthur'),
+                                                               reply_text=None))
+
+            self.assertEqual(evt_cmd.create_new_command(None, update('/create'), []), TITLE)
+            evt_cmd.drafts.pop(42)
+
+            self.assertEqual(evt_cmd.set_title(None, update('Party')), ConversationHandler.END)
+            self.assertIn('expired', replies[-1])
+            self.assertEqual(evt_cmd.set_title.__name__, 'set_title')
+
+            evt_cmd.repository.close()
+            evt_cmd.reminders.close()
+
+    def test_a_failing_event_does_not_stop_the_other_reminders(self):
+        with tempfile.TemporaryDirectory() as directory:
+            repository = EventRepository(directory)
+            sent = []
+            outbound = SimpleNamespace(put=lambda chat_id, *args, **kwargs: sent.append(chat_id))
+            evt_cmd = EventCommand({'create': ['anyone'], 'publish': 'owner'}, repository, outbound,
+                                   ReminderRepository(directory))
+            evt_cmd.bot = SimpleNamespace(sendMessage=None)
+
+            reminders = []
+            for (chat_id, when) in ((1, 4102444800), (2, None)):
+                # Drafts stored before the wizard kept them in memory may have no date
+                event = Event(42)
+                (event.title, event.datetime) = ('Party', when)
+                reminder = Reminder(repository.insert(event), chat_id, 42)
+                reminder.next_run = 1000
+                reminder.id = evt_cmd.reminders.insert(reminder)
+                reminders.append(reminder)
+
+            with self.assertLogs('modules.events.event_command', 'ERROR'):
+                self.assertRaises(RuntimeError, evt_cmd.reminder_messages, [r.id for r in reminders])
+
+            self.assertEqual(sent, [1])
+            self.assertGreater(evt_cmd.reminders.find_by_id(reminders[0].id).next_run, 1000)
+            self.assertIn(reminders[0].id, evt_cmd.scheduler)
+            self.assertNotIn(reminders[1].id, evt_cmd.scheduler)
+
+            evt_cmd.scheduler.stop()
+            repository.close()
+            evt_cmd.reminders.close()
+
 
 if __name__ == '__main__':
     unittest.main()
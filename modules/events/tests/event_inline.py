@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from modules.events.event_inline import AsyncEventInline, EventInline, render_cache
+from modules.events.event_model import Event
+
+
+class TestEventInline(unittest.TestCase):
+    def setUp(self):
+        # Shared by the whole process: other tests render events with the same id and version
+        render_cache.clear()
+
+    def create_event(self) -> Event:
+        event = Event(42)
+        event.id = 1
+        event.title = 'Party'
+        event.datetime = 0
+        event.location = 'Milliways'
+
+        return event
+
+    def test_create_event_message(self):
+        event = self.create_event()
+        event.users_confirmed = {1: {'id': 1, 'first_name': 'Arthur', 'last_name': 'Dent', 'username': 'arthur'}}
+        event.users_to_be_confirmed = {2: {'id': 2, 'first_name': 'Ford', 'last_name': None}}
+
+        text = EventInline.create_event_message(event)
+
+        self.assertTrue(text.startswith('<b>Party</b> - {}\n'.format(event.formatted_date())))
+        self.assertIn(' Milliways\n\n', text)
+        self.assertIn('@arthur (Arthur Dent)\n\n', text)
+        self.assertTrue(text.endswith(' (Ford)\n'))
+
+    def test_create_event_message_is_rendered_again_for_a_new_version(self):
+        event = self.create_event()
+        event.version = 7
+        before = EventInline.create_event_message(event)
+
+        event.users_confirmed = {1: {'id': 1, 'first_name': 'Arthur'}}
+        self.assertEqual(EventInline.create_event_message(event), before)
+
+        event.version = 8
+        self.assertIn('(Arthur)', EventInline.create_event_message(event))
+
+    def test_answers_are_not_cached_without_a_cache(self):
+        events = [self.create_event()]
+        query = SimpleNamespace(offset=lambda start: SimpleNamespace(limit=lambda size: list(events)))
+        repository = SimpleNamespace(subscribe=lambda listener: None, query=lambda *args: query)
+        inline_query = SimpleNamespace(query='party', from_user=SimpleNamespace(id=42), offset='')
+
+        cached = EventInline({'publish': 'anyone'}, repository, SimpleNamespace())
+        uncached = EventInline({'publish': 'anyone'}, repository, SimpleNamespace(), answer_cache_size=0)
+        for inline in (cached, uncached):
+            inline.inline_answer(inline_query)
+
+        # Written by another process: no invalidation reaches this one
+        events[0] = self.create_event()
+        (events[0].title, events[0].version) = ('Dinner', 2)
+
+        self.assertEqual(cached.inline_answer(inline_query)['results'][0].title, 'Party')
+        self.assertEqual(uncached.inline_answer(inline_query)['results'][0].title, 'Dinner')
+
+    def test_sqlite_answers_are_built_off_the_loop(self):
+        threads = []
+
+        def query(*args):
+            threads.append(threading.current_thread())
+            return SimpleNamespace(offset=lambda start: SimpleNamespace(limit=lambda size: [self.create_event()]))
+
+        answers = []
+        repository = SimpleNamespace(subscribe=lambda listener: None, query=query)
+        bot = SimpleNamespace(answerInlineQuery=lambda query_id, **answer: answers.append(answer))
+        update = SimpleNamespace(inline_query=SimpleNamespace(id='1', query='party', from_user=SimpleNamespace(id=42),
+                                                              offset=''))
+
+        with ThreadPoolExecutor(1) as executor:
+            inline = AsyncEventInline({'publish': 'anyone'}, repository, SimpleNamespace(), executor=executor)
+            asyncio.run(inline.inline_event_list(bot, update))
+
+        self.assertIsNot(threads[0], threading.main_thread())
+        self.assertEqual(answers[0]['results'][0].title, 'Party')
+
+
+if __name__ == '__main__':
+    unittest.main()
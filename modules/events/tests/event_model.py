@@ -0,0 +1,30 @@
+import unittest
+
+from tinydb.database import Element
+
+from modules.events.event_model import Event
+
+
+class TestEventModel(unittest.TestCase):
+    def test_events_do_not_share_attendees(self):
+        first = Event(42)
+        second = Event(42)
+        first.users_confirmed[7] = {'id': 7}
+
+        self.assertEqual(second.users_confirmed, {})
+        self.assertFalse(hasattr(first, '__dict__'))
+
+    def test_from_dict_reads_attendees_by_id_and_with_profile(self):
+        document = Element(dict(Event(42).to_dict(), users_confirmed=[{'id': 7, 'first_name': 'Arthur'}, 8],
+                                users_not_confirmed=[9]), 1)
+
+        event = Event.from_dict(document, {8: {'id': 8, 'first_name': 'Ford'}})
+
+        self.assertEqual(event.users_confirmed, {7: {'id': 7, 'first_name': 'Arthur'},
+                                                 8: {'id': 8, 'first_name': 'Ford'}})
+        self.assertEqual(event.users_not_confirmed, {9: {'id': 9}})
+        self.assertEqual(event.to_dict()['users_confirmed'], [7, 8])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,277 @@
+import tempfile
+import threading
+import unittest
+
+from modules.events.event_model import Event
+from modules.events.event_repository import EventRepository
+
+
+class TestEventRepository(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repository = EventRepository(self.directory.name)
+
+    def tearDown(self):
+        self.repository.close()
+        self.directory.cleanup()
+
+    def create_event(self, user_id: int, title: str) -> Event:
+        event = Event(user_id)
+        event.title = title
+        event.id = self.repository.insert(event)
+        self.repository.update(event)
+
+        return event
+
+    def test_find_draft_follows_updates(self):
+        event = self.create_event(42, 'Party')
+
+        self.assertEqual(self.repository.find_draft(42).id, event.id)
+
+        event.draft = False
+        self.repository.update(event)
+
+        self.assertIsNone(self.repository.find_draft(42))
+        self.assertEqual([e.id for e in self.repository.find_by_user_id(42, False)], [event.id])
+
+    def test_cached_name_search_sees_new_titles(self):
+        event = self.create_event(42, 'Party')
+
+        self.assertEqual([e.id for e in self.repository.find_by_name('Part')], [event.id])
+
+        event.title = 'Dinner'
+        self.repository.update(event)
+
+        self.assertEqual(self.repository.find_by_name('Part'), [])
+        self.assertEqual([e.id for e in self.repository.find_by_name_and_user_id('Din', 42)], [event.id])
+
+    def test_cached_name_search_sees_new_attendees(self):
+        event = self.create_event(42, 'Party')
+        self.repository.find_by_name('Party')
+
+        event.users_confirmed[7] = {'id': 7, 'first_name': 'Arthur'}
+        self.repository.update(event)
+
+        self.assertEqual(len(self.repository.query_cache), 1)
+        self.assertEqual(self.repository.find_by_name('Party')[0].users_confirmed,
+                         {7: {'id': 7, 'first_name': 'Arthur'}})
+
+    def test_name_search_is_case_insensitive_and_filtered_by_owner(self):
+        party = self.create_event(42, 'Summer Party')
+        self.create_event(7, 'party on the beach')
+
+        self.assertEqual(len(self.repository.find_by_name('PARTY')), 2)
+        self.assertEqual([e.id for e in self.repository.find_by_name_and_user_id('party', 42)], [party.id])
+
+    def test_name_search_pages(self):
+        events = [self.create_event(42, 'Party {}'.format(n)) for n in range(5)]
+
+        first_page = self.repository.find_by_name('party', limit=3)
+        second_page = self.repository.find_by_name_and_user_id('party', 42, limit=3, offset=3)
+
+        self.assertEqual([e.id for e in first_page + second_page], [e.id for e in events])
+
+    def test_name_search_ranks_only_the_pages_read(self):
+        events = [self.create_event(42, 'Party {}'.format(n)) for n in range(10)]
+        for event in events[:5]:
+            event.draft = False
+            self.repository.update(event)
+
+        self.assertEqual([e.id for e in self.repository.find_by_name('party', limit=2)], [e.id for e in events[:2]])
+        self.assertEqual(len(self.repository.query_cache.get(('name', 'party'))[0]), 2)
+
+        # The first ranked are not drafts and are filtered out: the ranking goes on until the page is full
+        page = self.repository.query('party', drafts=True).limit(3)
+
+        self.assertEqual([e.id for e in page], [e.id for e in events[5:8]])
+        self.assertEqual(self.repository.query('party').count(), 10)
+
+    def test_query_orders_filters_and_counts(self):
+        events = [self.create_event(42, 'Party {}'.format(n)) for n in range(4)]
+        for (event, when) in zip(events, (4102444800, None, 4102444700, 1000)):
+            (event.datetime, event.draft) = (when, when is None)
+            self.repository.update(event)
+        self.create_event(7, 'Dinner')
+
+        query = self.repository.query('party', 42)
+
+        self.assertEqual([e.id for e in query.order_by('datetime')], [events[n].id for n in (3, 2, 0, 1)])
+        self.assertEqual([e.id for e in query.order_by('-datetime').limit(2)], [events[0].id, events[2].id])
+        self.assertEqual([e.id for e in query.order_by('datetime').offset(1).limit(2)], [events[2].id, events[0].id])
+        self.assertEqual(query.count(), 4)
+        self.assertEqual(self.repository.query(user_id=42, only_future=True, drafts=False).count(), 2)
+        self.assertEqual(self.repository.query(drafts=True).first().id, events[1].id)
+        self.assertEqual(self.repository.query().offset(3).count(), 2)
+        self.assertIsNone(self.repository.query('nothing like it').first())
+
+    def test_set_rsvp_moves_user_between_lists(self):
+        event = self.create_event(42, 'Party')
+
+        self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+        event = self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur Dent'}, 'maybe')
+
+        self.assertEqual(event.users_confirmed, {})
+        self.assertEqual(event.users_to_be_confirmed, {7: {'id': 7, 'first_name': 'Arthur Dent'}})
+
+        event = self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur Dent'}, 'maybe')
+
+        self.assertEqual(len(event.users_to_be_confirmed), 1)
+        self.assertIsNone(self.repository.set_rsvp(event.id + 1, {'id': 7}, 'yes'))
+
+    def test_set_rsvp_bumps_the_version_for_a_new_profile(self):
+        event = self.create_event(42, 'Party')
+        event = self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+        version = event.version
+
+        self.assertEqual(self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur'}, 'yes').version, version)
+        self.assertEqual(self.repository.set_rsvp(event.id, {'id': 8, 'first_name': 'Ford'}, 'none').version, version)
+
+        event = self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur Dent'}, 'yes')
+
+        self.assertGreater(event.version, version)
+        self.assertEqual(event.users_confirmed, {7: {'id': 7, 'first_name': 'Arthur Dent'}})
+
+    def test_set_rsvp_keeps_concurrent_clicks(self):
+        event = self.create_event(42, 'Party')
+        threads = [threading.Thread(target=self.repository.set_rsvp,
+                                    args=(event.id, {'id': user_id, 'first_name': 'User'}, status))
+                   for user_id in range(50) for status in ('maybe', 'yes')]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        event = self.repository.find_by_id(event.id)
+        attendees = list(event.users_confirmed) + list(event.users_to_be_confirmed)
+
+        self.assertEqual(sorted(attendees), list(range(50)))
+
+    def test_profiles_are_stored_once(self):
+        events = [self.create_event(42, 'Party {}'.format(n)) for n in range(3)]
+
+        for event in events:
+            self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+        self.repository.set_rsvp(events[0].id, {'id': 7, 'first_name': 'Arthur Dent'}, 'maybe')
+
+        self.assertEqual(len(self.repository.users.db), 1)
+        self.assertEqual(self.repository.db.get(eid=events[1].id)['users_confirmed'], [7])
+        self.assertEqual(self.repository.find_by_id(events[1].id).users_confirmed,
+                         {7: {'id': 7, 'first_name': 'Arthur Dent'}})
+
+    def test_attendees_stored_with_their_profile_are_moved_to_the_directory(self):
+        event = self.create_event(42, 'Party')
+        self.repository.db.update({'users_confirmed': [{'id': 7, 'first_name': 'Arthur'}]}, eids=[event.id])
+
+        self.assertEqual(self.repository.find_by_id(event.id).users_confirmed, {7: {'id': 7, 'first_name': 'Arthur'}})
+
+        self.repository.set_rsvp(event.id, {'id': 8, 'first_name': 'Ford'}, 'yes')
+
+        self.assertEqual(self.repository.db.get(eid=event.id)['users_confirmed'], [7, 8])
+        self.assertEqual(list(self.repository.find_by_id(event.id).users_confirmed.values()),
+                         [{'id': 7, 'first_name': 'Arthur'}, {'id': 8, 'first_name': 'Ford'}])
+
+    def test_remove_draft(self):
+        self.create_event(42, 'Party')
+        self.repository.remove_draft(42)
+
+        self.assertIsNone(self.repository.find_draft(42))
+        self.assertEqual(self.repository.find_by_name('Party'), [])
+
+    def test_past_events_are_archived_but_found_by_id(self):
+        past = self.create_event(42, 'Past party')
+        past.datetime = 1000
+        past.draft = False
+        self.repository.update(past)
+        self.repository.set_rsvp(past.id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+        upcoming = self.create_event(42, 'Next party')
+        upcoming.datetime = 5000
+        upcoming.draft = False
+        self.repository.update(upcoming)
+        draft = self.create_event(42, 'Draft party')
+        draft.datetime = 1000
+        self.repository.update(draft)
+
+        self.repository.archive_after = 3600
+
+        self.assertEqual(self.repository.archive_past(now=5000), 1)
+        self.assertEqual(self.repository.archive_past(now=5000), 0)
+        self.assertIsNone(self.repository.db.get(eid=past.id))
+        self.assertEqual([e.id for e in self.repository.find_by_user_id(42, False)], [upcoming.id, draft.id])
+        self.assertEqual([e.id for e in self.repository.find_by_name('party')], [upcoming.id, draft.id])
+
+        self.repository.close()
+        self.repository = EventRepository(self.directory.name, 3600)
+
+        archived = self.repository.find_by_id(past.id)
+        self.assertEqual(archived.title, 'Past party')
+        self.assertEqual(archived.users_confirmed, {7: {'id': 7, 'first_name': 'Arthur'}})
+        self.assertIsNone(self.repository.set_rsvp(past.id, {'id': 8, 'first_name': 'Ford'}, 'yes'))
+
+    def test_events_changed_while_archived_are_archived_again(self):
+        events = [self.create_event(42, 'Past party {}'.format(n)) for n in range(2)]
+        for event in events:
+            (event.datetime, event.draft) = (1000, False)
+            self.repository.update(event)
+        self.repository.archive_after = 3600
+        append = self.repository.archive.append
+        batches = []
+
+        def append_then_answer(documents: dict):
+            append(documents)
+            batches.append(sorted(documents))
+            if len(batches) == 1:
+                self.repository.set_rsvp(events[0].id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+
+        self.repository.archive.append = append_then_answer
+
+        # The answer came after the first copy was written: the event stays live and goes with the next batch
+        self.assertEqual(self.repository.archive_past(now=5000), 2)
+        self.assertEqual(batches, [[events[0].id, events[1].id], [events[0].id]])
+        self.assertEqual(len(self.repository.db), 0)
+
+        self.repository.close()
+        self.repository = EventRepository(self.directory.name, 3600)
+
+        self.assertEqual(self.repository.find_by_id(events[0].id).users_confirmed,
+                         {7: {'id': 7, 'first_name': 'Arthur'}})
+        self.assertEqual(self.repository.find_by_id(events[1].id).title, 'Past party 1')
+
+    def test_ids_of_archived_events_are_not_reused(self):
+        for shards in (1, 4):
+            self.repository.close()
+            self.repository = EventRepository(self.directory.name, 3600, shards)
+            self.repository.db.purge()
+
+            past = self.create_event(42, 'Past party')
+            past.datetime = 1000
+            past.draft = False
+            self.repository.update(past)
+
+            self.assertEqual(self.repository.archive_past(now=5000), 1)
+            self.repository.db.compact()
+            self.repository.close()
+
+            self.repository = EventRepository(self.directory.name, 3600, shards)
+
+            self.assertGreater(self.repository.insert(Event(42)), past.id)
+            self.assertEqual(self.repository.find_by_id(past.id).title, 'Past party')
+
+    def test_sharded_events_are_found_by_owner_and_id(self):
+        self.repository.close()
+        self.repository = EventRepository(self.directory.name, shards=4)
+        events = [self.create_event(user_id, 'Party {}'.format(user_id)) for user_id in range(1, 9)]
+
+        self.repository.close()
+        self.repository = EventRepository(self.directory.name, shards=4)
+
+        for event in events:
+            self.assertEqual(self.repository.find_by_id(event.id).title, event.title)
+            self.assertEqual([e.id for e in self.repository.find_by_user_id(event.user_id, False)], [event.id])
+        self.assertEqual(len(self.repository.find_by_name('Party')), 8)
+        self.assertEqual(self.repository.set_rsvp(events[3].id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+                         .users_confirmed, {7: {'id': 7, 'first_name': 'Arthur'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
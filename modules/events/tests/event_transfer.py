@@ -0,0 +1,102 @@
+import io
+import os
+import tempfile
+import unittest
+
+from modules.events import event_repository
+from modules.events.event_model import Event
+from modules.events.event_repository import EventRepository
+from modules.events.event_transfer import export_events, import_events, matches
+from modules.events.sqlite_event_repository import SqliteEventRepository
+from modules.events.user_repository import UserRepository
+
+
+class FailingRepository:
+    def __init__(self, repository, batches: int):
+        self.repository = repository
+        self.batches = batches
+
+    def insert_documents(self, documents: dict):
+        if not self.batches:
+            raise OSError('Disk full')
+
+        self.batches -= 1
+        self.repository.insert_documents(documents)
+
+
+class TestEventTransfer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repository = EventRepository(self.directory.name)
+
+        self.events = []
+        for n in range(7):
+            event = Event(42 if n % 2 else 7)
+            event.title = 'Party {}'.format(n)
+            event.datetime = 1000.0 * n
+            event.draft = n == 6
+            event.id = self.repository.insert(event)
+            self.events.append(event)
+        self.repository.set_rsvp(self.events[1].id, {'id': 8, 'first_name': 'Ford'}, 'yes')
+        self.repository.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def export(self, **filters) -> bytes:
+        output = io.StringIO()
+        users = UserRepository(self.directory.name)
+
+        export_events(((eid, document) for (eid, document) in event_repository.stream(self.directory.name)
+                       if matches(document, **filters)),
+                      lambda user_ids: {user_id: users.profiles[user_id] for user_id in user_ids}, output, 2)
+        users.close()
+
+        return output.getvalue().encode('utf-8')
+
+    def test_filters(self):
+        lines = self.export(user_id=42, since=1000.0, until=5000.0, drafts=False)
+
+        self.assertEqual(len(lines.splitlines()), 2)
+        self.assertIn(b'"users_confirmed":[{"id":8,"first_name":"Ford"}]', lines)
+
+    def test_export_imports_into_sqlite(self):
+        target = tempfile.TemporaryDirectory()
+        repository = SqliteEventRepository(target.name)
+
+        self.assertEqual(import_events(io.BytesIO(self.export()), repository, 3), 7)
+        self.assertEqual(import_events(io.BytesIO(self.export()), repository, 3), 7)
+
+        self.assertEqual([event.id for event in repository.find_all()], [event.id for event in self.events])
+        self.assertEqual(repository.find_by_id(self.events[1].id).users_confirmed,
+                         {8: {'id': 8, 'first_name': 'Ford'}})
+        self.assertEqual([(eid, document['title']) for (eid, document) in repository.stream(drafts=True)],
+                         [(self.events[6].id, 'Party 6')])
+
+        repository.close()
+        target.cleanup()
+
+    def test_interrupted_import_is_resumed(self):
+        target = tempfile.TemporaryDirectory()
+        repository = EventRepository(target.name, shards=2)
+        progress = os.path.join(target.name, 'events.progress')
+        lines = io.BytesIO(self.export())
+
+        with self.assertRaises(OSError):
+            import_events(lines, FailingRepository(repository, 2), 2, progress)
+
+        lines.seek(0)
+        self.assertEqual(import_events(lines, FailingRepository(repository, 2), 2, progress, resume=True), 7)
+        self.assertFalse(os.path.exists(progress))
+
+        self.assertEqual(sorted(event.id for event in repository.find_all()), [event.id for event in self.events])
+        self.assertEqual(repository.find_by_name('party 3')[0].id, self.events[3].id)
+        self.assertEqual(repository.users.find_by_id(8), {'id': 8, 'first_name': 'Ford'})
+        self.assertGreater(repository.insert(Event(42)), self.events[-1].id)
+
+        repository.close()
+        target.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import tempfile
+import unittest
+
+from modules.events.reminder_model import Reminder
+from modules.events.reminder_repository import ReminderRepository
+
+
+class TestReminderRepository(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repository = ReminderRepository(self.directory.name)
+
+    def tearDown(self):
+        self.repository.close()
+        self.directory.cleanup()
+
+    def create_reminder(self, event_id: int, chat_id: int) -> Reminder:
+        reminder = Reminder(event_id, chat_id, 42, 3600)
+        reminder.next_run = 1000.0
+        reminder.id = self.repository.insert(reminder)
+
+        return reminder
+
+    def test_reminders_survive_a_restart(self):
+        first = self.create_reminder(1, 10)
+        second = self.create_reminder(2, 10)
+
+        first.next_run += first.interval
+        self.repository.update(first)
+        self.repository.remove(second.id)
+        self.repository.close()
+
+        self.repository = ReminderRepository(self.directory.name)
+        reminders = self.repository.find_all()
+
+        self.assertEqual([(r.id, r.event_id, r.next_run) for r in reminders], [(first.id, 1, 4600.0)])
+
+    def test_several_reminders_per_chat(self):
+        self.create_reminder(1, 10)
+        self.create_reminder(2, 10)
+        self.create_reminder(1, 20)
+
+        self.assertEqual(sorted(r.event_id for r in self.repository.find_by_chat_id(10)), [1, 2])
+        self.assertEqual(sorted(r.chat_id for r in self.repository.find_by_event_id(1)), [10, 20])
+
+    def test_reminders_are_found_by_event_after_writes_and_restarts(self):
+        first = self.create_reminder(1, 10)
+        second = self.create_reminder(1, 20)
+        moved = self.create_reminder(2, 30)
+
+        moved.event_id = 1
+        self.repository.update(moved)
+        self.repository.remove(second.id)
+
+        self.assertEqual([r.id for r in self.repository.find_by_event_id(1)], [first.id, moved.id])
+        self.assertEqual(self.repository.find_by_event_id(2), [])
+
+        self.repository.close()
+        self.repository = ReminderRepository(self.directory.name)
+
+        self.assertEqual([r.id for r in self.repository.find_by_event_id(1)], [first.id, moved.id])
+
+    def test_update_multiple_keeps_every_reminder_its_own_fields(self):
+        first = self.create_reminder(1, 10)
+        second = self.create_reminder(2, 20)
+
+        first.next_run = 2000.0
+        second.next_run = 3000.0
+        self.repository.update_multiple([first, second])
+
+        self.assertEqual([r.next_run for r in self.repository.find_by_ids([second.id, first.id])], [3000.0, 2000.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import tempfile
+import threading
+import unittest
+
+from modules.events.event_model import Event
+from modules.events.event_repository import EventRepository
+from modules.events.reminder_model import Reminder
+from modules.events.reminder_repository import ReminderRepository
+from modules.events.sqlite_event_repository import SqliteEventRepository, migrate
+from modules.events.sqlite_reminder_repository import SqliteReminderRepository
+
+
+class TestSqliteEventRepository(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repository = SqliteEventRepository(self.directory.name)
+
+    def tearDown(self):
+        self.repository.close()
+        self.directory.cleanup()
+
+    def create_event(self, user_id: int, title: str, repository=None) -> Event:
+        repository = repository or self.repository
+        event = Event(user_id)
+        event.title = title
+        event.id = repository.insert(event)
+        repository.update(event)
+
+        return event
+
+    def test_find_draft_follows_updates(self):
+        event = self.create_event(42, 'Party')
+
+        self.assertEqual(self.repository.find_draft(42).id, event.id)
+
+        event.draft = False
+        event.datetime = 4102444800
+        self.repository.update(event)
+
+        self.assertIsNone(self.repository.find_draft(42))
+        self.assertEqual([e.id for e in self.repository.find_by_user_id(42, True)], [event.id])
+        self.assertEqual(self.repository.find_by_id(event.id).version, 2)
+
+    def test_name_search_matches_substrings_and_short_words(self):
+        party = self.create_event(42, 'Summer Party')
+        beach = self.create_event(7, 'party on the beach')
+
+        self.assertEqual(sorted(e.id for e in self.repository.find_by_name('PARTY')), [party.id, beach.id])
+        self.assertEqual([e.id for e in self.repository.find_by_name('mmer par')], [party.id])
+        self.assertEqual([e.id for e in self.repository.find_by_name('on')], [beach.id])
+        self.assertEqual([e.id for e in self.repository.find_by_name_and_user_id('party', 42)], [party.id])
+
+        beach.title = 'Dinner'
+        self.repository.update(beach)
+
+        self.assertEqual([e.id for e in self.repository.find_by_name('party')], [party.id])
+
+    def test_name_search_pages(self):
+        events = [self.create_event(42, 'Party {}'.format(n)) for n in range(5)]
+
+        first_page = self.repository.find_by_name('party', limit=3)
+        second_page = self.repository.find_by_name_and_user_id('party', 42, limit=3, offset=3)
+
+        self.assertEqual(sorted(e.id for e in first_page + second_page), [e.id for e in events])
+
+    def test_query_orders_filters_and_counts(self):
+        events = [self.create_event(42, 'Party {}'.format(n)) for n in range(4)]
+        for (event, when) in zip(events, (4102444800, None, 4102444700, 1000)):
+            (event.datetime, event.draft) = (when, when is None)
+            self.repository.update(event)
+        self.create_event(7, 'Dinner')
+
+        query = self.repository.query('party', 42)
+
+        self.assertEqual([e.id for e in query.order_by('datetime')], [events[n].id for n in (3, 2, 0, 1)])
+        self.assertEqual([e.id for e in query.order_by('-datetime').limit(2)], [events[0].id, events[2].id])
+        self.assertEqual([e.id for e in query.order_by('datetime').offset(1).limit(2)], [events[2].id, events[0].id])
+        self.assertEqual(query.count(), 4)
+        self.assertEqual(self.repository.query(user_id=42, only_future=True, drafts=False).count(), 2)
+        self.assertEqual(self.repository.query(drafts=True).first().id, events[1].id)
+        self.assertEqual(self.repository.query().offset(3).count(), 2)
+        self.assertIsNone(self.repository.query('nothing like it').first())
+
+    def test_set_rsvp_moves_user_between_lists(self):
+        event = self.create_event(42, 'Party')
+        changes = []
+        self.repository.subscribe(lambda event_id, previous, current: changes.append(event_id))
+
+        self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+        event = self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur Dent'}, 'maybe')
+
+        self.assertEqual(event.users_confirmed, {})
+        self.assertEqual(event.users_to_be_confirmed, {7: {'id': 7, 'first_name': 'Arthur Dent'}})
+
+        event = self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur Dent'}, 'maybe')
+
+        self.assertEqual(len(event.users_to_be_confirmed), 1)
+        self.assertEqual(changes, [event.id, event.id])
+        self.assertIsNone(self.repository.set_rsvp(event.id + 1, {'id': 7}, 'yes'))
+
+    def test_set_rsvp_bumps_the_version_for_a_new_profile(self):
+        event = self.create_event(42, 'Party')
+        event = self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+        version = event.version
+
+        self.assertEqual(self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur'}, 'yes').version, version)
+        self.assertEqual(self.repository.set_rsvp(event.id, {'id': 8, 'first_name': 'Ford'}, 'none').version, version)
+
+        event = self.repository.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur Dent'}, 'yes')
+
+        self.assertGreater(event.version, version)
+        self.assertEqual(event.users_confirmed, {7: {'id': 7, 'first_name': 'Arthur Dent'}})
+
+    def test_set_rsvp_keeps_concurrent_clicks(self):
+        event = self.create_event(42, 'Party')
+        threads = [threading.Thread(target=self.repository.set_rsvp,
+                                    args=(event.id, {'id': user_id, 'first_name': 'User'}, status))
+                   for user_id in range(20) for status in ('maybe', 'yes')]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        event = self.repository.find_by_id(event.id)
+        attendees = list(event.users_confirmed) + list(event.users_to_be_confirmed)
+
+        self.assertEqual(sorted(attendees), list(range(20)))
+
+    def test_remove_draft(self):
+        self.create_event(42, 'Party')
+        self.repository.remove_draft(42)
+
+        self.assertIsNone(self.repository.find_draft(42))
+        self.assertEqual(self.repository.find_by_name('Party'), [])
+
+    def test_processes_share_events_profiles_and_reminders(self):
+        other = SqliteEventRepository(self.directory.name)
+        event = self.create_event(42, 'Party')
+
+        other.set_rsvp(event.id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+        self.repository.users.save({'id': 7, 'first_name': 'Arthur Dent'})
+
+        self.assertEqual(other.find_by_id(event.id).users_confirmed, {7: {'id': 7, 'first_name': 'Arthur Dent'}})
+        other.close()
+
+        reminders = SqliteReminderRepository(self.directory.name)
+        other_reminders = SqliteReminderRepository(self.directory.name)
+        reminder = Reminder(event.id, -100, 42)
+        reminder.next_run = 1000
+        reminder.id = reminders.insert(reminder)
+        reminder.next_run += reminder.interval
+        other_reminders.update(reminder)
+
+        self.assertEqual([r.to_dict() for r in reminders.find_by_chat_id(-100)], [reminder.to_dict()])
+        other_reminders.remove(reminder.id)
+        self.assertEqual(reminders.find_all(), [])
+        reminders.close()
+        other_reminders.close()
+
+    def test_tinydb_events_are_migrated_with_their_ids(self):
+        self.repository.close()
+        tinydb = EventRepository(self.directory.name)
+        events = [self.create_event(42, 'Party {}'.format(n), tinydb) for n in range(5)]
+        tinydb.set_rsvp(events[1].id, {'id': 7, 'first_name': 'Arthur'}, 'yes')
+        tinydb.db.update({'users_not_confirmed': [{'id': 8, 'first_name': 'Ford'}]}, eids=[events[2].id])
+        tinydb.db.remove(eids=[events[4].id])
+        tinydb.close()
+
+        reminders = ReminderRepository(self.directory.name)
+        reminder = Reminder(events[1].id, -100, 42)
+        reminder.next_run = 1000
+        reminder.id = reminders.insert(reminder)
+        reminders.close()
+
+        self.repository = SqliteEventRepository(self.directory.name)
+        sqlite_reminders = SqliteReminderRepository(self.directory.name)
+
+        self.assertEqual(migrate(self.directory.name, self.repository, sqlite_reminders, batch_size=2),
+                         {'events': 4, 'users': 1, 'reminders': 1})
+        self.assertEqual(migrate(self.directory.name, self.repository, sqlite_reminders, batch_size=2),
+                         {'events': 4, 'users': 1, 'reminders': 1})
+        self.assertEqual(sqlite_reminders.find_by_event_id(events[1].id)[0].to_dict(), reminder.to_dict())
+        sqlite_reminders.close()
+        self.assertEqual([e.id for e in self.repository.find_all()], [e.id for e in events[:4]])
+        self.assertEqual(self.repository.find_by_id(events[1].id).users_confirmed,
+                         {7: {'id': 7, 'first_name': 'Arthur'}})
+        self.assertEqual(self.repository.find_by_id(events[2].id).users_not_confirmed,
+                         {8: {'id': 8, 'first_name': 'Ford'}})
+        self.assertEqual([e.id for e in self.repository.find_by_name('party 3')], [events[3].id])
+        self.assertGreater(self.repository.insert(Event(42)), events[3].id)
+
+
+if __name__ == '__main__':
+    unittest.main()
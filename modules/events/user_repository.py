@@ -0,0 +1,43 @@
+from services.storage import Storage
+
+
+class UserRepository(Storage):
+    """Telegram profiles of the attendees, stored once however many events they answer"""
+
+    def __init__(self, data_dir: str = './data/'):
+        # Profiles and ids of their documents, by user id
+        self.profiles = {}
+        self.eids = {}
+
+        super().__init__('users', data_dir)
+
+    def open(self):
+        super().open()
+
+        self.profiles = {}
+        self.eids = {}
+
+        for document in self.db.all():
+            self.profiles[document['id']] = dict(document)
+            self.eids[document['id']] = document.eid
+
+    def save(self, user: dict) -> bool:
+        """Store the profile of `user`, unless it is the one already stored. Returns whether it was"""
+        with self.db.lock:
+            stored = self.profiles.get(user['id'])
+            profile = dict(stored or {}, **user)
+
+            if profile == stored:
+                return False
+
+            if stored is None:
+                self.eids[user['id']] = self.db.insert(profile)
+            else:
+                self.db.update(user, eids=[self.eids[user['id']]])
+
+            self.profiles[user['id']] = profile
+
+        return True
+
+    def find_by_id(self, user_id: int) -> dict:
+        return self.profiles.get(user_id)
@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import logging
+import threading
+
+from concurrent.futures import Executor
+
+from telegram.error import TelegramError
+from telegram.ext import ConversationHandler, Dispatcher
+
+from services.processes import sender_key
+
+
+class AsyncProxy:
+    """
+    Coroutine version of every method of `target`, run by `executor` (the
+    default executor of the loop if None): the blocking storage and HTTP
+    calls never hold the event loop
+    """
+
+    def __init__(self, target, executor: Executor = None):
+        self.target = target
+        self.executor = executor
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.target, name)
+
+        if not callable(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            return await asyncio.get_event_loop().run_in_executor(
+                self.executor, functools.partial(attribute, *args, **kwargs))
+
+        return call
+
+
+class AsyncPolling:
+    """
+    Long polling on an asyncio event loop. Handlers whose callback is a
+    coroutine function are awaited on the loop, up to `concurrency` updates
+    at once; the others are checked and run in a single call in `executor`,
+    one update at a time for each ConversationHandler, which keeps the
+    update it checked until it handles it. The updates of the same sender
+    are processed in order
+    """
+
+    def __init__(self, dispatcher: Dispatcher, executor: Executor = None, concurrency: int = 1000,
+                 timeout: int = 10):
+        self.dispatcher = dispatcher
+        self.bot = AsyncProxy(dispatcher.bot, executor)
+        self.executor = executor
+        self.semaphore = None
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.running = False
+        # Lock and updates waiting for it, by sender
+        self.senders = {}
+        self.conversation_locks = {}
+        # Updates in progress: the loop only keeps weak references to its tasks
+        self.tasks = set()
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """Poll until stop() is called, on a new event loop"""
+        loop = asyncio.new_event_loop()
+
+        try:
+            loop.run_until_complete(self.run())
+        finally:
+            loop.close()
+
+    def stop(self):
+        self.running = False
+
+    async def run(self):
+        self.running = True
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        offset = None
+
+        # Telegram refuses getUpdates while the webhook of a run in webhook mode is still set
+        while self.running:
+            try:
+                await self.bot.deleteWebhook()
+                break
+            except TelegramError as e:
+                self.logger.warning('Error while removing the webhook: %s', e)
+                await asyncio.sleep(1)
+
+        while self.running:
+            try:
+                updates = await self.bot.getUpdates(offset=offset, timeout=self.timeout)
+            except TelegramError as e:
+                self.logger.warning('Error while getting updates: %s', e)
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                offset = update.update_id + 1
+
+                # Past the limit, polling waits for the updates in progress
+                await self.semaphore.acquire()
+                task = asyncio.ensure_future(self.process_update(update))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def process_update(self, update):
+        """Same as Dispatcher.process_update, awaiting the coroutine handlers"""
+        key = sender_key(update)
+        (lock, waiting) = self.senders.get(key, (None, 0))
+        lock = lock or asyncio.Lock()
+        self.senders[key] = (lock, waiting + 1)
+
+        try:
+            async with lock:
+                await self._process_update(update)
+        finally:
+            (lock, waiting) = self.senders[key]
+            if waiting == 1:
+                del self.senders[key]
+            else:
+                self.senders[key] = (lock, waiting - 1)
+
+            self.semaphore.release()
+
+    def _handle(self, handler, update) -> bool:
+        if isinstance(handler, ConversationHandler):
+            # Checked and handled holding the lock of the conversation: no other update is checked in between
+            with self.conversation_locks.setdefault(handler, threading.Lock()):
+                if not handler.check_update(update):
+                    return False
+
+                handler.handle_update(update, self.dispatcher)
+                return True
+
+        if not handler.check_update(update):
+            return False
+
+        handler.handle_update(update, self.dispatcher)
+        return True
+
+    async def _process_update(self, update):
+        dispatcher = self.dispatcher
+        loop = asyncio.get_event_loop()
+
+        for group in dispatcher.groups:
+            for handler in dispatcher.handlers[group]:
+                try:
+                    callback = getattr(handler, 'callback', None)
+
+                    if asyncio.iscoroutinefunction(callback):
+                        if not handler.check_update(update):
+                            continue
+
+                        await callback(dispatcher.bot, update, **handler.collect_optional_args(dispatcher, update))
+                    elif not await loop.run_in_executor(self.executor, self._handle, handler, update):
+                        continue
+                    break
+                except TelegramError as te:
+                    self.logger.warning('A TelegramError was raised while processing the Update.')
+
+                    try:
+                        dispatcher.dispatch_error(update, te)
+                    except Exception:
+                        self.logger.exception('An uncaught error was raised while handling the error')
+                    break
+                except Exception:
+                    self.logger.exception('An uncaught error was raised while processing the update')
+                    break
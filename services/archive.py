@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import threading
+import zlib
+
+from typing import Dict, Iterable
+
+from tinydb.database import Element
+
+from services.cache import TaggedCache
+
+
+class Archive:
+    """
+    Cold, read-only store of documents no longer in the live table.
+
+    Every call to append() writes one gzip member holding the documents as
+    JSON lines at the end of `path`, and records the ids it holds in an
+    index file next to it: a lookup decompresses only that member. Only the
+    index (a few bytes per document) and the last `cache_size` documents
+    read are kept in memory
+    """
+
+    def __init__(self, path: str, cache_size: int = 256):
+        self.path = path
+        self.index_path = path + '.index'
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+        # Offset of the member holding every archived id
+        self.offsets = {}
+        self.documents = TaggedCache(cache_size)
+
+        self._load()
+
+    def __contains__(self, eid: int) -> bool:
+        return eid in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, documents: Dict[int, dict]):
+        """Archive `documents` by id: once this returns they can be removed from the live table"""
+        if not documents:
+            return
+
+        lines = ''.join(json.dumps({'eid': eid, 'document': document}, separators=(',', ':')) + '\n'
+                        for (eid, document) in documents.items())
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        member = compressor.compress(lines.encode('utf-8')) + compressor.flush()
+
+        with self.lock:
+            with open(self.path, 'ab') as archive:
+                offset = archive.tell()
+                archive.write(member)
+                archive.flush()
+                os.fsync(archive.fileno())
+
+            # Written after the member: an index entry always points to complete data
+            with open(self.index_path, 'a') as index:
+                index.write(json.dumps({'offset': offset, 'ids': list(documents)}) + '\n')
+                index.flush()
+                os.fsync(index.fileno())
+
+            for eid in documents:
+                self.offsets[eid] = offset
+                self.documents.invalidate(eid)
+
+    def discard(self, eids: Iterable[int]):
+        """Forget the archived copy of `eids`, which are to stay in the live table"""
+        eids = list(eids)
+
+        with self.lock:
+            with open(self.index_path, 'a') as index:
+                index.write(json.dumps({'discarded': eids}) + '\n')
+                index.flush()
+                os.fsync(index.fileno())
+
+            for eid in eids:
+                self.offsets.pop(eid, None)
+                self.documents.invalidate(eid)
+
+    def get(self, eid: int):
+        offset = self.offsets.get(eid)
+
+        if offset is None:
+            return None
+
+        document = self.documents.get(eid)
+
+        if document is None:
+            document = self._read(offset).get(eid)
+            if document is not None:
+                self.documents.put(eid, document, (eid,))
+
+        return Element(document, eid) if document is not None else None
+
+    def items(self):
+        """Yield the id and the document of everything archived, a member at a time"""
+        members = {}
+        for (eid, offset) in self.offsets.items():
+            members.setdefault(offset, set()).add(eid)
+
+        for (offset, ids) in sorted(members.items()):
+            for (eid, document) in self._read(offset).items():
+                # Archived again later: the newest member has it
+                if eid in ids:
+                    yield eid, document
+
+    def _read(self, offset: int) -> Dict[int, dict]:
+        decompressor = zlib.decompressobj(31)
+        data = b''
+
+        with open(self.path, 'rb') as archive:
+            archive.seek(offset)
+
+            while not decompressor.eof:
+                chunk = archive.read(65536)
+                if not chunk:
+                    break
+                data += decompressor.decompress(chunk)
+
+        return {entry['eid']: entry['document'] for entry in map(json.loads, data.decode('utf-8').splitlines())}
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+        with open(self.index_path) as index:
+            for line in index:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write: its member was never acknowledged, the documents are still live
+                    self.logger.warning('Discarding the archive index %s from %r', self.index_path, line)
+                    break
+
+                if 'discarded' in entry:
+                    for eid in entry['discarded']:
+                        self.offsets.pop(eid, None)
+                elif entry['offset'] < size:
+                    for eid in entry['ids']:
+                        self.offsets[eid] = entry['offset']
+
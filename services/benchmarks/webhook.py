@@ -0,0 +1,112 @@
+import http.client
+import json
+import statistics
+import threading
+import time
+
+from services.webhook import WebhookServer
+
+CLIENTS = 8
+UPDATES = 4000
+# Workers, queue size and seconds spent by the handlers on every update
+SETUPS = ((4, 1000, 0.0), (4, 1000, 0.001), (16, 1000, 0.001), (4, 100, 0.005))
+
+
+class Dispatcher:
+    """Stands in for the real one: counts the updates, spending `delay` seconds on each"""
+
+    bot = None
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.processed = 0
+        self.lock = threading.Lock()
+
+    def process_update(self, update):
+        if self.delay:
+            time.sleep(self.delay)
+
+        with self.lock:
+            self.processed += 1
+
+
+def synthetic_update(update_id: int) -> bytes:
+    return json.dumps({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': update_id % 1000, 'type': 'private'},
+            'from': {'id': update_id % 1000, 'first_name': 'User'},
+            'text': '/create',
+        },
+    }).encode('utf-8')
+
+
+def post(port: int, update_ids: range, timings: list, statuses: dict, lock: threading.Lock):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+
+    for update_id in update_ids:
+        start = time.perf_counter()
+        connection.request('POST', '/telegram', synthetic_update(update_id), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+
+        with lock:
+            timings.append((time.perf_counter() - start) * 1e3)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    connection.close()
+
+
+def measure(workers: int, queue_size: int, delay: float) -> dict:
+    dispatcher = Dispatcher(delay)
+    server = WebhookServer(dispatcher, port=0, path='/telegram', workers=workers, queue_size=queue_size)
+    threading.Thread(target=server.start, daemon=True).start()
+
+    timings = []
+    statuses = {}
+    lock = threading.Lock()
+    port = server.server_address[1]
+    per_client = UPDATES // CLIENTS
+    clients = [threading.Thread(target=post, args=(port, range(n * per_client, (n + 1) * per_client),
+                                                   timings, statuses, lock))
+               for n in range(CLIENTS)]
+
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    received = time.perf_counter() - start
+
+    # Throughput counts the updates handled, not only accepted
+    while dispatcher.processed < statuses.get(200, 0):
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    server.stop()
+    timings.sort()
+
+    return {
+        'accepted/s': statuses.get(200, 0) / received,
+        'handled/s': dispatcher.processed / elapsed,
+        'refused': statuses.get(503, 0),
+        'p50': statistics.median(timings),
+        'p99': timings[int(len(timings) * 0.99) - 1],
+    }
+
+
+def run():
+    print('{:>7} {:>6} {:>9} {:>11} {:>10} {:>8} {:>9} {:>9}'.format(
+        'workers', 'queue', 'work (ms)', 'accepted/s', 'handled/s', 'refused', 'p50 (ms)', 'p99 (ms)'))
+
+    for (workers, queue_size, delay) in SETUPS:
+        result = measure(workers, queue_size, delay)
+        print('{:>7} {:>6} {:>9.1f} {:>11.0f} {:>10.0f} {:>8} {:>9.2f} {:>9.2f}'.format(
+            workers, queue_size, delay * 1e3, result['accepted/s'], result['handled/s'], result['refused'],
+            result['p50'], result['p99']))
+
+
+if __name__ == '__main__':
+    run()
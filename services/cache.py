@@ -0,0 +1,88 @@
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Hashable, Iterable
+
+
+class TaggedCache:
+    """
+    Bounded LRU cache whose entries are labelled with tags, so that a write
+    can drop only the entries depending on what it touched. Entries older
+    than `ttl` seconds (if given) are dropped as well
+    """
+
+    def __init__(self, capacity: int = 256, ttl: float = None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._discard(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value, tags: Iterable[Hashable] = ()):
+        with self.lock:
+            self._discard(key)
+
+            tags = frozenset(tags)
+            expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+            self.entries[key] = (value, tags, expiry)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+
+            while len(self.entries) > self.capacity:
+                self._discard(next(iter(self.entries)))
+
+    def invalidate(self, *tags: Hashable):
+        with self.lock:
+            for tag in tags:
+                for key in list(self.tags.get(tag, ())):
+                    self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0.0,
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _discard(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+
+        if entry is None:
+            return
+
+        for tag in entry[1]:
+            keys = self.tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self.tags[tag]
@@ -0,0 +1,245 @@
+import heapq
+
+from bisect import bisect_left, bisect_right, insort
+from typing import Callable, Dict, Iterable, List
+
+
+class HashIndex:
+    """
+    Secondary index mapping a key computed from a document
+    to the ids of all the documents sharing it
+    """
+
+    def __init__(self, key: Callable[[dict], object]):
+        self.key = key
+        self.entries = {}
+
+    def add(self, eid: int, document: dict):
+        key = self.key(document)
+
+        if key is not None:
+            self.entries.setdefault(key, set()).add(eid)
+
+    def discard(self, eid: int, document: dict):
+        key = self.key(document)
+        ids = self.entries.get(key)
+
+        if ids is not None:
+            ids.discard(eid)
+            if not ids:
+                del self.entries[key]
+
+    def find(self, key) -> frozenset:
+        return frozenset(self.entries.get(key, ()))
+
+    def count(self, key) -> int:
+        return len(self.entries.get(key, ()))
+
+    def clear(self):
+        self.entries.clear()
+
+
+class SortedIndex:
+    """
+    Secondary index keeping (key, id) pairs ordered by key,
+    used for range lookups. Documents with a None key are not indexed
+    """
+
+    def __init__(self, key: Callable[[dict], object]):
+        self.key = key
+        self.entries = []
+
+    def add(self, eid: int, document: dict):
+        key = self.key(document)
+
+        if key is not None:
+            insort(self.entries, (key, eid))
+
+    def discard(self, eid: int, document: dict):
+        key = self.key(document)
+
+        if key is None:
+            return
+
+        position = bisect_left(self.entries, (key, eid))
+        if position < len(self.entries) and self.entries[position] == (key, eid):
+            del self.entries[position]
+
+    def _bounds(self, low=None, high=None) -> (int, int):
+        start = 0 if low is None else bisect_right(self.entries, (low, float('inf')))
+        end = len(self.entries) if high is None else bisect_left(self.entries, (high, float('-inf')))
+
+        return start, max(start, end)
+
+    def range(self, low=None, high=None) -> List[int]:
+        """Ids of the documents with low < key < high, ordered by key"""
+        (start, end) = self._bounds(low, high)
+
+        return [eid for (key, eid) in self.entries[start:end]]
+
+    def count(self, low=None, high=None) -> int:
+        (start, end) = self._bounds(low, high)
+
+        return end - start
+
+    def clear(self):
+        self.entries.clear()
+
+
+class TextIndex:
+    """
+    Case-insensitive full text index over some fields of the documents.
+
+    Every word is indexed for prefix matching; the fields listed in `grams`
+    are indexed by trigram as well, so any substring of them can be found.
+    Matches are ranked using the weight given to each field
+    """
+
+    def __init__(self, fields: Dict[str, int], grams: Iterable[str] = (), scan_threshold: int = 256):
+        self.fields = fields
+        self.scan_threshold = scan_threshold
+        self.gram_fields = tuple(grams)
+        self.texts = {}
+        self.grams = {}
+        self.words = {}
+        self.vocabulary = []
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return ' '.join((text or '').casefold().split())
+
+    @staticmethod
+    def trigrams(text: str) -> set:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, eid: int, document: dict):
+        texts = {field: self.normalize(document.get(field)) for field in self.fields}
+        self.texts[eid] = texts
+
+        for gram in set().union(*(self.trigrams(texts[field]) for field in self.gram_fields)):
+            self.grams.setdefault(gram, set()).add(eid)
+
+        for word in set(' '.join(texts.values()).split()):
+            if word not in self.words:
+                self.words[word] = set()
+                insort(self.vocabulary, word)
+            self.words[word].add(eid)
+
+    def discard(self, eid: int, document: dict):
+        texts = self.texts.pop(eid, None)
+
+        if texts is None:
+            return
+
+        for gram in set().union(*(self.trigrams(texts[field]) for field in self.gram_fields)):
+            self._discard_posting(self.grams, gram, eid)
+
+        for word in set(' '.join(texts.values()).split()):
+            if self._discard_posting(self.words, word, eid):
+                del self.vocabulary[bisect_left(self.vocabulary, word)]
+
+    @staticmethod
+    def _discard_posting(postings: dict, key: str, eid: int) -> bool:
+        ids = postings.get(key)
+
+        if ids is not None:
+            ids.discard(eid)
+            if not ids:
+                del postings[key]
+                return True
+
+        return False
+
+    def clear(self):
+        self.texts.clear()
+        self.grams.clear()
+        self.words.clear()
+        self.vocabulary.clear()
+
+    def search(self, query: str, within: frozenset = None, limit: int = None) -> List[int]:
+        """
+        Ids of the documents matching `query`, best first. A document matches
+        when the query is a substring of a trigram field or when every word of
+        the query is the prefix of one of its words. `within` restricts the
+        search to the given ids, `limit` to the best ones (which are the only
+        ones ranked)
+        """
+        needle = self.normalize(query)
+
+        if not needle:
+            ids = list(within if within is not None else self.texts)
+            return sorted(ids) if limit is None else heapq.nsmallest(limit, ids)
+
+        if within is not None and len(within) <= self.scan_threshold:
+            # Few documents to look at (e.g. the events of one owner): ranking them is the filter
+            candidates = within
+        else:
+            candidates = self._candidates(needle, within)
+
+        query_words = needle.split() if ' ' in needle else None
+        scores = ((self._score(eid, needle, query_words), eid) for eid in candidates)
+        ranked = ((-score, eid) for (score, eid) in scores if score > 0)
+
+        return [eid for (score, eid) in (sorted(ranked) if limit is None else heapq.nsmallest(limit, ranked))]
+
+    def _candidates(self, needle: str, within: frozenset = None) -> set:
+        candidates = self._intersect([self._prefixed(word) for word in needle.split()], within)
+
+        if len(needle) >= 3 and self.gram_fields:
+            grams = [self.grams.get(gram, ()) for gram in self.trigrams(needle)]
+            candidates = candidates | self._intersect(grams, within)
+
+        return candidates
+
+    def _prefixed(self, prefix: str) -> set:
+        ids = set()
+        position = bisect_left(self.vocabulary, prefix)
+
+        # Searches don't hold the lock of the writers: words may leave the vocabulary meanwhile
+        while True:
+            try:
+                word = self.vocabulary[position]
+            except IndexError:
+                break
+
+            if not word.startswith(prefix):
+                break
+
+            ids.update(self.words.get(word, ()))
+            position += 1
+
+        return ids
+
+    @staticmethod
+    def _intersect(postings: list, within: frozenset = None) -> set:
+        if within is not None:
+            postings = postings + [within]
+
+        if not postings:
+            return set()
+
+        # Start from the shortest posting list and probe the others
+        postings = sorted(postings, key=len)
+
+        return set(postings[0]).intersection(*postings[1:])
+
+    def _score(self, eid: int, needle: str, query_words: list = None) -> int:
+        score = 0
+        texts = self.texts.get(eid)
+
+        # Discarded since it became a candidate (or never indexed, when given by `within`)
+        if texts is None:
+            return score
+
+        for (field, text) in texts.items():
+            if needle in text:
+                quality = 8 if text == needle else 4 if text.startswith(needle) else 2
+            elif query_words and all(any(word.startswith(q) for word in text.split()) for q in query_words):
+                # A single word prefix is a substring as well: only queries of many words get here
+                quality = 1
+            else:
+                continue
+
+            score += self.fields[field] * quality
+
+        return score
@@ -0,0 +1,465 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import zlib
+
+from typing import Callable, Dict, List
+
+from tinydb.database import Element
+
+from exceptions import StorageInUseError
+
+# Lock files held by this process, with how many dbs opened them: other processes can't open those dbs
+_owners = {}
+_owners_lock = threading.Lock()
+
+
+def _own(path: str):
+    with _owners_lock:
+        if path not in _owners:
+            owner = open(path, 'a')
+            try:
+                fcntl.flock(owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                owner.close()
+                raise StorageInUseError('{} is open in another process'.format(path))
+
+            _owners[path] = [owner, 0]
+
+        _owners[path][1] += 1
+
+
+def _disown(path: str):
+    with _owners_lock:
+        _owners[path][1] -= 1
+
+        if not _owners[path][1]:
+            _owners.pop(path)[0].close()
+
+
+class JournalDB:
+    """
+    Single table document store kept in memory.
+
+    The table is persisted as a snapshot (same layout of a TinyDB JSON file)
+    plus an append-only journal: every write appends one checksummed record
+    and never rewrites the snapshot. At startup the journal is replayed over
+    the snapshot; once it grows past `compact_threshold` records it is folded
+    into a new snapshot by a background thread.
+
+    Only one process at a time can open it: the others raise StorageInUseError
+    """
+
+    def __init__(self, path: str, default_table: str = '_default', compact_threshold: int = 1000,
+                 sync: bool = True):
+        self.path = path
+        self.journal_path = os.path.splitext(path)[0] + '.journal'
+        self.table_name = default_table
+        self.compact_threshold = compact_threshold
+        self.sync = sync
+        self.logger = logging.getLogger(__name__)
+
+        self.data = {}
+        self.last_id = 0
+        self.records = 0
+
+        self.lock = threading.RLock()
+        self.compaction = None
+        self.journal = None
+        self.owner = None
+
+        self._load()
+
+    # Reading
+
+    def get(self, cond: Callable = None, eid: int = None):
+        if eid is not None:
+            document = self.data.get(eid)
+            return Element(document, eid) if document is not None else None
+
+        for element in self.search(cond):
+            return element
+
+        return None
+
+    def all(self) -> List[Element]:
+        return [Element(document, eid) for (eid, document) in list(self.data.items())]
+
+    def search(self, cond: Callable) -> List[Element]:
+        return [element for element in self.all() if cond(element)]
+
+    def contains(self, cond: Callable = None, eids: list = None) -> bool:
+        if eids is not None:
+            return any(eid in self.data for eid in eids)
+
+        return self.get(cond) is not None
+
+    def count(self, cond: Callable) -> int:
+        return len(self.search(cond))
+
+    def __len__(self):
+        return len(self.data)
+
+    # Writing
+
+    def insert(self, document: dict) -> int:
+        if not isinstance(document, dict):
+            raise ValueError('Element is not a dictionary')
+
+        with self.lock:
+            self.last_id += 1
+            eid = self.last_id
+
+            self._commit([{'op': 'insert', 'eid': eid, 'document': document}])
+
+        return eid
+
+    def insert_multiple(self, documents: list, eids: List[int] = None) -> List[int]:
+        """Insert `documents` with new ids, or with the ones given (replacing the documents holding them)"""
+        with self.lock:
+            if eids is None:
+                first_id = self.last_id + 1
+                self.last_id += len(documents)
+                eids = list(range(first_id, self.last_id + 1))
+
+            self._commit([{'op': 'insert', 'eid': eid, 'document': document}
+                          for (eid, document) in zip(eids, documents)])
+
+        return eids
+
+    def update(self, fields: dict, cond: Callable = None, eids: list = None) -> List[int]:
+        with self.lock:
+            eids = self._resolve(cond, eids)
+            self._commit([{'op': 'update', 'eid': eid, 'fields': fields} for eid in eids])
+
+        return eids
+
+    def update_multiple(self, updates: Dict[int, dict]) -> List[int]:
+        """Update every document by id with its own fields, in a single journal write"""
+        with self.lock:
+            eids = self._resolve(None, list(updates))
+            self._commit([{'op': 'update', 'eid': eid, 'fields': updates[eid]} for eid in eids])
+
+        return eids
+
+    def remove(self, cond: Callable = None, eids: list = None) -> List[int]:
+        with self.lock:
+            eids = self._resolve(cond, eids)
+            self._commit([{'op': 'remove', 'eid': eid} for eid in eids])
+
+        return eids
+
+    def purge(self):
+        with self.lock:
+            self._commit([{'op': 'remove', 'eid': eid} for eid in list(self.data)])
+            self.last_id = 0
+
+    def clear_cache(self):
+        # Every read is served from memory: there is no query cache to drop
+        pass
+
+    def close(self):
+        compaction = self.compaction
+        if compaction is not None:
+            compaction.join()
+
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            if self.owner is not None:
+                _disown(self.owner)
+                self.owner = None
+
+    def _resolve(self, cond: Callable, eids: list) -> List[int]:
+        if eids is not None:
+            return [eid for eid in eids if eid in self.data]
+
+        return [element.eid for element in self.search(cond)]
+
+    def _commit(self, records: List[dict]):
+        if not records:
+            return
+
+        # One checksummed line per record, flushed (and synced) before touching memory
+        offset = self.journal.tell()
+        try:
+            self.journal.write(b''.join(self._encode(record) for record in records))
+            self.journal.flush()
+            if self.sync:
+                os.fsync(self.journal.fileno())
+        except Exception:
+            # Records appended after a torn write would be discarded with it at the next replay
+            self._rollback(offset)
+            raise
+
+        for record in records:
+            self._apply(record)
+
+        self.records += len(records)
+        if self.records >= self.compact_threshold:
+            self.compact(wait=False)
+
+    def _rollback(self, offset: int):
+        """Cut the journal back to `offset`, dropping what a failed commit wrote or buffered"""
+        try:
+            self.journal.close()
+        except OSError:
+            pass
+
+        try:
+            os.truncate(self.journal_path, offset)
+        finally:
+            self.journal = open(self.journal_path, 'ab')
+
+    def _apply(self, record: dict):
+        eid = record['eid']
+
+        if record['op'] == 'insert':
+            self.data[eid] = dict(record['document'])
+            self.last_id = max(self.last_id, eid)
+        elif record['op'] == 'update' and eid in self.data:
+            # Documents are never modified in place, so readers holding one stay consistent
+            self.data[eid] = dict(self.data[eid], **record['fields'])
+        elif record['op'] == 'remove':
+            self.data.pop(eid, None)
+
+    @staticmethod
+    def _encode(record: dict) -> bytes:
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+
+        return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+    @staticmethod
+    def _decode(line: bytes):
+        (checksum, _, payload) = line.rstrip(b'\n').partition(b' ')
+
+        if not line.endswith(b'\n') or checksum != b'%08x' % zlib.crc32(payload):
+            return None
+
+        return json.loads(payload.decode('utf-8'))
+
+    @staticmethod
+    def stream(path: str, table_name: str = '_default', chunk_size: int = 1 << 20):
+        """
+        Yield the id and the document of everything in the db at `path`,
+        without opening it: the snapshot is parsed a chunk at a time, and
+        only the journal (at most a compaction worth of records) is held
+        """
+        journal_path = os.path.splitext(path)[0] + '.journal'
+        records = {}
+
+        for journal in (journal_path + '.old', journal_path):
+            if os.path.exists(journal):
+                with open(journal, 'rb') as lines:
+                    for record in map(JournalDB._decode, lines):
+                        if record is None:
+                            break
+                        records.setdefault(record['eid'], []).append(record)
+
+        def replay(eid: int, document):
+            for record in records.pop(eid, ()):
+                if record['op'] == 'insert':
+                    document = dict(record['document'])
+                elif record['op'] == 'update' and document is not None:
+                    document = dict(document, **record['fields'])
+                elif record['op'] == 'remove':
+                    document = None
+
+            return document
+
+        if os.path.exists(path):
+            with open(path, 'r') as snapshot:
+                for (eid, document) in SnapshotReader(snapshot, chunk_size).documents(table_name):
+                    document = replay(int(eid), document)
+                    if document is not None:
+                        yield int(eid), document
+
+        # Inserted after the snapshot was written
+        for eid in sorted(records):
+            document = replay(eid, None)
+            if document is not None:
+                yield eid, document
+
+    # Startup and compaction
+
+    def _load(self):
+        # A second process would append to the same journal, and its records be lost at our next compaction
+        _own(self.journal_path + '.lock')
+        self.owner = self.journal_path + '.lock'
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as snapshot:
+                content = snapshot.read()
+
+            tables = json.loads(content) if content.strip() else {}
+            for (eid, document) in tables.get(self.table_name, {}).items():
+                self.data[int(eid)] = document
+
+        self.last_id = max(self.data) if self.data else 0
+
+        # A journal left behind by an interrupted compaction comes before the current one
+        if os.path.exists(self.journal_path + '.old'):
+            self._replay(self.journal_path + '.old')
+        if os.path.exists(self.journal_path):
+            self.records = self._replay(self.journal_path)
+
+        self.journal = open(self.journal_path, 'ab')
+
+    def _replay(self, journal_path: str) -> int:
+        replayed = 0
+        offset = 0
+
+        with open(journal_path, 'rb') as journal:
+            for line in journal:
+                record = self._decode(line)
+
+                if record is None:
+                    # Torn or corrupted write: everything from here on was never committed
+                    self.logger.warning('Discarding journal %s after byte %d', journal_path, offset)
+                    break
+
+                self._apply(record)
+                offset += len(line)
+                replayed += 1
+
+        if offset != os.path.getsize(journal_path):
+            with open(journal_path, 'r+b') as journal:
+                journal.truncate(offset)
+
+        return replayed
+
+    def compact(self, wait: bool = True):
+        """Fold the journal into a new snapshot"""
+        with self.lock:
+            if self.compaction is None or not self.compaction.is_alive():
+                # Freeze the current state and start a new journal: writers carry on meanwhile.
+                # If a previous compaction failed its journal is still there and is kept: replaying
+                # records already folded into the snapshot leads to the same state
+                if not os.path.exists(self.journal_path + '.old'):
+                    self.journal.close()
+                    os.replace(self.journal_path, self.journal_path + '.old')
+                    self.journal = open(self.journal_path, 'ab')
+                self.records = 0
+
+                self.compaction = threading.Thread(target=self._write_snapshot, args=(dict(self.data),),
+                                                   name='journal-compaction', daemon=True)
+                self.compaction.start()
+
+            compaction = self.compaction
+
+        if wait:
+            compaction.join()
+
+    def _write_snapshot(self, data: dict):
+        temporary_path = self.path + '.tmp'
+
+        with open(temporary_path, 'w') as snapshot:
+            json.dump({self.table_name: {str(eid): document for (eid, document) in data.items()}}, snapshot)
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+
+        os.replace(temporary_path, self.path)
+        self._sync_directory()
+        os.remove(self.journal_path + '.old')
+
+    def _sync_directory(self):
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+class SnapshotReader:
+    """Incremental parser of a snapshot, yielding the documents of a table one at a time"""
+
+    def __init__(self, snapshot, chunk_size: int = 1 << 20):
+        self.snapshot = snapshot
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def documents(self, table_name: str):
+        if not self._skip_space():
+            return
+
+        self._expect('{')
+
+        while self._skip_space() != '}':
+            table = self._value()
+            self._expect(':')
+
+            if table != table_name:
+                # Every value here is an object or a string: parsed whole, never cut short
+                self._value()
+            else:
+                self._expect('{')
+
+                while self._skip_space() != '}':
+                    eid = self._value()
+                    self._expect(':')
+                    yield eid, self._value()
+                    self._separator('}')
+
+                self._expect('}')
+
+            self._separator('}')
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+
+        chunk = self.snapshot.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def _skip_space(self) -> str:
+        """Next non-blank character, left in the buffer; empty at the end"""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position].isspace():
+                self.position += 1
+
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+
+            if not self._fill():
+                return ''
+
+    def _expect(self, character: str):
+        if self._skip_space() != character:
+            raise ValueError('Expected {!r} at {} of the snapshot'.format(character, self.position))
+        self.position += 1
+
+    def _separator(self, closing: str):
+        if self._skip_space() == ',':
+            self.position += 1
+        elif self._skip_space() != closing:
+            raise ValueError('Expected \',\' or {!r} in the snapshot'.format(closing))
+
+    def _value(self):
+        self._skip_space()
+
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                # Cut by the end of the chunk: read on, unless that's the end of the file
+                if not self._fill():
+                    raise
+                continue
+
+            self.position = end
+            return value
@@ -0,0 +1,188 @@
+import asyncio
+import contextvars
+import copy
+import functools
+import json
+import logging
+import queue
+import random
+import sys
+import time
+
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
+
+from telegram.ext import ConversationHandler, Handler
+
+# Update being handled and its handler, added to every record logged meanwhile
+update_id = contextvars.ContextVar('update_id', default=None)
+handler_name = contextvars.ContextVar('handler_name', default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the update and the handler it was logged for"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + '.{:03d}Z'.format(
+                int(record.msecs)),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+
+        for key in ('update_id', 'handler'):
+            if getattr(record, key, None) is not None:
+                entry[key] = getattr(record, key)
+
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+
+        if getattr(record, 'update_id', None) is not None:
+            text = '{} [update {} {}]'.format(text, record.update_id, record.handler)
+
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps the DEBUG records of the loggers in `rates` (and their children)
+    with the given probability, the most specific logger name winning
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+
+        name = record.name
+        while name not in self.rates:
+            if '.' not in name:
+                return True
+            name = name.rsplit('.', 1)[0]
+
+        return random.random() < self.rates[name]
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Puts the records in a bounded queue, written by a QueueListener thread:
+    the handler threads only pay for merging the message. Records past
+    the size of the queue are dropped and counted, instead of blocking
+    """
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Arguments may change (or not be picklable) once the call returns: merge them now, format later
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.update_id = update_id.get()
+        record.handler = handler_name.get()
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup(settings: dict) -> QueueListener:
+    """
+    Configure the logging from the `logging` section of config.yml, and
+    start the thread writing the records: stop it before exiting
+    """
+    if settings.get('file'):
+        output = logging.FileHandler(settings['file'], encoding='utf-8')
+    else:
+        output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if settings.get('format', 'text') == 'json' else TextFormatter())
+
+    handler = ContextQueueHandler(queue.Queue(settings.get('queue_size', 10000)))
+    if settings.get('sample'):
+        handler.addFilter(SamplingFilter(settings['sample']))
+
+    root = logging.getLogger()
+    for previous in list(root.handlers):
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(settings.get('level', 'INFO'))
+
+    for (name, level) in (settings.get('loggers') or {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+
+    return listener
+
+
+def tag_handler(handler: Handler, module: str) -> Handler:
+    """Tag the records logged by the callback of `handler` (of a conversation) with the update and the callback"""
+    if isinstance(handler, ConversationHandler):
+        for handlers in [handler.entry_points, handler.fallbacks, *handler.states.values()]:
+            for sub_handler in handlers:
+                tag_handler(sub_handler, module)
+
+        return handler
+
+    name = '{}.{}'.format(module, getattr(handler.callback, '__name__', 'callback'))
+
+    handler.callback = tagged(handler.callback, name)
+
+    return handler
+
+
+def tagged(callback, name: str):
+    """`callback` tagging the records logged meanwhile with the id of its update and `name`"""
+    def tag(update) -> tuple:
+        return update_id.set(getattr(update, 'update_id', None)), handler_name.set(name)
+
+    def untag(tokens: tuple):
+        update_id.reset(tokens[0])
+        handler_name.reset(tokens[1])
+
+    if asyncio.iscoroutinefunction(callback):
+        @functools.wraps(callback)
+        async def wrapper(bot, update, *args, **kwargs):
+            tokens = tag(update)
+            try:
+                return await callback(bot, update, *args, **kwargs)
+            finally:
+                untag(tokens)
+    else:
+        @functools.wraps(callback)
+        def wrapper(bot, update, *args, **kwargs):
+            tokens = tag(update)
+            try:
+                return callback(bot, update, *args, **kwargs)
+            finally:
+                untag(tokens)
+
+    return wrapper
+
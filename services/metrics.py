@@ -0,0 +1,324 @@
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, Iterable, Tuple
+
+from telegram.ext import ConversationHandler, Handler
+
+from services.cache import TaggedCache
+from services.query import Query
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Metric:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+
+    def render(self) -> list:
+        raise NotImplementedError
+
+    def _labels(self, values: tuple, extra: str = '') -> str:
+        pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                 for (name, value) in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with self.lock:
+            return ['{}{} {}'.format(self.name, self._labels(labels), value) for (labels, value) in self.values.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # Observations in every bucket (not cumulative), their sum and count, by labels
+        self.series = {}
+
+    def observe(self, labels: tuple, value: float):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+
+            for (n, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][n] += 1
+                    break
+
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = []
+
+        with self.lock:
+            for (labels, (counts, total, count)) in self.series.items():
+                cumulative = 0
+                for (bound, observations) in zip(self.buckets, counts):
+                    cumulative += observations
+                    lines.append('{}_bucket{} {}'.format(self.name, self._labels(labels, 'le="{}"'.format(bound)),
+                                                         cumulative))
+
+                lines.append('{}_bucket{} {}'.format(self.name, self._labels(labels, 'le="+Inf"'), count))
+                lines.append('{}_sum{} {}'.format(self.name, self._labels(labels), total))
+                lines.append('{}_count{} {}'.format(self.name, self._labels(labels), count))
+
+        return lines
+
+
+class Gauge(Metric):
+    """Read when rendered, from the function watched for every set of labels"""
+
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.functions = {}
+
+    def watch(self, labels: tuple, function: Callable[[], float]):
+        with self.lock:
+            self.functions[labels] = function
+
+    def render(self) -> list:
+        with self.lock:
+            functions = list(self.functions.items())
+
+        return ['{}{} {}'.format(self.name, self._labels(labels), function()) for (labels, function) in functions]
+
+
+class Registry:
+    """Metrics of the process, rendered in the Prometheus text format"""
+
+    def __init__(self, prefix: str = 'marvin_'):
+        self.prefix = prefix
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._metric(Counter, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Histogram:
+        return self._metric(Histogram, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._metric(Gauge, name, help, labels)
+
+    def render(self) -> str:
+        lines = []
+
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+    def _metric(self, kind: type, name: str, help: str, labels: Tuple[str, ...]):
+        name = self.prefix + name
+
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = kind(name, help, labels)
+
+        return metric
+
+
+registry = Registry()
+
+
+def timed(function: Callable, histogram: Histogram, errors: Counter, labels: tuple) -> Callable:
+    """`function` observing its latency in `histogram` and counting its exceptions in `errors`"""
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                errors.inc(labels)
+                raise
+            finally:
+                histogram.observe(labels, time.perf_counter() - start)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                errors.inc(labels)
+                raise
+            finally:
+                histogram.observe(labels, time.perf_counter() - start)
+
+    return wrapper
+
+
+class TimedQuery(Query):
+    """`query` observing the time spent iterating and counting it: building it reads nothing"""
+
+    def __init__(self, query: Query, histogram: Histogram, errors: Counter, labels: tuple):
+        self.__dict__.update(query.__dict__)
+        self.histogram = histogram
+        self.errors = errors
+        self.labels = labels
+
+    def __iter__(self):
+        # Only the time spent inside the query: not what the caller does between two results
+        results = super().__iter__()
+        elapsed = 0
+
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    result = next(results)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+
+                yield result
+        except Exception:
+            self.errors.inc(self.labels)
+            raise
+        finally:
+            self.histogram.observe(self.labels, elapsed)
+
+    def count(self) -> int:
+        return timed(super().count, self.histogram, self.errors, self.labels)()
+
+
+def timed_query(function: Callable[..., Query], histogram: Histogram, errors: Counter, labels: tuple) -> Callable:
+    """`function`, whose queries are timed when read"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return TimedQuery(function(*args, **kwargs), histogram, errors, labels)
+
+    return wrapper
+
+
+def instrument_handler(handler: Handler, module: str) -> Handler:
+    """Time the callback of `handler` (of every handler of a conversation), labelled by module and callback"""
+    if isinstance(handler, ConversationHandler):
+        for handlers in [handler.entry_points, handler.fallbacks, *handler.states.values()]:
+            for sub_handler in handlers:
+                instrument_handler(sub_handler, module)
+
+        return handler
+
+    histogram = registry.histogram('handler_seconds', 'Time spent handling the updates', ('handler',))
+    errors = registry.counter('handler_errors_total', 'Updates whose handler raised', ('handler',))
+    name = '{}.{}'.format(module, getattr(handler.callback, '__name__', 'callback'))
+
+    handler.callback = timed(handler.callback, histogram, errors, (name,))
+
+    return handler
+
+
+def instrument_repository(repository, exclude: Iterable[str] = ('subscribe', 'event_lock', 'search_changed')):
+    """Time every public method of `repository`, labelled by its class and the method"""
+    histogram = registry.histogram('storage_seconds', 'Time spent in the storage operations',
+                                   ('repository', 'operation'))
+    errors = registry.counter('storage_errors_total', 'Storage operations that raised', ('repository', 'operation'))
+    kind = type(repository).__name__
+
+    for name in dir(type(repository)):
+        if name.startswith('_') or name in exclude or not callable(getattr(type(repository), name)):
+            continue
+
+        method = getattr(repository, name)
+        wrap = timed_query if inspect.signature(method).return_annotation is Query else timed
+        setattr(repository, name, wrap(method, histogram, errors, (kind, name)))
+
+    return repository
+
+
+def watch_cache(name: str, cache: TaggedCache):
+    registry.gauge('cache_entries', 'Entries in the caches', ('cache',)).watch((name,), lambda: len(cache))
+    registry.gauge('cache_hit_ratio', 'Hits over the lookups of the caches', ('cache',)).watch(
+        (name,), lambda: cache.stats()['hit_ratio'])
+
+
+def watch_queue(name: str, stats: Callable[[], Dict[str, int]]):
+    """Depth and counters (everything else in `stats()`) of a queue"""
+    registry.gauge('queue_depth', 'Requests waiting in the queues', ('queue',)).watch(
+        (name,), lambda: stats()['depth'])
+
+    for key in stats():
+        if key != 'depth':
+            registry.gauge('queue_' + key, 'Requests {} by the queues'.format(key), ('queue',)).watch(
+                (name,), lambda key=key: stats()[key])
+
+
+class MetricsServer(HTTPServer):
+    """Serves the metrics of `registry` on GET /metrics, from a daemon thread"""
+
+    def __init__(self, listen: str = '127.0.0.1', port: int = 9100, metrics: Registry = registry):
+        self.registry = metrics
+        super().__init__((listen, port), MetricsRequestHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='metrics', daemon=True).start()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format, *args)
+
+
+def dump_periodically(interval: float, metrics: Registry = registry):
+    """Log the metrics every `interval` seconds, from a daemon thread"""
+    logger = logging.getLogger(__name__)
+
+    def dump():
+        while True:
+            time.sleep(interval)
+            logger.info('Metrics:\n%s', metrics.render())
+
+    threading.Thread(target=dump, name='metrics-dump', daemon=True).start()
@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from typing import Callable, Hashable
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from services.throttle import TokenBucket
+
+# Priorities of the requests: the lower goes first
+INTERACTIVE, EDIT, REMINDER = range(3)
+
+# Seconds between two sweeps of the buckets of the chats
+SWEEP_INTERVAL = 60
+
+
+class OutboundQueue:
+    """
+    Sends the Bot API requests of every module, highest priority first, within
+    Telegram's rate limits: `global_rate` messages per second overall and
+    `chat_rate` in the same chat. Requests refused with RetryAfter are sent
+    again once the flood wait is over; network errors are retried up to
+    `max_retries` times. Worker threads are started by the first request
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, workers: int = 2,
+                 max_retries: int = 3):
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = {}
+        self.swept = time.monotonic()
+        self.workers = workers
+        self.max_retries = max_retries
+
+        self.ready = []
+        self.delayed = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.running = False
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.logger = logging.getLogger(__name__)
+
+    def put(self, chat_id: int, priority: int, method: Callable, *args, **kwargs):
+        """Call `method(*args, **kwargs)` when the budget of `chat_id` (None for no chat) allows it"""
+        self._push((priority, next(self.sequence), chat_id, method, args, kwargs, 0))
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                'depth': len(self.ready) + len(self.delayed),
+                'sent': self.sent,
+                'retried': self.retried,
+                'failed': self.failed,
+            }
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        for thread in self.threads:
+            thread.join()
+
+    def _push(self, request: tuple, not_before: float = None):
+        with self.condition:
+            if not_before is None:
+                heapq.heappush(self.ready, request)
+            else:
+                heapq.heappush(self.delayed, (not_before, request))
+
+            if not self.threads:
+                self.running = True
+                for n in range(self.workers):
+                    thread = threading.Thread(target=self._run, name='outbound-{}'.format(n), daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+
+            self.condition.notify()
+
+    def _wait(self, chat_id: int) -> float:
+        if chat_id is None:
+            return self.global_bucket.take()
+
+        self._sweep()
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate)
+
+        wait = bucket.take()
+        if wait:
+            return wait
+
+        wait = self.global_bucket.take()
+        if wait:
+            # Not sent yet: the token of the chat is for when it is
+            bucket.give()
+
+        return wait
+
+    def _sweep(self):
+        # A bucket that refilled is the same as a new one: dropped, instead of keeping one for every chat ever seen
+        now = time.monotonic()
+
+        if now - self.swept >= SWEEP_INTERVAL:
+            self.chat_buckets = {chat_id: bucket for (chat_id, bucket) in self.chat_buckets.items()
+                                 if not bucket.full()}
+            self.swept = now
+
+    def _next(self) -> tuple:
+        """Pop the next request allowed to go, waiting for it; None once stopped"""
+        with self.condition:
+            while self.running:
+                now = time.monotonic()
+
+                while self.delayed and self.delayed[0][0] <= now:
+                    heapq.heappush(self.ready, heapq.heappop(self.delayed)[1])
+
+                if self.ready:
+                    request = heapq.heappop(self.ready)
+                    wait = self._wait(request[2])
+
+                    if not wait:
+                        return request
+
+                    # Over budget: the requests for other chats can go meanwhile
+                    heapq.heappush(self.delayed, (now + wait, request))
+                    continue
+
+                self.condition.wait(self.delayed[0][0] - now if self.delayed else None)
+
+            return None
+
+    def _run(self):
+        while True:
+            request = self._next()
+
+            if request is None:
+                return
+
+            (priority, sequence, chat_id, method, args, kwargs, attempts) = request
+
+            try:
+                method(*args, **kwargs)
+            except RetryAfter as e:
+                self._retry(request, e.retry_after)
+            except BadRequest as e:
+                self._failed(request, e)
+            except NetworkError as e:
+                if attempts < self.max_retries:
+                    self._retry(request, 2 ** attempts)
+                else:
+                    self._failed(request, e)
+            except Exception as e:
+                self._failed(request, e)
+            else:
+                with self.condition:
+                    self.sent += 1
+
+    def _retry(self, request: tuple, delay: float):
+        with self.condition:
+            self.retried += 1
+
+        self._push(request[:-1] + (request[-1] + 1,), time.monotonic() + delay)
+
+    def _failed(self, request: tuple, error: Exception):
+        with self.condition:
+            self.failed += 1
+
+        self.logger.error('Request %s to chat %s failed: %s', getattr(request[3], '__name__', request[3]),
+                          request[2], error)
+
+
+class EditCoalescer:
+    """
+    Collects the edits of the same message for `window` seconds and sends
+    only the last one, through the outbound queue
+    """
+
+    def __init__(self, outbound: OutboundQueue, window: float = 1.0):
+        self.outbound = outbound
+        self.window = window
+
+        self.pending = {}
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def submit(self, key: Hashable, chat_id: int, edit: Callable[[], None]):
+        """Send `edit` of the message identified by `key`, unless a newer edit of it comes within the window"""
+        with self.condition:
+            if key not in self.pending:
+                heapq.heappush(self.queue, (time.monotonic() + self.window, next(self.sequence), key))
+            self.pending[key] = (chat_id, edit)
+
+            if self.thread is None:
+                self.running = True
+                self.thread = threading.Thread(target=self._run, name='edit-coalescer', daemon=True)
+                self.thread.start()
+
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+
+                if not self.running:
+                    return
+
+                key = heapq.heappop(self.queue)[2]
+                (chat_id, edit) = self.pending.pop(key)
+
+            self.outbound.put(chat_id, EDIT, edit)
@@ -0,0 +1,133 @@
+import logging
+import multiprocessing
+import threading
+import time
+import zlib
+
+from typing import Callable, Hashable
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+from telegram.ext import Dispatcher
+
+
+def sender_key(update: Update) -> Hashable:
+    """User the update comes from, or its chat if there is none"""
+    user = update.effective_user
+    if user is not None:
+        return user.id
+
+    chat = update.effective_chat
+    return chat.id if chat is not None else update.update_id
+
+
+def worker_of(key: Hashable, processes: int) -> int:
+    """Worker process of `key`: stable across runs and processes, unlike hash()"""
+    return zlib.crc32(str(key).encode('utf-8')) % processes
+
+
+class ProcessRouter:
+    """
+    Ingress of the multi-process mode: hands every update to one of
+    `processes` worker processes running `target(index, updates)`, always the
+    same for the same `key(update)`, so that the state kept by a worker
+    (such as the conversations) sees every update of its users, in order.
+    Each worker has a queue of `queue_size` updates; once full, the ingress
+    waits (the webhook then refuses the updates waiting for it)
+    """
+
+    def __init__(self, bot: Bot, processes: int, target: Callable, key: Callable[[Update], Hashable] = sender_key,
+                 queue_size: int = 1000):
+        # Spawned, not forked: the workers don't inherit the threads and the connections of the ingress
+        context = multiprocessing.get_context('spawn')
+
+        self.bot = bot
+        self.key = key
+        self.queues = [context.Queue(queue_size) for _ in range(processes)]
+        self.processes = [context.Process(target=target, args=(n, updates), name='worker-{}'.format(n), daemon=True)
+                          for (n, updates) in enumerate(self.queues)]
+        self.routed = [0] * processes
+        self.counters_lock = threading.Lock()
+        self.running = False
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def stop(self, timeout: float = 30):
+        self.running = False
+
+        for updates in self.queues:
+            updates.put(None)
+
+        for process in self.processes:
+            process.join(timeout)
+
+    def process_update(self, update: Update):
+        """Same as Dispatcher.process_update, in the worker of the update"""
+        worker = worker_of(self.key(update), len(self.queues))
+
+        self.queues[worker].put(update.to_dict())
+        with self.counters_lock:
+            self.routed[worker] += 1
+
+    def stats(self) -> dict:
+        try:
+            depth = sum(updates.qsize() for updates in self.queues)
+        except NotImplementedError:
+            # Not available on every platform
+            depth = -1
+
+        return {
+            'depth': depth,
+            'routed': sum(self.routed),
+        }
+
+    def poll(self, timeout: int = 10):
+        """Long polling until stop() is called"""
+        self.running = True
+        offset = None
+
+        # Telegram refuses getUpdates while the webhook of a run in webhook mode is still set
+        while self.running:
+            try:
+                self.bot.deleteWebhook()
+                break
+            except TelegramError as e:
+                self.logger.warning('Error while removing the webhook: %s', e)
+                time.sleep(1)
+
+        while self.running:
+            try:
+                updates = self.bot.getUpdates(offset=offset, timeout=timeout)
+            except TelegramError as e:
+                self.logger.warning('Error while getting updates: %s', e)
+                time.sleep(1)
+                continue
+
+            for update in updates:
+                offset = update.update_id + 1
+                self.process_update(update)
+
+
+def serve(dispatcher: Dispatcher, updates: multiprocessing.Queue):
+    """Worker side: process the updates routed to this process, one at a time, until the ingress stops"""
+    logger = logging.getLogger(__name__)
+
+    while True:
+        try:
+            data = updates.get()
+        except (EOFError, OSError):
+            # The ingress is gone
+            return
+
+        if data is None:
+            return
+
+        update = Update.de_json(data, dispatcher.bot)
+
+        try:
+            dispatcher.process_update(update)
+        except Exception:
+            logger.exception('Update %s failed', update.update_id)
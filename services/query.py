@@ -0,0 +1,70 @@
+import copy
+
+from typing import Callable, Iterable, Iterator, List
+
+
+class Query:
+    """
+    Lazy query over a repository: order_by(), limit() and offset() return a
+    new query, and nothing is read until it is iterated or counted.
+
+    `ids(order, limit, offset)` gives the ids of the matches, and
+    `load(ids)` their entities: iterating loads `batch_size` of them at a
+    time, only as far as the caller goes. `total()`, if given, counts the
+    matches without listing them
+    """
+
+    def __init__(self, ids: Callable[[str, int, int], Iterable[int]], load: Callable[[List[int]], list],
+                 orders: Iterable[str], total: Callable[[], int] = None, batch_size: int = 50):
+        self.ids = ids
+        self.load = load
+        self.orders = tuple(orders)
+        self.total = total
+        self.batch_size = batch_size
+
+        self.order = self.orders[0]
+        self.size = None
+        self.start = 0
+
+    def _copy(self, **fields) -> 'Query':
+        query = copy.copy(self)
+        query.__dict__.update(fields)
+
+        return query
+
+    def order_by(self, order: str) -> 'Query':
+        """One of `orders`, the first by default"""
+        if order not in self.orders:
+            raise ValueError('Unknown order {!r}, expected one of {}'.format(order, ', '.join(self.orders)))
+
+        return self._copy(order=order)
+
+    def limit(self, size: int = None) -> 'Query':
+        return self._copy(size=size)
+
+    def offset(self, start: int) -> 'Query':
+        return self._copy(start=start)
+
+    def __iter__(self) -> Iterator:
+        batch = []
+
+        for eid in self.ids(self.order, self.size, self.start):
+            batch.append(eid)
+
+            if len(batch) == self.batch_size:
+                yield from self.load(batch)
+                batch = []
+
+        if batch:
+            yield from self.load(batch)
+
+    def first(self):
+        """The first match, None if there is none"""
+        return next(iter(self.limit(1)), None)
+
+    def count(self) -> int:
+        """Matches within the limit and the offset, none of them loaded"""
+        total = self.total() if self.total else sum(1 for _ in self.ids(self.order, None, 0))
+        total = max(total - self.start, 0)
+
+        return total if self.size is None else min(total, self.size)
@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from typing import Callable, Hashable, List
+
+
+class Scheduler:
+    """
+    Calls `handler(keys)` at the time the keys are scheduled for: all the
+    keys due at the same time (up to `batch_size`) are handled by one call.
+    A single thread waits on a min-heap of the deadlines, however many keys there are.
+    Keys whose call raised are tried again after `retry_delay` seconds,
+    doubled on every failure up to `max_retry_delay`
+    """
+
+    def __init__(self, handler: Callable[[List[Hashable]], None], batch_size: int = 1000,
+                 retry_delay: float = 60, max_retry_delay: float = 3600):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # Consecutive failed calls of the keys being retried
+        self.failures = {}
+
+        self.queue = []
+        # Sequence number of the live heap entry of every key: the others are cancelled
+        self.scheduled = {}
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.logger = logging.getLogger(__name__)
+
+    def schedule(self, key: Hashable, when: float):
+        """Call the handler of `key` at `when` (a timestamp), in place of any previous schedule of it"""
+        with self.condition:
+            sequence = next(self.sequence)
+            self.scheduled[key] = sequence
+            heapq.heappush(self.queue, (when, sequence, key))
+
+            if self.thread is None:
+                self.running = True
+                self.thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+                self.thread.start()
+
+            self.condition.notify()
+
+    def cancel(self, key: Hashable):
+        with self.condition:
+            self.scheduled.pop(key, None)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        if self.thread is not None:
+            self.thread.join()
+
+    def __contains__(self, key: Hashable):
+        return key in self.scheduled
+
+    def __len__(self):
+        return len(self.scheduled)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    # Cancelled entries are dropped once they reach the top
+                    while self.queue and self.scheduled.get(self.queue[0][2]) != self.queue[0][1]:
+                        heapq.heappop(self.queue)
+
+                    if self.queue and self.queue[0][0] <= time.time():
+                        break
+
+                    self.condition.wait(self.queue[0][0] - time.time() if self.queue else None)
+
+                if not self.running:
+                    return
+
+                keys = []
+                now = time.time()
+
+                while self.queue and self.queue[0][0] <= now and len(keys) < self.batch_size:
+                    (when, sequence, key) = heapq.heappop(self.queue)
+
+                    if self.scheduled.get(key) == sequence:
+                        del self.scheduled[key]
+                        keys.append(key)
+
+            try:
+                self.handler(keys)
+            except Exception:
+                self.logger.exception('Scheduled call for %s failed', keys)
+                self._retry(keys)
+            else:
+                for key in keys:
+                    self.failures.pop(key, None)
+
+    def _retry(self, keys: List[Hashable]):
+        with self.condition:
+            for key in keys:
+                # Rescheduled by the handler itself before it failed
+                if key in self.scheduled:
+                    continue
+
+                failures = self.failures.get(key, 0)
+                self.failures[key] = failures + 1
+
+                delay = min(self.retry_delay * 2 ** failures, self.max_retry_delay)
+                sequence = next(self.sequence)
+                self.scheduled[key] = sequence
+                heapq.heappush(self.queue, (time.time() + delay, sequence, key))
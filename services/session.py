@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Callable, Hashable, List
+
+
+class SessionStore:
+    """
+    In-memory state of multi-step interactions (such as a wizard) by key.
+    Past `capacity` the least recently used sessions are dropped, and so
+    are the ones untouched for `ttl` seconds. With a `path` the sessions
+    are checkpointed there every `interval` seconds, if changed, and loaded
+    back at startup; `encode` and `decode` turn a value into JSON and back
+    """
+
+    def __init__(self, capacity: int = 1024, ttl: float = 86400, path: str = None, interval: float = 60,
+                 encode: Callable = None, decode: Callable = None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+        self.interval = interval
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+
+        # Value and expiry of every session, least recently used first
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.stopped = threading.Event()
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+
+        if path:
+            self._restore()
+
+    def get(self, key: Hashable, default=None):
+        with self.lock:
+            entry = self.sessions.get(key)
+
+            if entry is None or entry[1] < time.time():
+                self._discard(key)
+                return default
+
+            self.sessions.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value):
+        with self.lock:
+            now = time.time()
+
+            self.sessions[key] = (value, now + self.ttl)
+            self.sessions.move_to_end(key)
+
+            # Drop from the least recently used end: past the capacity, and the expired sessions found there
+            while self.sessions:
+                (first, entry) = next(iter(self.sessions.items()))
+                if len(self.sessions) <= self.capacity and entry[1] >= now:
+                    break
+                self._discard(first)
+
+            self.dirty = True
+
+            if self.path and self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='session-checkpoint', daemon=True)
+                self.thread.start()
+
+    def pop(self, key: Hashable, default=None):
+        with self.lock:
+            entry = self.sessions.get(key)
+            self._discard(key)
+
+            return entry[0] if entry is not None and entry[1] >= time.time() else default
+
+    def items(self) -> List[tuple]:
+        """Keys and values of the live sessions"""
+        with self.lock:
+            now = time.time()
+
+            return [(key, entry[0]) for (key, entry) in self.sessions.items() if entry[1] >= now]
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def checkpoint(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            now = time.time()
+            sessions = [[key, self.encode(value), expiry] for (key, (value, expiry)) in self.sessions.items()
+                        if expiry >= now]
+            self.dirty = False
+
+        temporary = self.path + '.tmp'
+
+        with open(temporary, 'w') as checkpoint:
+            json.dump(sessions, checkpoint)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+
+        os.replace(temporary, self.path)
+
+    def close(self):
+        self.stopped.set()
+
+        if self.thread is not None:
+            self.thread.join()
+
+        if self.path:
+            self.checkpoint()
+
+    def _discard(self, key: Hashable):
+        if self.sessions.pop(key, None) is not None:
+            self.dirty = True
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.checkpoint()
+            except OSError:
+                self.logger.exception('Checkpoint of the sessions to %s failed', self.path)
+
+    def _restore(self):
+        try:
+            with open(self.path) as checkpoint:
+                sessions = json.load(checkpoint)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            self.logger.error('Checkpoint %s is not readable, sessions are lost', self.path)
+            return
+
+        now = time.time()
+
+        for (key, value, expiry) in sessions:
+            if expiry >= now:
+                self.sessions[key] = (self.decode(value), expiry)
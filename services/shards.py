@@ -0,0 +1,205 @@
+import glob
+import logging
+import os
+import re
+import threading
+import zlib
+
+from typing import Callable, Dict, List
+
+from services.journal import JournalDB
+
+
+class ShardedDB:
+    """
+    Same interface of JournalDB, over `shards` JournalDB files partitioned by
+    the `key` field of the documents: every shard is loaded, written and
+    compacted on its own, and writes to different shards don't wait for
+    each other. Ids are unique across the shards, and an id -> shard map
+    routes the lookups by id.
+
+    A document stays in the shard it was inserted in: shards found on disk
+    beyond `shards` are still read, and an unsharded db at `path` is moved
+    into the shards the first time
+    """
+
+    def __init__(self, path: str, shards: int, key: str, default_table: str = '_default',
+                 compact_threshold: int = 1000, sync: bool = True):
+        self.path = path
+        self.key = key
+        self.table_name = default_table
+        self.logger = logging.getLogger(__name__)
+
+        (base, extension) = os.path.splitext(path)
+        pattern = re.compile(re.escape(base) + r'\.(\d+)(\.json|\.journal)$')
+        found = [int(pattern.match(name).group(1)) for name in glob.glob(glob.escape(base) + '.*')
+                 if pattern.match(name)]
+
+        self.shards = [JournalDB('{}.{}{}'.format(base, n, extension), default_table, compact_threshold, sync)
+                       for n in range(max([shards - 1] + found) + 1)]
+        self.partitions = shards
+
+        # Shard of every document by id, and the last id given
+        self.shard_ids = {}
+        for (n, shard) in enumerate(self.shards):
+            for eid in shard.data:
+                self.shard_ids[eid] = n
+        self.last_id = max(self.shard_ids) if self.shard_ids else 0
+        self.ids_lock = threading.Lock()
+
+        # Writes of a whole operation over several shards (such as purge) are serialized by this
+        self.lock = threading.RLock()
+
+        self._migrate()
+
+    def shard_of(self, document: dict) -> int:
+        """Shard of a new document"""
+        return zlib.crc32(str(document.get(self.key)).encode('utf-8')) % self.partitions
+
+    # Reading
+
+    def get(self, cond: Callable = None, eid: int = None):
+        if eid is not None:
+            shard = self.shard_ids.get(eid)
+            return self.shards[shard].get(eid=eid) if shard is not None else None
+
+        for element in self.search(cond):
+            return element
+
+        return None
+
+    def all(self) -> list:
+        return [element for shard in self.shards for element in shard.all()]
+
+    def search(self, cond: Callable) -> list:
+        return [element for shard in self.shards for element in shard.search(cond)]
+
+    def contains(self, cond: Callable = None, eids: list = None) -> bool:
+        if eids is not None:
+            return any(eid in self.shard_ids for eid in eids)
+
+        return self.get(cond) is not None
+
+    def count(self, cond: Callable) -> int:
+        return sum(shard.count(cond) for shard in self.shards)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    # Writing
+
+    def insert(self, document: dict) -> int:
+        if not isinstance(document, dict):
+            raise ValueError('Element is not a dictionary')
+
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents: list, eids: List[int] = None) -> List[int]:
+        """Insert `documents` with new ids, or with the ones given (replacing the documents holding them)"""
+        with self.ids_lock:
+            if eids is None:
+                first_id = self.last_id + 1
+                self.last_id += len(documents)
+                eids = list(range(first_id, self.last_id + 1))
+            else:
+                self.last_id = max([self.last_id] + list(eids))
+
+        partitions = {}
+
+        for (eid, document) in zip(eids, documents):
+            partitions.setdefault(self.shard_of(document), {})[eid] = document
+
+        # A replaced document whose key changed moves to its new shard
+        moved = [eid for (shard, ids) in partitions.items() for eid in ids
+                 if self.shard_ids.get(eid, shard) != shard]
+        for (shard, ids) in self._partition(moved).items():
+            self.shards[shard].remove(eids=ids)
+
+        self._insert(partitions)
+
+        return eids
+
+    def update(self, fields: dict, cond: Callable = None, eids: list = None) -> List[int]:
+        if eids is None:
+            return [eid for shard in self.shards for eid in shard.update(fields, cond)]
+
+        return [eid for (shard, ids) in self._partition(eids).items()
+                for eid in self.shards[shard].update(fields, eids=ids)]
+
+    def update_multiple(self, updates: Dict[int, dict]) -> List[int]:
+        return [eid for (shard, ids) in self._partition(list(updates)).items()
+                for eid in self.shards[shard].update_multiple({eid: updates[eid] for eid in ids})]
+
+    def remove(self, cond: Callable = None, eids: list = None) -> List[int]:
+        if eids is None:
+            removed = [eid for shard in self.shards for eid in shard.remove(cond)]
+        else:
+            removed = [eid for (shard, ids) in self._partition(eids).items()
+                       for eid in self.shards[shard].remove(eids=ids)]
+
+        for eid in removed:
+            self.shard_ids.pop(eid, None)
+
+        return removed
+
+    def purge(self):
+        with self.lock:
+            for shard in self.shards:
+                shard.purge()
+
+            self.shard_ids.clear()
+            with self.ids_lock:
+                self.last_id = 0
+
+    def clear_cache(self):
+        pass
+
+    def compact(self, wait: bool = True):
+        for shard in self.shards:
+            shard.compact(wait)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def _insert(self, partitions: Dict[int, Dict[int, dict]]):
+        for (shard, documents) in partitions.items():
+            self.shards[shard].insert_multiple(list(documents.values()), list(documents))
+
+            for eid in documents:
+                self.shard_ids[eid] = shard
+
+    def _partition(self, eids: list) -> Dict[int, List[int]]:
+        partitions = {}
+
+        for eid in eids:
+            shard = self.shard_ids.get(eid)
+            if shard is not None:
+                partitions.setdefault(shard, []).append(eid)
+
+        return partitions
+
+    def _migrate(self):
+        (base, extension) = os.path.splitext(self.path)
+
+        paths = [path for path in (self.path, base + '.journal', base + '.journal.old') if os.path.exists(path)]
+
+        if not paths:
+            return
+
+        single = JournalDB(self.path, self.table_name)
+        partitions = {}
+
+        # Ids are kept: a migration interrupted halfway is done again over the same documents
+        for (eid, document) in single.data.items():
+            partitions.setdefault(self.shard_of(document), {})[eid] = document
+
+        self._insert(partitions)
+        self.last_id = max([self.last_id, single.last_id])
+        single.close()
+
+        for path in (self.path, base + '.journal', base + '.journal.old'):
+            if os.path.exists(path):
+                os.replace(path, path + '.sharded')
+
+        self.logger.info('Moved %d documents of %s into %d shards', len(single.data), self.path, self.partitions)
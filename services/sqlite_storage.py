@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+
+
+class SqliteStorage:
+    """
+    Storage on a SQLite database in WAL mode: readers never wait for the
+    writer, and every thread has a connection of its own, whose prepared
+    statements are reused by their SQL. Subclasses give the `schema`
+    """
+
+    schema = ''
+
+    def __init__(self, db_name: str, data_dir: str = './data/', busy_timeout: float = 5.0):
+        self.db_name = db_name
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, db_name + '.sqlite')
+        self.busy_timeout = busy_timeout
+
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+
+        self.open()
+
+    def open(self):
+        self.connection().executescript(self.schema)
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is None:
+            # Autocommit: transactions are opened explicitly by transaction()
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                         check_same_thread=False, cached_statements=256)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('PRAGMA foreign_keys = ON')
+
+            self.local.connection = connection
+            with self.connections_lock:
+                self.connections.append(connection)
+
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction, taking the write lock at once so that reads can't deadlock upgrading to writes"""
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+        connection.execute('COMMIT')
+
+    def close(self):
+        with self.connections_lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+
+        self.local = threading.local()
+
+    def clear_cache(self):
+        # Pages are cached by SQLite itself
+        pass
@@ -1,21 +1,36 @@
-from tinydb import TinyDB, Query
+import os
 
 from modules.abstract.model import MarvinModel
+from services.journal import JournalDB
+from services.shards import ShardedDB
 
 
 class Storage:
     db = None
     db_name = ''
+    data_dir = './data/'
+    # Field the documents are partitioned by, when stored in several shards
+    shard_key = None
 
-    def __init__(self, db_name: str):
+    def __init__(self, db_name: str, data_dir: str = './data/', shards: int = 1):
         self.db_name = db_name
+        self.data_dir = data_dir
+        self.shards = shards
         self.open()
 
     def insert(self, entity: MarvinModel):
         return self.db.insert(entity.to_dict())
 
     def open(self):
-        self.db = TinyDB('./data/' + self.db_name + '.json', default_table='events')
+        path = os.path.join(self.data_dir, self.db_name + '.json')
+
+        if self.shards > 1:
+            self.db = ShardedDB(path, self.shards, self.shard_key, default_table=self.db_name)
+        else:
+            self.db = JournalDB(path, default_table=self.db_name)
+
+    def close(self):
+        self.db.close()
 
     def clear_cache(self):
-        self.db.table('events').clear_cache()
+        self.db.clear_cache()
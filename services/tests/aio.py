@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.ext import ConversationHandler
+
+from services.aio import AsyncPolling, AsyncProxy
+
+
+class Handler:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def check_update(self, update):
+        return True
+
+    def handle_update(self, update, dispatcher):
+        return self.callback(dispatcher.bot, update)
+
+    def collect_optional_args(self, dispatcher, update=None):
+        return {}
+
+
+class StatefulHandler(ConversationHandler):
+    """Keeps the update it checked until it handles it, as every ConversationHandler does"""
+
+    def __init__(self, callback):
+        super().__init__(entry_points=[], states={}, fallbacks=[])
+        self.callback = callback
+
+    def check_update(self, update):
+        self.current = update.update_id
+        time.sleep(0.01)
+
+        return True
+
+    def handle_update(self, update, dispatcher):
+        return self.callback(self.current, update)
+
+
+class TestAioModule(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_proxy_runs_methods_off_the_loop(self):
+        proxy = AsyncProxy(SimpleNamespace(name='storage', current_thread=threading.current_thread))
+
+        thread = self.loop.run_until_complete(proxy.current_thread())
+
+        self.assertEqual(proxy.name, 'storage')
+        self.assertIsNot(thread, threading.current_thread())
+
+    def test_webhook_is_removed_before_polling(self):
+        calls = []
+        polling = AsyncPolling(SimpleNamespace(bot=None))
+
+        def get_updates(offset=None, timeout=None):
+            calls.append('getUpdates')
+            polling.stop()
+            return []
+
+        polling.bot = AsyncProxy(SimpleNamespace(deleteWebhook=lambda: calls.append('deleteWebhook'),
+                                                 getUpdates=get_updates))
+        self.loop.run_until_complete(polling.run())
+
+        self.assertEqual(calls, ['deleteWebhook', 'getUpdates'])
+
+    def test_coroutine_and_blocking_handlers(self):
+        calls = []
+
+        async def coroutine(bot, update):
+            calls.append(('coroutine', update, threading.current_thread()))
+
+        def blocking(bot, update):
+            calls.append(('blocking', update, threading.current_thread()))
+
+        dispatcher = SimpleNamespace(bot=None, groups=[0, 1],
+                                     handlers={0: [Handler(coroutine)], 1: [Handler(blocking)]})
+        polling = AsyncPolling(dispatcher)
+        update = Update(1)
+
+        async def process():
+            polling.semaphore = asyncio.Semaphore(1)
+            await polling.semaphore.acquire()
+            await polling.process_update(update)
+
+            return polling.semaphore.locked()
+
+        self.assertFalse(self.loop.run_until_complete(process()))
+        self.assertEqual([(name, update) for (name, update, thread) in calls],
+                         [('coroutine', update), ('blocking', update)])
+        self.assertIs(calls[0][2], threading.current_thread())
+        self.assertIsNot(calls[1][2], threading.current_thread())
+        self.assertEqual(polling.senders, {})
+
+    def test_blocking_handlers_run_at_once_for_different_senders(self):
+        together = threading.Barrier(2, timeout=2)
+        met = []
+        dispatcher = SimpleNamespace(bot=None, groups=[0], handlers={0: [Handler(lambda bot, update: met.append(
+            together.wait()))]})
+        polling = AsyncPolling(dispatcher, ThreadPoolExecutor(2))
+        updates = [Update.de_json({'update_id': user_id,
+                                   'message': {'message_id': user_id, 'date': 0, 'text': '/reminder',
+                                               'from': {'id': user_id, 'first_name': 'user'},
+                                               'chat': {'id': user_id, 'type': 'private'}}}, None)
+                   for user_id in (1, 2)]
+
+        async def process():
+            polling.semaphore = asyncio.Semaphore(2)
+            for _ in updates:
+                await polling.semaphore.acquire()
+            await asyncio.gather(*[polling.process_update(update) for update in updates])
+
+        self.loop.run_until_complete(process())
+
+        self.assertEqual(sorted(met), [0, 1])
+
+    def test_conversations_handle_the_update_they_checked(self):
+        handled = []
+        dispatcher = SimpleNamespace(bot=None, groups=[0],
+                                     handlers={0: [StatefulHandler(lambda current, update: handled.append(
+                                         (current, update.update_id)))]})
+        polling = AsyncPolling(dispatcher, ThreadPoolExecutor(8))
+        updates = [Update.de_json({'update_id': update_id,
+                                   'message': {'message_id': update_id, 'date': 0, 'text': 'hi',
+                                               'from': {'id': update_id % 2, 'first_name': 'user'},
+                                               'chat': {'id': update_id % 2, 'type': 'private'}}}, None)
+                   for update_id in range(1, 11)]
+
+        async def process():
+            polling.semaphore = asyncio.Semaphore(10)
+            for _ in updates:
+                await polling.semaphore.acquire()
+            await asyncio.gather(*[polling.process_update(update) for update in updates])
+
+        self.loop.run_until_complete(process())
+
+        self.assertEqual([current for (current, update_id) in handled], [update_id for (_, update_id) in handled])
+        # Every sender in the order its updates came
+        for sender in (0, 1):
+            self.assertEqual([update_id for (_, update_id) in handled if update_id % 2 == sender],
+                             list(range(2 - sender, 11, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
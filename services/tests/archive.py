@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+from services.archive import Archive
+
+
+class TestArchiveModule(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'archive.gz')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_documents_are_read_back_by_id(self):
+        archive = Archive(self.path)
+        archive.append({1: {'title': 'One'}, 3: {'title': 'Three'}})
+        archive.append({2: {'title': 'Two'}})
+
+        archive = Archive(self.path)
+
+        self.assertEqual(len(archive), 3)
+        self.assertEqual(archive.get(3), {'title': 'Three'})
+        self.assertEqual(archive.get(3).eid, 3)
+        self.assertEqual(archive.get(2), {'title': 'Two'})
+        self.assertIsNone(archive.get(4))
+
+    def test_torn_index_entry_is_discarded(self):
+        archive = Archive(self.path)
+        archive.append({1: {'title': 'One'}})
+
+        with open(self.path + '.index', 'a') as index:
+            index.write('{"offset": ')
+
+        archive = Archive(self.path)
+
+        self.assertEqual(archive.get(1), {'title': 'One'})
+        self.assertEqual(len(archive), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
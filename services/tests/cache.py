@@ -0,0 +1,48 @@
+import unittest
+
+from services.cache import TaggedCache
+
+
+class TestCacheModule(unittest.TestCase):
+    def test_invalidate_drops_only_tagged_entries(self):
+        cache = TaggedCache()
+        cache.put('a', 1, tags=('title', ('user_id', 1)))
+        cache.put('b', 2, tags=(('user_id', 2),))
+
+        cache.invalidate(('user_id', 1))
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+        self.assertNotIn('title', cache.tags)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TaggedCache(capacity=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_expired_entries_are_misses(self):
+        cache = TaggedCache(ttl=0)
+        cache.put('a', 1)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_stats_count_hits_and_misses(self):
+        cache = TaggedCache()
+        cache.put('a', 1)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+
+        self.assertEqual(cache.stats(), {'size': 1, 'hits': 2, 'misses': 1, 'hit_ratio': 2 / 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
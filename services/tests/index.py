@@ -0,0 +1,88 @@
+import threading
+import unittest
+
+from services.index import HashIndex, SortedIndex, TextIndex
+
+
+class TestIndexModule(unittest.TestCase):
+    def test_hash_index_add_and_discard(self):
+        index = HashIndex(lambda d: (d['user_id'], d['draft']))
+        index.add(1, {'user_id': 10, 'draft': True})
+        index.add(2, {'user_id': 10, 'draft': True})
+        index.add(3, {'user_id': 10, 'draft': False})
+
+        self.assertEqual(index.find((10, True)), {1, 2})
+
+        index.discard(1, {'user_id': 10, 'draft': True})
+        index.discard(2, {'user_id': 10, 'draft': True})
+
+        self.assertEqual(index.find((10, True)), frozenset())
+        self.assertEqual(index.count((10, False)), 1)
+        self.assertNotIn((10, True), index.entries)
+
+    def test_sorted_index_range(self):
+        index = SortedIndex(lambda d: d['datetime'])
+        for (eid, value) in ((1, 30.0), (2, 10.0), (3, None), (4, 20.0), (5, 20.0)):
+            index.add(eid, {'datetime': value})
+
+        self.assertEqual(index.range(), [2, 4, 5, 1])
+        self.assertEqual(index.range(low=10.0), [4, 5, 1])
+        self.assertEqual(index.range(high=30.0), [2, 4, 5])
+        self.assertEqual(index.count(low=10.0, high=30.0), 2)
+
+        index.discard(4, {'datetime': 20.0})
+
+        self.assertEqual(index.range(low=10.0, high=30.0), [5])
+
+    def test_text_index_ranks_case_insensitive_matches(self):
+        index = TextIndex({'title': 2, 'description': 1}, grams=('title',), scan_threshold=1)
+        index.add(1, {'title': 'Beer night', 'description': 'At the Pub'})
+        index.add(2, {'title': 'Pub quiz', 'description': ''})
+        index.add(3, {'title': 'Republic day', 'description': 'Public holiday'})
+        index.add(4, {'title': 'pub', 'description': None})
+
+        self.assertEqual(index.search('PUB'), [4, 2, 3, 1])
+        self.assertEqual(index.search('pu'), [2, 3, 4, 1])
+        self.assertEqual(index.search('quiz pub'), [2])
+        self.assertEqual(index.search('pub', within=frozenset({1, 3})), [3, 1])
+        self.assertEqual(index.search('quiz', within=frozenset({2})), [2])
+        self.assertEqual(index.search('quiz', within=frozenset({1})), [])
+        self.assertEqual(index.search(''), [1, 2, 3, 4])
+        self.assertEqual(index.search('pub', limit=2), [4, 2])
+        self.assertEqual(index.search('', within=frozenset({3, 1, 2}), limit=2), [1, 2])
+
+        index.discard(2, {})
+
+        self.assertEqual(index.search('quiz'), [])
+        self.assertNotIn('quiz', index.vocabulary)
+
+    def test_text_index_is_searched_while_written(self):
+        index = TextIndex({'title': 1}, grams=('title',), scan_threshold=2)
+        index.add(1, {'title': 'Pub quiz'})
+
+        self.assertEqual(index.search('pub', within=frozenset({1, 2})), [1])
+
+        errors = []
+
+        def search():
+            try:
+                for _ in range(2000):
+                    index.search('p')
+                    index.search('pub')
+            except Exception as error:
+                errors.append(error)
+
+        reader = threading.Thread(target=search)
+        reader.start()
+        while reader.is_alive():
+            for eid in range(2, 50):
+                index.add(eid, {'title': 'pub{} party{}'.format(eid, eid)})
+            for eid in range(2, 50):
+                index.discard(eid, {})
+        reader.join()
+
+        self.assertEqual(errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
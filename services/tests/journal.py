@@ -0,0 +1,123 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from types import SimpleNamespace
+
+from services.journal import JournalDB
+
+
+class TestJournalModule(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'events.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_writes_are_replayed_at_startup(self):
+        db = JournalDB(self.path, default_table='events')
+        first = db.insert({'title': 'first', 'draft': True})
+        second = db.insert({'title': 'second', 'draft': True})
+        db.update({'draft': False}, eids=[first])
+        db.remove(eids=[second])
+        db.close()
+
+        db = JournalDB(self.path, default_table='events')
+
+        self.assertEqual(db.get(eid=first), {'title': 'first', 'draft': False})
+        self.assertIsNone(db.get(eid=second))
+        self.assertEqual(db.get(eid=first).eid, first)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_torn_record_is_discarded(self):
+        db = JournalDB(self.path, default_table='events')
+        eid = db.insert({'title': 'committed'})
+        db.close()
+
+        with open(db.journal_path, 'ab') as journal:
+            journal.write(b'0badc0de {"op":"update","eid":1,"fie')
+
+        db = JournalDB(self.path, default_table='events')
+        db.update({'title': 'after restart'}, eids=[eid])
+        db.close()
+
+        db = JournalDB(self.path, default_table='events')
+
+        self.assertEqual(db.get(eid=eid), {'title': 'after restart'})
+
+    def test_failed_commit_leaves_no_torn_record(self):
+        db = JournalDB(self.path, default_table='events')
+        first = db.insert({'title': 'first'})
+        journal = db.journal
+
+        def torn_write(data: bytes):
+            journal.write(data[:len(data) // 2])
+            journal.flush()
+            raise OSError('Disk full')
+
+        db.journal = SimpleNamespace(tell=journal.tell, write=torn_write, close=journal.close)
+
+        with self.assertRaises(OSError):
+            db.update({'title': 'lost'}, eids=[first])
+
+        second = db.insert({'title': 'second'})
+        db.close()
+
+        db = JournalDB(self.path, default_table='events')
+
+        self.assertEqual(db.get(eid=first), {'title': 'first'})
+        self.assertEqual(db.get(eid=second), {'title': 'second'})
+
+    def test_only_one_process_opens_the_db(self):
+        code = 'from services.journal import JournalDB; JournalDB({!r}).close()'.format(self.path)
+        other = [sys.executable, '-c', code]
+
+        db = JournalDB(self.path, default_table='events')
+        JournalDB(self.path, default_table='events').close()
+
+        self.assertIn(b'StorageInUseError', subprocess.run(other, stderr=subprocess.PIPE).stderr)
+
+        db.close()
+
+        self.assertEqual(subprocess.run(other).returncode, 0)
+
+    def test_compaction_writes_snapshot(self):
+        db = JournalDB(self.path, default_table='events', compact_threshold=3)
+        eids = db.insert_multiple([{'n': n} for n in range(5)])
+        db.compact()
+        db.update({'n': 42}, eids=[eids[0]])
+        db.close()
+
+        self.assertTrue(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(db.journal_path + '.old'))
+
+        db = JournalDB(self.path, default_table='events')
+
+        self.assertEqual(len(db), 5)
+        self.assertEqual(db.get(eid=eids[0]), {'n': 42})
+        self.assertEqual(db.records, 1)
+
+    def test_stream_reads_snapshot_and_journal_a_chunk_at_a_time(self):
+        db = JournalDB(self.path, default_table='events')
+        eids = db.insert_multiple([{'title': 'event "{}"'.format(n), 'tags': {'n': [n]}} for n in range(50)])
+        db.compact()
+        db.update({'title': 'updated'}, eids=[eids[3]])
+        db.remove(eids=[eids[4]])
+        new = db.insert({'title': 'new'})
+        db.close()
+
+        streamed = dict(JournalDB.stream(self.path, 'events', chunk_size=16))
+        db = JournalDB(self.path, default_table='events')
+
+        self.assertEqual(streamed, db.data)
+        self.assertEqual(streamed[eids[3]]['title'], 'updated')
+        self.assertNotIn(eids[4], streamed)
+        self.assertEqual(streamed[new], {'title': 'new'})
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import logging
+import queue
+import unittest
+
+from telegram.ext import CommandHandler, ConversationHandler
+from unittest_data_provider import data_provider
+
+from services import log
+from services.log import ContextQueueHandler, JsonFormatter, SamplingFilter
+
+
+class Update:
+    def __init__(self, update_id: int):
+        self.update_id = update_id
+
+
+class TestLogModule(unittest.TestCase):
+    def setUp(self):
+        self.records = queue.Queue(2)
+        self.handler = ContextQueueHandler(self.records)
+        self.logger = logging.getLogger('services.tests.log')
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_records_carry_the_update_and_the_handler(self):
+        def start(bot, update):
+            self.logger.info('Started by %s', 'someone')
+
+        conversation = ConversationHandler(entry_points=[CommandHandler('start', start)], states={}, fallbacks=[])
+        log.tag_handler(conversation, 'Module')
+        conversation.entry_points[0].callback(None, Update(42))
+        self.logger.info('Outside')
+
+        entry = json.loads(JsonFormatter().format(self.records.get_nowait()))
+        outside = json.loads(JsonFormatter().format(self.records.get_nowait()))
+
+        self.assertEqual(entry['message'], 'Started by someone')
+        self.assertEqual(entry['update_id'], 42)
+        self.assertEqual(entry['handler'], 'Module.start')
+        self.assertNotIn('update_id', outside)
+
+    def test_exceptions_are_formatted_before_queueing(self):
+        try:
+            raise ValueError(':(')
+        except ValueError:
+            self.logger.exception('Failed')
+
+        entry = json.loads(JsonFormatter().format(self.records.get_nowait()))
+
+        self.assertIn('ValueError: :(', entry['exception'])
+
+    def test_records_past_the_queue_size_are_dropped(self):
+        for n in range(3):
+            self.logger.info('Record %d', n)
+
+        self.assertEqual(self.records.qsize(), 2)
+        self.assertEqual(self.handler.dropped, 1)
+
+    def sampling_provider():
+        return (
+            ('telegram.bot', logging.DEBUG, False),
+            ('telegram.bot.request', logging.DEBUG, False),
+            ('telegram.bot', logging.INFO, True),
+            ('telegram', logging.DEBUG, True),
+            ('telegram.ext.dispatcher', logging.DEBUG, True),
+        )
+
+    @data_provider(sampling_provider)
+    def test_sampling_of_debug_records(self, name: str, level: int, kept: bool):
+        record = logging.LogRecord(name, level, __file__, 1, 'Message', None, None)
+
+        self.assertEqual(SamplingFilter({'telegram.bot': 0, 'telegram.ext': 1}).filter(record), kept)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import time
+import unittest
+
+from telegram.ext import CommandHandler, ConversationHandler
+
+from services import metrics
+from services.metrics import Registry
+from services.query import Query
+
+
+class Repository:
+    def find(self, key):
+        return key
+
+    def fail(self):
+        raise ValueError(':(')
+
+    def query(self, name: str) -> Query:
+        def ids(order: str, limit: int = None, offset: int = 0) -> list:
+            time.sleep(0.01)
+            return [1, 2]
+
+        return Query(ids, lambda ids: ids, ('id',), lambda: 2)
+
+
+class TestMetricsModule(unittest.TestCase):
+    def test_histogram_is_rendered_cumulative(self):
+        registry = Registry()
+        histogram = registry.histogram('latency_seconds', 'Latency', ('handler',))
+        histogram.observe(('a',), 0.0001)
+        histogram.observe(('a',), 0.003)
+        histogram.observe(('a',), 10)
+
+        text = registry.render()
+
+        self.assertIn('# TYPE marvin_latency_seconds histogram\n', text)
+        self.assertIn('marvin_latency_seconds_bucket{handler="a",le="0.001"} 1\n', text)
+        self.assertIn('marvin_latency_seconds_bucket{handler="a",le="0.005"} 2\n', text)
+        self.assertIn('marvin_latency_seconds_bucket{handler="a",le="+Inf"} 3\n', text)
+        self.assertIn('marvin_latency_seconds_count{handler="a"} 3\n', text)
+
+    def test_conversation_handlers_are_timed(self):
+        def start(bot, update):
+            return 1
+
+        async def answer(bot, update):
+            return 2
+
+        conversation = ConversationHandler(entry_points=[CommandHandler('start', start)],
+                                           states={1: [CommandHandler('answer', answer)]}, fallbacks=[])
+        metrics.instrument_handler(conversation, 'Module')
+
+        self.assertEqual(conversation.entry_points[0].callback(None, None), 1)
+        self.assertTrue(asyncio.iscoroutinefunction(conversation.states[1][0].callback))
+        self.assertEqual(asyncio.run(conversation.states[1][0].callback(None, None)), 2)
+        self.assertIn('marvin_handler_seconds_count{handler="Module.start"} 1\n', metrics.registry.render())
+        self.assertIn('marvin_handler_seconds_count{handler="Module.answer"} 1\n', metrics.registry.render())
+
+    def test_repository_operations_and_errors_are_counted(self):
+        repository = metrics.instrument_repository(Repository())
+
+        self.assertEqual(repository.find(7), 7)
+        self.assertRaises(ValueError, repository.fail)
+
+        text = metrics.registry.render()
+
+        self.assertIn('marvin_storage_seconds_count{repository="Repository",operation="find"} 1\n', text)
+        self.assertIn('marvin_storage_errors_total{repository="Repository",operation="fail"} 1\n', text)
+
+    def test_queries_are_timed_when_read(self):
+        repository = metrics.instrument_repository(Repository())
+        series = '{repository="Repository",operation="query"'
+
+        query = repository.query('party')
+
+        self.assertNotIn(series, metrics.registry.render())
+
+        self.assertEqual(list(query.limit(5)), [1, 2])
+        self.assertEqual(query.count(), 2)
+
+        text = metrics.registry.render()
+
+        self.assertIn('marvin_storage_seconds_count' + series + '} 2\n', text)
+        self.assertIn('marvin_storage_seconds_bucket' + series + ',le="0.005"} 1\n', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
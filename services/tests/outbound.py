@@ -0,0 +1,107 @@
+import threading
+import unittest
+
+from telegram.error import BadRequest, RetryAfter
+
+from services.outbound import EDIT, INTERACTIVE, REMINDER, SWEEP_INTERVAL, EditCoalescer, OutboundQueue
+
+
+class TestOutboundModule(unittest.TestCase):
+    def setUp(self):
+        self.outbound = OutboundQueue(global_rate=1000, chat_rate=1000, workers=1)
+
+    def tearDown(self):
+        self.outbound.stop()
+
+    def test_interactive_requests_go_before_reminders(self):
+        sent = []
+        started = threading.Event()
+        release = threading.Event()
+        done = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(2)
+
+        # Keep the only worker busy while the other requests are queued
+        self.outbound.put(None, REMINDER, block)
+        self.assertTrue(started.wait(2))
+
+        self.outbound.put(1, REMINDER, sent.append, 'reminder')
+        self.outbound.put(2, EDIT, sent.append, 'edit')
+        self.outbound.put(3, INTERACTIVE, sent.append, 'reply')
+        self.outbound.put(None, REMINDER, done.set)
+        release.set()
+
+        self.assertTrue(done.wait(2))
+        self.assertEqual(sent, ['reply', 'edit', 'reminder'])
+
+    def test_chat_budget_is_kept_while_over_the_global_one(self):
+        outbound = OutboundQueue(global_rate=0.001, chat_rate=0.001)
+        outbound.global_bucket.take()
+
+        self.assertGreater(outbound._wait(1), 0)
+        self.assertTrue(outbound.chat_buckets[1].full())
+
+    def test_refilled_chat_buckets_are_dropped(self):
+        outbound = OutboundQueue(global_rate=1000, chat_rate=1)
+        for chat_id in range(100):
+            outbound._wait(chat_id)
+
+        # Every chat but the first one has been quiet long enough
+        for bucket in list(outbound.chat_buckets.values())[1:]:
+            bucket.updated -= 1
+        outbound.swept -= SWEEP_INTERVAL
+        outbound._wait(100)
+
+        self.assertEqual(list(outbound.chat_buckets), [0, 100])
+
+    def test_flood_wait_is_retried(self):
+        done = threading.Event()
+        attempts = []
+
+        def send():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RetryAfter(0.01)
+            done.set()
+
+        self.outbound.put(1, INTERACTIVE, send)
+
+        self.assertTrue(done.wait(2))
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(self.outbound.stats()['retried'], 1)
+
+    def test_bad_request_is_not_retried(self):
+        done = threading.Event()
+
+        def send():
+            raise BadRequest('Message is not modified')
+
+        self.outbound.put(1, EDIT, send)
+        self.outbound.put(1, REMINDER, done.set)
+
+        self.assertTrue(done.wait(2))
+        self.outbound.stop()
+        self.assertEqual(self.outbound.stats(), {'depth': 0, 'sent': 1, 'retried': 0, 'failed': 1})
+
+    def test_coalescer_runs_only_the_last_edit(self):
+        coalescer = EditCoalescer(self.outbound, window=0.05)
+        done = threading.Event()
+        edits = []
+
+        def edit(n):
+            edits.append(n)
+            done.set()
+
+        for n in range(10):
+            coalescer.submit('message', 1, lambda n=n: edit(n))
+
+        self.assertTrue(done.wait(2))
+        coalescer.stop()
+
+        self.assertEqual(edits, [9])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import queue
+import unittest
+
+from types import SimpleNamespace
+
+from telegram import Update
+
+from services.processes import ProcessRouter, sender_key, serve, worker_of
+
+
+def worker(index, updates):
+    pass
+
+
+class Dispatcher:
+    bot = None
+
+    def __init__(self, fail: int = None):
+        self.updates = []
+        self.fail = fail
+
+    def process_update(self, update):
+        if update.update_id == self.fail:
+            raise ValueError('Handler failed')
+
+        self.updates.append(update.update_id)
+
+
+class TestProcessesModule(unittest.TestCase):
+    def setUp(self):
+        self.router = ProcessRouter(None, 4, worker)
+
+    @staticmethod
+    def update(update_id: int, user_id: int) -> Update:
+        return Update.de_json({'update_id': update_id,
+                               'message': {'message_id': update_id, 'date': 0, 'text': 'hi',
+                                           'from': {'id': user_id, 'first_name': 'user'},
+                                           'chat': {'id': user_id, 'type': 'private'}}}, None)
+
+    def test_worker_of(self):
+        self.assertEqual(worker_of(42, 4), worker_of(42, 4))
+        self.assertEqual(set(range(4)), {worker_of(key, 4) for key in range(100)})
+
+    def test_sender_key(self):
+        self.assertEqual(7, sender_key(self.update(1, 7)))
+        self.assertEqual(3, sender_key(Update(3)))
+
+    def test_process_update(self):
+        for update_id in range(1, 41):
+            self.router.process_update(self.update(update_id, update_id % 5))
+
+        received = {index: [updates.get(timeout=5)['update_id'] for _ in range(self.router.routed[index])]
+                    for (index, updates) in enumerate(self.router.queues)}
+
+        # Every update of a user in the same worker, in the order it came
+        for user_id in range(5):
+            sent = [update_id for update_id in range(1, 41) if update_id % 5 == user_id]
+            self.assertEqual(sent, [update_id for update_id in received[worker_of(user_id, 4)] if update_id in sent])
+
+        self.assertEqual(40, self.router.stats()['routed'])
+
+    def test_webhook_is_removed_before_polling(self):
+        calls = []
+
+        def get_updates(offset=None, timeout=None):
+            calls.append('getUpdates')
+            self.router.running = False
+            return []
+
+        self.router.bot = SimpleNamespace(deleteWebhook=lambda: calls.append('deleteWebhook'), getUpdates=get_updates)
+        self.router.poll()
+
+        self.assertEqual(calls, ['deleteWebhook', 'getUpdates'])
+
+    def test_serve(self):
+        updates = queue.Queue()
+        for update_id in range(1, 4):
+            updates.put(self.update(update_id, 1).to_dict())
+        updates.put(None)
+
+        dispatcher = Dispatcher(fail=2)
+        with self.assertLogs('services.processes', 'ERROR'):
+            serve(dispatcher, updates)
+
+        # A failing update doesn't stop the worker
+        self.assertEqual([1, 3], dispatcher.updates)
+
+
+if __name__ == '__main__':
+    unittest.main()
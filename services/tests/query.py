@@ -0,0 +1,50 @@
+import unittest
+
+from services.query import Query
+
+
+class TestQueryModule(unittest.TestCase):
+    def setUp(self):
+        self.loaded = []
+        self.matched = []
+
+    def ids(self, order: str, limit: int = None, offset: int = 0):
+        ids = range(1, 101) if order == 'id' else range(100, 0, -1)
+
+        for eid in list(ids)[offset:None if limit is None else offset + limit]:
+            self.matched.append(eid)
+            yield eid
+
+    def load(self, ids: list) -> list:
+        self.loaded.extend(ids)
+
+        return ['event {}'.format(eid) for eid in ids if eid % 10]
+
+    def query(self) -> Query:
+        return Query(self.ids, self.load, ('id', 'reversed'), batch_size=10)
+
+    def test_only_what_is_used_is_loaded(self):
+        events = iter(self.query().order_by('reversed').offset(5))
+
+        self.assertEqual([next(events) for _ in range(3)], ['event 95', 'event 94', 'event 93'])
+        self.assertEqual(self.loaded, list(range(95, 85, -1)))
+        self.assertEqual(len(self.matched), 10)
+
+    def test_queries_are_immutable(self):
+        query = self.query()
+        page = query.offset(10).limit(5)
+
+        self.assertEqual(list(page), ['event 11', 'event 12', 'event 13', 'event 14', 'event 15'])
+        self.assertEqual(len(list(query)), 90)
+        self.assertEqual(query.first(), 'event 1')
+        self.assertRaises(ValueError, query.order_by, 'datetime')
+
+    def test_count(self):
+        self.assertEqual(self.query().count(), 100)
+        self.assertEqual(self.query().offset(95).limit(10).count(), 5)
+        self.assertEqual(Query(self.ids, self.load, ('id',), lambda: 7).offset(5).count(), 2)
+        self.assertEqual(self.loaded, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
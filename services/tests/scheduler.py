@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+
+from services.scheduler import Scheduler
+
+
+class TestSchedulerModule(unittest.TestCase):
+    def test_keys_run_in_time_order(self):
+        done = threading.Event()
+        calls = []
+
+        def handler(keys):
+            calls.extend(keys)
+            if len(calls) == 3:
+                done.set()
+
+        scheduler = Scheduler(handler)
+        now = time.time()
+        scheduler.schedule('third', now + 0.06)
+        scheduler.schedule('first', now)
+        scheduler.schedule('second', now + 0.03)
+
+        self.assertTrue(done.wait(2))
+        scheduler.stop()
+
+        self.assertEqual(calls, ['first', 'second', 'third'])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_cancelled_and_rescheduled_keys(self):
+        done = threading.Event()
+        calls = []
+
+        def handler(keys):
+            calls.extend(keys)
+            done.set()
+
+        scheduler = Scheduler(handler)
+        now = time.time()
+        scheduler.schedule('cancelled', now + 0.01)
+        scheduler.schedule('moved', now + 0.01)
+        scheduler.cancel('cancelled')
+        scheduler.schedule('moved', now + 0.05)
+
+        self.assertNotIn('cancelled', scheduler)
+        self.assertTrue(done.wait(2))
+        time.sleep(0.05)
+        scheduler.stop()
+
+        self.assertEqual(calls, ['moved'])
+
+    def test_keys_due_together_are_handled_together(self):
+        done = threading.Event()
+        batches = []
+
+        def handler(keys):
+            batches.append(sorted(keys))
+            if sum(len(batch) for batch in batches) == 5:
+                done.set()
+
+        scheduler = Scheduler(handler, batch_size=3)
+        when = time.time() + 0.05
+        for key in range(5):
+            scheduler.schedule(key, when)
+
+        self.assertTrue(done.wait(2))
+        scheduler.stop()
+
+        self.assertEqual(batches, [[0, 1, 2], [3, 4]])
+
+    def test_failed_keys_are_retried_later(self):
+        done = threading.Event()
+        calls = []
+
+        def handler(keys):
+            calls.append((sorted(keys), time.time()))
+            if len(calls) < 3:
+                raise ValueError('Storage unavailable')
+            done.set()
+
+        scheduler = Scheduler(handler, retry_delay=0.02)
+        start = time.time()
+        scheduler.schedule('first', start)
+        scheduler.schedule('second', start)
+
+        with self.assertLogs('services.scheduler', 'ERROR'):
+            self.assertTrue(done.wait(2))
+        scheduler.stop()
+
+        self.assertEqual([keys for (keys, when) in calls], [['first', 'second']] * 3)
+        # Waiting twice as long after the second failure
+        self.assertGreaterEqual(calls[2][1] - calls[1][1], 0.04)
+        self.assertEqual(scheduler.failures, {})
+        self.assertEqual(len(scheduler), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
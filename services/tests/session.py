@@ -0,0 +1,44 @@
+import os
+import tempfile
+import time
+import unittest
+
+from services.session import SessionStore
+
+
+class TestSessionModule(unittest.TestCase):
+    def test_least_recently_used_sessions_are_dropped(self):
+        store = SessionStore(capacity=2)
+        store.put(1, 'first')
+        store.put(2, 'second')
+        store.get(1)
+        store.put(3, 'third')
+
+        self.assertEqual(sorted(store.items()), [(1, 'first'), (3, 'third')])
+        self.assertEqual(store.pop(1), 'first')
+        self.assertIsNone(store.get(1))
+
+    def test_expired_sessions_are_dropped(self):
+        store = SessionStore(ttl=0.01)
+        store.put(1, 'first')
+        time.sleep(0.02)
+
+        self.assertIsNone(store.get(1))
+        self.assertEqual(len(store), 0)
+
+    def test_checkpoint_is_restored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sessions.json')
+            store = SessionStore(path=path, encode=lambda value: [value], decode=lambda value: tuple(value))
+            store.put(1, 'first')
+            store.put(2, 'second')
+            store.pop(2)
+            store.close()
+
+            store = SessionStore(path=path, encode=lambda value: [value], decode=lambda value: tuple(value))
+
+            self.assertEqual(store.items(), [(1, ('first',))])
+
+
+if __name__ == '__main__':
+    unittest.main()
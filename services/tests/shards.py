@@ -0,0 +1,89 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from services.journal import JournalDB
+from services.shards import ShardedDB
+
+
+class TestShardsModule(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'events.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_documents_are_partitioned_by_key_and_found_by_id(self):
+        db = ShardedDB(self.path, 4, 'user_id', default_table='events')
+        eids = [db.insert({'user_id': user_id, 'title': str(user_id)}) for user_id in range(20)]
+        db.update({'title': 'updated'}, eids=[eids[3]])
+        db.remove(eids=[eids[5]])
+        db.close()
+
+        db = ShardedDB(self.path, 4, 'user_id', default_table='events')
+
+        self.assertEqual(len(eids), len(set(eids)))
+        self.assertEqual(len(db), 19)
+        self.assertEqual(db.get(eid=eids[3]), {'user_id': 3, 'title': 'updated'})
+        self.assertIsNone(db.get(eid=eids[5]))
+        self.assertEqual(db.get(eid=eids[7]).eid, eids[7])
+        self.assertGreater(db.insert({'user_id': 1}), max(eids))
+        for (n, shard) in enumerate(db.shards):
+            self.assertEqual({db.shard_of(document) for document in shard.data.values()}, {n})
+
+    def test_unsharded_db_is_moved_into_the_shards(self):
+        single = JournalDB(self.path, default_table='events')
+        eids = single.insert_multiple([{'user_id': user_id} for user_id in range(10)])
+        single.close()
+
+        db = ShardedDB(self.path, 3, 'user_id', default_table='events')
+
+        self.assertEqual([db.get(eid=eid)['user_id'] for eid in eids], list(range(10)))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(single.journal_path))
+        self.assertEqual(db.insert({'user_id': 1}), 11)
+
+    def test_shards_beyond_the_count_are_still_read(self):
+        db = ShardedDB(self.path, 4, 'user_id', default_table='events')
+        eids = db.insert_multiple([{'user_id': user_id} for user_id in range(10)])
+        db.close()
+
+        db = ShardedDB(self.path, 2, 'user_id', default_table='events')
+
+        self.assertEqual(len(db.shards), 4)
+        self.assertEqual([db.get(eid=eid)['user_id'] for eid in eids], list(range(10)))
+        self.assertLess(db.shard_of(db.get(eid=db.insert({'user_id': 12}))), 2)
+
+    def test_concurrent_inserts_get_distinct_ids(self):
+        db = ShardedDB(self.path, 4, 'user_id', default_table='events', sync=False)
+        eids = []
+
+        def insert(user_id: int):
+            for _ in range(50):
+                eids.append(db.insert({'user_id': user_id}))
+
+        threads = [threading.Thread(target=insert, args=(user_id,)) for user_id in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(eids)), 400)
+        self.assertEqual(len(db), 400)
+
+    def test_insert_with_ids_replaces_across_shards(self):
+        db = ShardedDB(self.path, 4, 'user_id', default_table='events')
+        db.insert_multiple([{'user_id': 1}, {'user_id': 2}], [10, 20])
+        moved = next(user_id for user_id in range(3, 20)
+                     if db.shard_of({'user_id': user_id}) != db.shard_of({'user_id': 1}))
+        db.insert_multiple([{'user_id': moved}], [10])
+
+        self.assertEqual(len(db), 2)
+        self.assertEqual(db.get(eid=10), {'user_id': moved})
+        self.assertEqual(db.insert({'user_id': 3}), 21)
+
+
+if __name__ == '__main__':
+    unittest.main()
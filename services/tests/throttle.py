@@ -0,0 +1,28 @@
+import unittest
+
+from services.throttle import TokenBucket
+
+
+class TestThrottleModule(unittest.TestCase):
+    def test_token_bucket_allows_bursts_then_waits(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+
+    def test_tokens_given_back_can_be_taken_again(self):
+        bucket = TokenBucket(rate=0.001, capacity=1)
+
+        self.assertTrue(bucket.full())
+        self.assertEqual(bucket.take(), 0)
+        self.assertFalse(bucket.full())
+
+        bucket.give()
+
+        self.assertTrue(bucket.full())
+        self.assertEqual(bucket.take(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import http.client
+import json
+import threading
+import time
+import unittest
+
+from telegram import Update
+
+from services.webhook import WebhookServer
+
+
+class Dispatcher:
+    bot = None
+
+    def __init__(self):
+        self.updates = []
+        self.processed = threading.Event()
+        self.release = threading.Event()
+
+    def process_update(self, update):
+        self.release.wait(2)
+        self.updates.append(update.update_id)
+        self.processed.set()
+
+
+class TestWebhookModule(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = Dispatcher()
+        self.server = WebhookServer(self.dispatcher, port=0, path='/telegram', workers=1, queue_size=1)
+        threading.Thread(target=self.server.start, daemon=True).start()
+
+    def tearDown(self):
+        self.dispatcher.release.set()
+        self.server.stop()
+
+    def post(self, body: bytes, path: str = '/telegram') -> int:
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        connection.request('POST', path, body)
+        status = connection.getresponse().status
+        connection.close()
+
+        return status
+
+    @staticmethod
+    def update(update_id: int) -> bytes:
+        return json.dumps({'update_id': update_id}).encode('utf-8')
+
+    def test_updates_reach_the_dispatcher(self):
+        self.dispatcher.release.set()
+
+        self.assertEqual(self.post(self.update(1)), 200)
+        self.assertTrue(self.dispatcher.processed.wait(2))
+        self.assertEqual(self.dispatcher.updates, [1])
+
+    def test_full_queue_is_refused(self):
+        # The worker holds the first update and the second one fills the queue
+        self.assertEqual(self.post(self.update(1)), 200)
+        while self.server.stats()['depth']:
+            time.sleep(0.001)
+        self.assertEqual(self.post(self.update(2)), 200)
+        self.assertEqual(self.post(self.update(3)), 503)
+
+        self.assertEqual(self.server.stats(), {'depth': 1, 'received': 2, 'refused': 1})
+
+    def test_updates_of_a_sender_are_handled_in_order(self):
+        self.dispatcher.release.set()
+        server = WebhookServer(self.dispatcher, port=0, path='/telegram', workers=4, queue_size=100)
+        for worker in server.workers:
+            worker.start()
+
+        for update_id in range(1, 21):
+            server.enqueue(Update.de_json({'update_id': update_id,
+                                           'message': {'message_id': update_id, 'date': 0, 'text': 'hi',
+                                                       'from': {'id': update_id % 3, 'first_name': 'user'},
+                                                       'chat': {'id': update_id % 3, 'type': 'private'}}}, None))
+
+        for updates in server.queues:
+            updates.put(None)
+        for worker in server.workers:
+            worker.join(2)
+        server.server_close()
+
+        for sender in range(3):
+            self.assertEqual([update_id for update_id in self.dispatcher.updates if update_id % 3 == sender],
+                             [update_id for update_id in range(1, 21) if update_id % 3 == sender])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post(self.update(1), '/other'), 404)
+        self.assertEqual(self.post(b'not json'), 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, tokens: float = 1) -> float:
+        """Take `tokens` if available and return 0, otherwise the seconds to wait for them"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+
+            return (tokens - self.tokens) / self.rate
+
+    def give(self, tokens: float = 1):
+        """Put back `tokens` taken for an operation that didn't happen"""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def full(self) -> bool:
+        """Whether it refilled completely, the same as a new bucket"""
+        with self.lock:
+            return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
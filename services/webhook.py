@@ -0,0 +1,158 @@
+import json
+import logging
+import queue
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ConversationHandler, Dispatcher
+
+from services.processes import sender_key, worker_of
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    """
+    Receives the updates POSTed by Telegram on `path` and hands them to
+    `workers` threads calling dispatcher.process_update, always the same
+    thread for the same sender, so that its updates are handled in order.
+    Once `queue_size` updates are waiting the following ones are refused
+    with 503, which Telegram sends again later: bursts wait upstream
+    instead of in memory
+    """
+
+    daemon_threads = True
+
+    def __init__(self, dispatcher: Dispatcher, listen: str = '127.0.0.1', port: int = 8443, path: str = '/',
+                 workers: int = 4, queue_size: int = 1000):
+        self.dispatcher = dispatcher
+        self.url_path = path
+        self.queues = [queue.Queue(max(queue_size // workers, 1)) for _ in range(workers)]
+        self.workers = [threading.Thread(target=self._work, args=(updates,), name='webhook-{}'.format(n), daemon=True)
+                        for (n, updates) in enumerate(self.queues)]
+        # A conversation keeps the update it checked until it handles it: one update at a time
+        self.conversation_locks = {}
+
+        self.received = 0
+        self.refused = 0
+        self.counters_lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+        super().__init__((listen, port), WebhookRequestHandler)
+
+    def start(self):
+        """Serve until stop() is called"""
+        for worker in self.workers:
+            worker.start()
+
+        self.serve_forever()
+
+    def stop(self):
+        self.shutdown()
+
+        for updates in self.queues:
+            updates.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        self.server_close()
+
+    def stats(self) -> dict:
+        return {
+            'depth': sum(updates.qsize() for updates in self.queues),
+            'received': self.received,
+            'refused': self.refused,
+        }
+
+    def enqueue(self, update: Update) -> bool:
+        """Queue `update` for the worker of its sender, False if its queue is full"""
+        try:
+            self.queues[worker_of(sender_key(update), len(self.queues))].put_nowait(update)
+        except queue.Full:
+            with self.counters_lock:
+                self.refused += 1
+            return False
+
+        with self.counters_lock:
+            self.received += 1
+        return True
+
+    def _work(self, updates: queue.Queue):
+        while True:
+            update = updates.get()
+
+            if update is None:
+                return
+
+            try:
+                if isinstance(self.dispatcher, Dispatcher):
+                    self._process_update(update)
+                else:
+                    self.dispatcher.process_update(update)
+            except Exception:
+                self.logger.exception('Update %s failed', update.update_id)
+
+    def _process_update(self, update: Update):
+        """Same as Dispatcher.process_update, checking and handling a conversation with no update in between"""
+        dispatcher = self.dispatcher
+
+        for group in dispatcher.groups:
+            for handler in dispatcher.handlers[group]:
+                try:
+                    if isinstance(handler, ConversationHandler):
+                        with self.conversation_locks.setdefault(handler, threading.Lock()):
+                            if not handler.check_update(update):
+                                continue
+                            handler.handle_update(update, dispatcher)
+                    elif handler.check_update(update):
+                        handler.handle_update(update, dispatcher)
+                    else:
+                        continue
+                    break
+                except TelegramError as te:
+                    self.logger.warning('A TelegramError was raised while processing the Update.')
+
+                    try:
+                        dispatcher.dispatch_error(update, te)
+                    except Exception:
+                        self.logger.exception('An uncaught error was raised while handling the error')
+                    break
+                except Exception:
+                    self.logger.exception('An uncaught error was raised while processing the update')
+                    break
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive: Telegram (and the load test) send many updates on the same connection
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.path != self.server.url_path:
+            self._respond(404, close=True)
+            return
+
+        try:
+            length = int(self.headers['Content-Length'])
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+            update = Update.de_json(data, self.server.dispatcher.bot)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            self._respond(400, close=True)
+            return
+
+        self._respond(200 if self.server.enqueue(update) else 503)
+
+    def _respond(self, status: int, close: bool = False):
+        # The body of a refused request may be left unread: the connection can't be reused
+        self.close_connection = close
+
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        if close:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format, *args)